@@ -0,0 +1,33 @@
+"""
+Benchmarks run against local stand-ins of 1C, Bitrix, Telegram and storages
+
+Settings are read when `cost_my_chemo_bot` is imported, so the defaults below
+are set before that: fake credentials, no throttling or Telegram pacing (they
+would measure configured limits, not our code) and a temporary lead outbox.
+Anything set in the environment wins.
+"""
+import os
+import tempfile
+
+BENCH_ENV = {
+    "ONCO_MEDCONSULT_API_LOGIN": "bench",
+    "ONCO_MEDCONSULT_API_PASSWORD": "bench",
+    "BITRIX_TOKEN": "bench",
+    "TELEGRAM_BOT_TOKEN": "123456:bench",
+    "BOT_MODE": "webhook",
+    # JSON storage settings require an existing file, storages are made here.
+    "STORAGE_TYPE": "redis",
+    "THROTTLE_RATE": "1e9",
+    "THROTTLE_BURST": "1e9",
+    "TELEGRAM_GLOBAL_RATE": "1e9",
+    "TELEGRAM_CHAT_RATE": "1e9",
+    "TELEGRAM_CHAT_BURST": "1e9",
+    "TRACING_SAMPLE_RATE": "0",
+    "LOG_LEVEL": "30",
+    # Leads go next to FSM states by default, that would be the configured redis.
+    "LEAD_OUTBOX_TYPE": "json",
+}
+
+for name, value in BENCH_ENV.items():
+    os.environ.setdefault(name, value)
+os.environ.setdefault("LEAD_OUTBOX_DIR", tempfile.mkdtemp(prefix="bench-outbox-"))
@@ -0,0 +1,471 @@
+"""
+Load generator for the conversation funnel
+
+Synthetic users go through the whole `Form` funnel concurrently, updates are
+fed to the dispatcher the way polling feeds them (update middlewares
+included). 1C, Bitrix, GCS, Telegram and storages are local stand-ins with
+optional injected latency and faults.
+
+    python -m benchmarks.funnel --users 500 --concurrency 50 --storage memory,json
+    python -m benchmarks.funnel --storage gcloud --gcs-faults 503:0.01,429:0.01
+"""
+import argparse
+import asyncio
+import dataclasses
+import itertools
+import json
+import os
+import pathlib
+import random
+import tempfile
+import time
+import typing
+
+import httpx
+from aiogram import Bot, Dispatcher, types
+
+from benchmarks.standins import (
+    NO_FAULTS,
+    BitrixStandIn,
+    Faults,
+    GcsStandIn,
+    Latency,
+    OneCStandIn,
+    StandInBot,
+    StandInServer,
+    StandInService,
+    StandInStorage,
+    install_http_standins,
+    make_backend,
+    make_catalog,
+)
+from cost_my_chemo_bot.bots.telegram import callback_data
+from cost_my_chemo_bot.bots.telegram.dispatcher import feed_update, make_dispatcher
+from cost_my_chemo_bot.bots.telegram.handlers import init_handlers
+from cost_my_chemo_bot.config import SETTINGS, BotMode
+from cost_my_chemo_bot.db import CATEGORY, COURSE, DB, NOSOLOGY, Course
+from cost_my_chemo_bot.outbox import LEAD_OUTBOX_WORKER
+
+_update_ids = itertools.count(1)
+
+
+def percentile(values: typing.Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `values`"""
+    if not values:
+        return float("nan")
+    rank = max(int(round(q / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(durations: list[float]) -> dict[str, float]:
+    values = sorted(durations)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else float("nan")) * 1000,
+    }
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def message_update(user_id: int, text: str) -> types.Update:
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(command)}
+        ]
+    return types.Update(update_id=next(_update_ids), message=message)
+
+
+def callback_update(user_id: int, data: str) -> types.Update:
+    return types.Update(
+        update_id=next(_update_ids),
+        callback_query={
+            "id": str(next(_update_ids)),
+            "chat_instance": str(user_id),
+            "data": data,
+            "from": _user(user_id),
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "bench"},
+                "text": "...",
+            },
+        },
+    )
+
+
+def funnel_steps(
+    user_id: int, rng: random.Random, courses: typing.Sequence[Course]
+) -> list[tuple[str, typing.Callable[[], types.Update]]]:
+    """
+    (step, update factory) pairs of one pass through the funnel
+
+    Callback data refers to the loaded catalog, so updates are made right
+    before they are sent.
+    """
+    course = rng.choice(courses)
+    nosology_id = next(
+        value
+        for value in (course.nosologyid1, course.nosologyid2, course.nosologyid3)
+        if value
+    )
+    return [
+        ("welcome", lambda: message_update(user_id, "/start")),
+        ("start", lambda: callback_update(user_id, "yes")),
+        ("height", lambda: message_update(user_id, str(rng.randint(150, 200)))),
+        ("weight", lambda: message_update(user_id, str(rng.randint(45, 120)))),
+        (
+            "category",
+            lambda: callback_update(
+                user_id, callback_data.encode(CATEGORY, course.categoryid)
+            ),
+        ),
+        (
+            "nosology",
+            lambda: callback_update(
+                user_id, callback_data.encode(NOSOLOGY, nosology_id)
+            ),
+        ),
+        (
+            "course",
+            lambda: callback_update(
+                user_id, callback_data.encode(COURSE, course.Courseid)
+            ),
+        ),
+        ("data_confirmation", lambda: callback_update(user_id, "yes")),
+        ("contacts_input", lambda: callback_update(user_id, "contacts_input")),
+        ("first_name", lambda: message_update(user_id, "Иван")),
+        ("last_name", lambda: message_update(user_id, "Иванов")),
+        ("email", lambda: message_update(user_id, f"user{user_id}@example.com")),
+        (
+            "phone_number",
+            lambda: message_update(user_id, f"+7 999 {user_id % 10_000_000:07}"),
+        ),
+        ("lead_confirmation", lambda: callback_update(user_id, "yes")),
+    ]
+
+
+async def load_catalog(attempts: int = 100) -> None:
+    """Initial catalog load, retried through injected 1C faults"""
+    for attempt in range(attempts):
+        try:
+            await DB().load_db()
+            return
+        except httpx.HTTPError:
+            if attempt + 1 == attempts:
+                raise
+
+
+@dataclasses.dataclass
+class RunResult:
+    storage: str
+    users: int
+    updates: int
+    errors: int
+    seconds: float
+    steps: dict[str, list[float]]
+    storage_calls: dict[str, list[float]]
+    leads_delivered: int
+    services: dict[str, dict[int, int]] = dataclasses.field(default_factory=dict)
+
+    def report(self) -> dict:
+        return {
+            "storage": self.storage,
+            "users": self.users,
+            "updates": self.updates,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "updates_per_second": self.updates / self.seconds if self.seconds else 0,
+            "funnels_per_second": self.users / self.seconds if self.seconds else 0,
+            "leads_delivered": self.leads_delivered,
+            "steps": {name: summarize(values) for name, values in self.steps.items()},
+            "storage_calls": {
+                name: summarize(values) for name, values in self.storage_calls.items()
+            },
+            "services": self.services,
+        }
+
+
+async def run_funnel(
+    storage_name: str,
+    users: int,
+    concurrency: int,
+    think_time: Latency,
+    storage_latency: Latency,
+    telegram_latency: Latency,
+    json_path: str,
+    redis_url: str | None = None,
+    user_offset: int = 0,
+    seed: int = 0,
+    services: typing.Iterable[StandInService] = (),
+) -> RunResult:
+    backend = make_backend(storage_name, json_path=json_path, redis_url=redis_url)
+    storage = StandInStorage(backend, latency=storage_latency)
+    bot = StandInBot(latency=telegram_latency)
+    dp = make_dispatcher(bot, storage=storage)
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await load_catalog()
+    courses = DB().courses
+    init_handlers(dp)
+
+    steps: dict[str, list[float]] = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_user(user_id: int) -> None:
+        nonlocal errors
+        rng = random.Random(seed * 1_000_003 + user_id)
+        async with semaphore:
+            for step, make_update in funnel_steps(user_id, rng, courses):
+                await think_time.wait()
+                started = time.perf_counter()
+                try:
+                    await feed_update(dp, make_update())
+                except Exception:
+                    errors += 1
+                steps.setdefault(step, []).append(time.perf_counter() - started)
+
+    services = list(services)
+    for service in services:
+        service.statuses.clear()
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(run_user(user_offset + i + 1) for i in range(users)),
+    )
+    seconds = time.perf_counter() - started
+
+    leads_delivered = 0
+    while delivered := await LEAD_OUTBOX_WORKER.flush():
+        leads_delivered += delivered
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    session = await bot.get_session()
+    if session is not None:
+        await session.close()
+
+    return RunResult(
+        storage=storage_name,
+        users=users,
+        updates=sum(len(values) for values in steps.values()),
+        errors=errors,
+        seconds=seconds,
+        steps=steps,
+        storage_calls=dict(storage.durations),
+        leads_delivered=leads_delivered,
+        services={service.name: dict(service.statuses) for service in services},
+    )
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"storage={report['storage']} users={report['users']} "
+        f"updates={report['updates']} errors={report['errors']} "
+        f"seconds={report['seconds']:.2f} "
+        f"updates/s={report['updates_per_second']:.1f} "
+        f"funnels/s={report['funnels_per_second']:.1f} "
+        f"leads={report['leads_delivered']}",
+        f"  {'step':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'max ms':>10}",
+    ]
+    for title, rows in (("", report["steps"]), ("storage.", report["storage_calls"])):
+        for name, row in rows.items():
+            lines.append(
+                f"  {title + name:<24}{row['count']:>8}{row['p50_ms']:>10.2f}"
+                f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}"
+            )
+    for name, statuses in report.get("services", {}).items():
+        answers = " ".join(
+            f"{status}={count}" for status, count in sorted(statuses.items())
+        )
+        lines.append(f"  {name} answers: {answers or '-'}")
+    return "\n".join(lines)
+
+
+def parse_latency(value: str) -> Latency:
+    """
+    "0.05" or "0.05+0.02" for 50ms plus up to 20ms of jitter,
+    "0.05+0.02~exponential" or "~lognormal" for other jitter distributions
+    """
+    value, _, distribution = value.partition("~")
+    base, _, jitter = value.partition("+")
+    try:
+        return Latency(float(base), float(jitter or 0), distribution or "uniform")
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_faults(value: str) -> Faults:
+    """
+    "503:0.01,429:0.05" for 1% of 503 and 5% of 429 answers,
+    "hang:0.001:30" holds 0.1% of requests for 30 seconds
+    """
+    rates = {}
+    hang_rate, hang = 0.0, 60.0
+    for item in filter(None, value.split(",")):
+        kind, _, rest = item.partition(":")
+        rate, _, seconds = rest.partition(":")
+        try:
+            if kind == "hang":
+                hang_rate, hang = float(rate), float(seconds or hang)
+            else:
+                rates[int(kind)] = float(rate)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"bad fault: {item}")
+    try:
+        return Faults(rates, hang_rate=hang_rate, hang=hang)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def add_standin_arguments(parser: argparse.ArgumentParser) -> None:
+    latency_help = (
+        "seconds, optionally +jitter and ~distribution, e.g. 0.05+0.02~lognormal"
+    )
+    faults_help = "status:rate pairs and hang:rate:seconds, e.g. 503:0.01,hang:0.001:30"
+    for service in ("onec", "bitrix", "gcs"):
+        parser.add_argument(
+            f"--{service}-latency",
+            type=parse_latency,
+            default=Latency(),
+            help=latency_help,
+        )
+        parser.add_argument(
+            f"--{service}-faults",
+            type=parse_faults,
+            default=NO_FAULTS,
+            help=faults_help,
+        )
+    parser.add_argument(
+        "--bitrix-command-errors",
+        type=float,
+        default=0,
+        help="share of batch commands failing inside a successful answer",
+    )
+    parser.add_argument(
+        "--gcs-write-interval",
+        type=float,
+        default=0,
+        help="seconds between writes to one object before GCS answers 429",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="serve stand-ins over local HTTP, so client timeouts apply; "
+        "always on for the gcloud backend",
+    )
+    parser.add_argument(
+        "--telegram-latency", type=parse_latency, default=Latency(), help=latency_help
+    )
+    parser.add_argument(
+        "--storage-latency", type=parse_latency, default=Latency(), help=latency_help
+    )
+
+
+async def start_standins(
+    args: argparse.Namespace, catalog: dict[str, list[dict]], serve: bool
+) -> tuple[list[StandInService], StandInServer | None]:
+    """Install 1C and Bitrix stand-ins, start the server with GCS if `serve`"""
+    onec = OneCStandIn(catalog, latency=args.onec_latency, faults=args.onec_faults)
+    bitrix = BitrixStandIn(
+        command_error_rate=args.bitrix_command_errors,
+        latency=args.bitrix_latency,
+        faults=args.bitrix_faults,
+    )
+    services: list[StandInService] = [onec, bitrix]
+    server = None
+    if serve or args.serve:
+        gcs = GcsStandIn(
+            min_write_interval=args.gcs_write_interval,
+            latency=args.gcs_latency,
+            faults=args.gcs_faults,
+        )
+        services.append(gcs)
+        server = StandInServer(onec=onec, bitrix=bitrix, gcs=gcs)
+        await server.start()
+        os.environ["STORAGE_EMULATOR_HOST"] = server.address
+    install_http_standins(onec, bitrix, server=server)
+    return services, server
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--storage",
+        default="memory,json",
+        help="comma separated backends: memory, json, redis, gcloud",
+    )
+    parser.add_argument("--redis-url", help="redis://host:port/db for redis backend")
+    parser.add_argument("--mode", choices=[mode.value for mode in BotMode])
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--nosologies", type=int, default=20)
+    parser.add_argument(
+        "--think-time", type=parse_latency, default=Latency(), help="like latencies"
+    )
+    add_standin_arguments(parser)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=pathlib.Path, help="write the report here")
+    return parser
+
+
+async def main(args: argparse.Namespace) -> list[dict]:
+    if args.mode is not None:
+        SETTINGS.BOT_MODE = BotMode(args.mode)
+    catalog = make_catalog(
+        courses=args.courses,
+        categories=args.categories,
+        nosologies=args.nosologies,
+        seed=args.seed,
+    )
+    storage_names = args.storage.split(",")
+    services, server = await start_standins(
+        args, catalog, serve="gcloud" in storage_names
+    )
+
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i, storage_name in enumerate(storage_names):
+            result = await run_funnel(
+                storage_name,
+                users=args.users,
+                concurrency=args.concurrency,
+                think_time=args.think_time,
+                storage_latency=args.storage_latency,
+                telegram_latency=args.telegram_latency,
+                json_path=str(pathlib.Path(directory) / f"{storage_name}.json"),
+                redis_url=args.redis_url,
+                # Fresh users for every backend.
+                user_offset=i * args.users,
+                seed=args.seed,
+                services=services,
+            )
+            report = result.report()
+            print(format_report(report))
+            reports.append(report)
+
+    await DB.close()
+    if server is not None:
+        await server.close()
+    if args.json is not None:
+        args.json.write_text(json.dumps(reports, indent=2))
+    return reports
+
+
+if __name__ == "__main__":
+    asyncio.run(main(make_parser().parse_args()))
@@ -0,0 +1,386 @@
+"""
+Microbenchmarks of catalog and rendering hot paths with a regression gate
+
+    python -m benchmarks.micro run --output baseline.json
+    python -m benchmarks.micro run --compare baseline.json --threshold 0.2
+    python -m benchmarks.micro compare baseline.json current.json
+
+Sized benchmarks run against synthetic catalogs of every `--sizes` courses.
+`compare` exits with 1 when any benchmark got slower than the baseline by
+more than `--threshold`.
+"""
+import argparse
+import asyncio
+import datetime
+import inspect
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import time
+import typing
+
+from aiogram import Bot, Dispatcher
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+
+from benchmarks.funnel import message_update
+from benchmarks.standins import (
+    BitrixStandIn,
+    OneCStandIn,
+    StandInBot,
+    install_http_standins,
+    make_catalog,
+)
+from cost_my_chemo_bot import context
+from cost_my_chemo_bot.bots.telegram import dispatcher
+from cost_my_chemo_bot.bots.telegram.dispatcher import make_dispatcher
+from cost_my_chemo_bot.bots.telegram.keyboard import Buttons, get_keyboard_markup
+from cost_my_chemo_bot.bots.telegram.state import StateData, parse_state
+from cost_my_chemo_bot.db import COURSE, DB, Course, parse_catalog, parse_catalog_chunk
+from cost_my_chemo_bot.jsonstream import JSONArrayStream
+
+SIZES = (100, 1_000, 10_000, 100_000)
+
+Callable = typing.Callable[[], typing.Any]
+Setup = typing.Callable[[int | None], typing.Awaitable[Callable]]
+
+
+class Benchmark(typing.NamedTuple):
+    name: str
+    setup: Setup
+    sized: bool
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, sized: bool = True):
+    """Register `setup`, it prepares the state and returns the measured call"""
+
+    def decorator(setup: Setup) -> Setup:
+        BENCHMARKS.append(Benchmark(name=name, setup=setup, sized=sized))
+        return setup
+
+    return decorator
+
+
+async def _time_loops(func: Callable, loops: int, is_async: bool) -> float:
+    if is_async:
+        started = time.perf_counter()
+        for _ in range(loops):
+            await func()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return time.perf_counter() - started
+
+
+async def measure(func: Callable, min_time: float = 0.1, repeat: int = 5) -> dict:
+    """Seconds per call, loops are grown until one repeat takes `min_time`"""
+    # Warm up caches and tell coroutines from plain results.
+    result = func()
+    is_async = inspect.isawaitable(result)
+    if is_async:
+        await result
+
+    loops = 1
+    while True:
+        elapsed = await _time_loops(func, loops, is_async)
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        timings.append(await _time_loops(func, loops, is_async) / loops)
+    return {
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "loops": loops,
+        "repeat": repeat,
+    }
+
+
+def _catalog_rows(size: int) -> list[dict]:
+    return make_catalog(courses=size, nosologies=max(20, size // 50))["Course"]
+
+
+async def _load_catalog(size: int) -> DB:
+    catalog = make_catalog(courses=size, nosologies=max(20, size // 50))
+    await DB.client.aclose()
+    install_http_standins(OneCStandIn(catalog), BitrixStandIn())
+    database = DB()
+    await database.load_db()
+    return database
+
+
+def _last_course(database: DB) -> Course:
+    return database.courses[-1]
+
+
+async def _state(data: dict) -> FSMContext:
+    storage = MemoryStorage()
+    await storage.set_data(chat=1, user=1, data=data)
+    return FSMContext(storage=storage, chat=1, user=1)
+
+
+def _funnel_data(database: DB) -> dict:
+    course = _last_course(database)
+    return {
+        "height": 180,
+        "weight": 80,
+        "category_id": course.categoryid,
+        "nosology_id": course.nosologyid1,
+        "course_id": course.Courseid,
+        "course_name": course.Course,
+    }
+
+
+@benchmark("parse_courses")
+async def bench_parse_courses(size: int) -> Callable:
+    rows = _catalog_rows(size)
+    header = list(rows[0])
+    values = [header] + [
+        [
+            str(int(value)) if isinstance(value, bool) else value
+            for value in row.values()
+        ]
+        for row in rows
+    ]
+    return lambda: DB.parse_courses(values)
+
+
+@benchmark("course_validation")
+async def bench_course_validation(size: int) -> Callable:
+    rows = _catalog_rows(size)
+    return lambda: [Course(**row) for row in rows]
+
+
+@benchmark("parse_catalog")
+async def bench_parse_catalog(size: int) -> Callable:
+    body = json.dumps({"result": _catalog_rows(size)}).encode()
+    return lambda: parse_catalog(Course, body)
+
+
+@benchmark("parse_catalog_stream")
+async def bench_parse_catalog_stream(size: int) -> Callable:
+    body = json.dumps({"result": _catalog_rows(size)}).encode()
+    # About what a socket read returns.
+    chunks = [body[i : i + 65536] for i in range(0, len(body), 65536)]
+
+    def parse():
+        decoder = JSONArrayStream("result")
+        items = []
+        for chunk in chunks:
+            items.extend(parse_catalog_chunk(decoder, Course, chunk))
+        decoder.close()
+        return items
+
+    return parse
+
+
+@benchmark("find_courses")
+async def bench_find_courses(size: int) -> Callable:
+    # Outside of an update the catalog is reloaded on every call.
+    database = await _load_catalog(size)
+    course = _last_course(database)
+    return lambda: database.find_courses(course.categoryid, course.nosologyid1)
+
+
+@benchmark("filter_courses")
+async def bench_filter_courses(size: int) -> Callable:
+    database = await _load_catalog(size)
+    course = _last_course(database)
+    return lambda: database.filter_courses(course.categoryid, course.nosologyid1)
+
+
+@benchmark("find_course_by_id")
+async def bench_find_course_by_id(size: int) -> Callable:
+    database = await _load_catalog(size)
+    course_id = _last_course(database).Courseid
+    return lambda: database.find_course_by_id(course_id)
+
+
+@benchmark("lookup_course")
+async def bench_lookup_course(size: int) -> Callable:
+    database = await _load_catalog(size)
+    course_id = _last_course(database).Courseid
+    return lambda: database.lookup(COURSE, course_id)
+
+
+@benchmark("course_price", sized=False)
+async def bench_course_price(size: None) -> Callable:
+    course = Course(**_catalog_rows(3)[1])
+    return lambda: course.price(bsa=1.9)
+
+
+@benchmark("state_bsa", sized=False)
+async def bench_state_bsa(size: None) -> Callable:
+    state_data = StateData(height=180, weight=80)
+    return lambda: state_data.bsa
+
+
+@benchmark("parse_state", sized=False)
+async def bench_parse_state(size: None) -> Callable:
+    state = await _state(
+        {"height": 180, "weight": 80, "email": "user@example.com", "first_name": "A"}
+    )
+    return lambda: parse_state(state)
+
+
+@benchmark("get_keyboard_markup", sized=False)
+async def bench_get_keyboard_markup(size: None) -> Callable:
+    buttons = [Buttons.YES.value, Buttons.NEED_CORRECTION.value] * 5
+    return lambda: get_keyboard_markup(buttons=buttons)
+
+
+async def _render_setup(size: int | None) -> tuple[DB, typing.Any]:
+    database = await _load_catalog(size or 100)
+    bot = StandInBot()
+    Bot.set_current(bot)
+    Dispatcher.set_current(make_dispatcher(bot, storage=MemoryStorage()))
+    # Renders of one update share the reloaded catalog.
+    context.begin_update()
+    return database, message_update(1, "bench").message
+
+
+@benchmark("send_welcome_message", sized=False)
+async def bench_send_welcome_message(size: None) -> Callable:
+    _, message = await _render_setup(size)
+    return lambda: dispatcher.send_welcome_message(message)
+
+
+@benchmark("send_category_message")
+async def bench_send_category_message(size: int) -> Callable:
+    _, message = await _render_setup(size)
+    return lambda: dispatcher.send_category_message(message)
+
+
+@benchmark("send_nosology_message")
+async def bench_send_nosology_message(size: int) -> Callable:
+    database, message = await _render_setup(size)
+    state = await _state(_funnel_data(database))
+    return lambda: dispatcher.send_nosology_message(message, state=state)
+
+
+@benchmark("send_course_message")
+async def bench_send_course_message(size: int) -> Callable:
+    database, message = await _render_setup(size)
+    course = _last_course(database)
+    return lambda: dispatcher.send_course_message(
+        message, category_id=course.categoryid, nosology_id=course.nosologyid1
+    )
+
+
+@benchmark("send_data_confirmation_message")
+async def bench_send_data_confirmation_message(size: int) -> Callable:
+    database, message = await _render_setup(size)
+    state = await _state(_funnel_data(database))
+    return lambda: dispatcher.send_data_confirmation_message(message, state=state)
+
+
+@benchmark("send_lead_confirmation_message")
+async def bench_send_lead_confirmation_message(size: int) -> Callable:
+    database, message = await _render_setup(size)
+    data = _funnel_data(database)
+    data.update(
+        first_name="Иван",
+        last_name="Иванов",
+        email="user@example.com",
+        phone_number="+79991234567",
+    )
+    state = await _state(data)
+    return lambda: dispatcher.send_lead_confirmation_message(message, state=state)
+
+
+async def run(
+    sizes: typing.Sequence[int], pattern: str | None, min_time: float, repeat: int
+) -> dict:
+    results = {}
+    for item in BENCHMARKS:
+        for size in sizes if item.sized else (None,):
+            name = item.name if size is None else f"{item.name}[{size}]"
+            if pattern is not None and pattern not in name:
+                continue
+            context.end_update()
+            func = await item.setup(size)
+            result = await measure(func, min_time=min_time, repeat=repeat)
+            context.end_update()
+            results[name] = result
+            print(f"{name:<44}{result['min_s'] * 1e6:>14.2f} us", flush=True)
+    await DB.close()
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    """Print the changes, return False if something regressed past threshold"""
+    ok = True
+    print(f"{'benchmark':<44}{'baseline us':>14}{'current us':>14}{'change':>10}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<44}{'-':>14}{result['min_s'] * 1e6:>14.2f}{'new':>10}")
+            continue
+        change = result["min_s"] / base["min_s"] - 1
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(
+            f"{name:<44}{base['min_s'] * 1e6:>14.2f}{result['min_s'] * 1e6:>14.2f}"
+            f"{change:>+10.1%}{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=SIZES,
+    )
+    run_parser.add_argument("--filter", help="run benchmarks with this in the name")
+    run_parser.add_argument("--min-time", type=float, default=0.1)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--output", type=pathlib.Path)
+    run_parser.add_argument("--compare", type=pathlib.Path, help="baseline file")
+    run_parser.add_argument("--threshold", type=float, default=0.2)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline", type=pathlib.Path)
+    compare_parser.add_argument("current", type=pathlib.Path)
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+    return parser
+
+
+def main() -> int:
+    args = make_parser().parse_args()
+    if args.command == "compare":
+        baseline = json.loads(args.baseline.read_text())
+        current = json.loads(args.current.read_text())
+        return 0 if compare(baseline, current, args.threshold) else 1
+
+    current = asyncio.run(run(args.sizes, args.filter, args.min_time, args.repeat))
+    if args.output is not None:
+        args.output.write_text(json.dumps(current, indent=2))
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        return 0 if compare(baseline, current, args.threshold) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Deterministic replay of recorded updates, see `UpdateRecorder`
+
+    python -m benchmarks.replay run recordings/ --speed 10 --output a.json
+    python -m benchmarks.replay compare a.json b.json
+
+Updates of one user are fed in recorded order, users run concurrently.
+`--speed 1` keeps recorded timing, `--speed N` compresses it N times and
+`--speed max` sends every update as soon as the previous one of its user is
+done. Backends are local stand-ins. Callback data refers to the catalog
+version, pass the recorded catalog (1C responses by action) with `--catalog`
+for buttons to resolve the same way.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import pathlib
+import sys
+import time
+
+from aiogram import Bot, Dispatcher, types
+
+from benchmarks.funnel import (
+    add_standin_arguments,
+    load_catalog,
+    start_standins,
+    summarize,
+)
+from benchmarks.standins import (
+    Latency,
+    StandInBot,
+    StandInStorage,
+    make_backend,
+    make_catalog,
+)
+from cost_my_chemo_bot.bots.telegram.dispatcher import feed_update, make_dispatcher
+from cost_my_chemo_bot.bots.telegram.handlers import init_handlers
+from cost_my_chemo_bot.bots.telegram.throttling import get_update_address
+from cost_my_chemo_bot.db import DB
+
+
+def load_recording(paths: list[pathlib.Path]) -> list[dict]:
+    files = []
+    for path in paths:
+        files.extend(sorted(path.glob("*.jsonl.gz")) if path.is_dir() else [path])
+
+    records = []
+    for file in files:
+        with gzip.open(file, "rt", encoding="utf-8") as lines:
+            try:
+                for line in lines:
+                    records.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # The recording process died, its last file ends abruptly.
+                print(f"warning: {file} is truncated", file=sys.stderr)
+    records.sort(key=lambda record: record["t"])
+    for i, record in enumerate(records):
+        record["index"] = i
+    return records
+
+
+async def replay(
+    records: list[dict],
+    speed: float | None,
+    storage_name: str,
+    json_path: str,
+    storage_latency: Latency,
+    telegram_latency: Latency,
+) -> list[dict]:
+    storage = StandInStorage(
+        make_backend(storage_name, json_path=json_path), latency=storage_latency
+    )
+    bot = StandInBot(latency=telegram_latency)
+    dp = make_dispatcher(bot, storage=storage)
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await load_catalog()
+    init_handlers(dp)
+
+    versions = {record["catalog_version"] for record in records} - {None}
+    if versions and versions != {DB().index.version}:
+        print(
+            f"warning: recorded catalog versions {sorted(versions)}, "
+            f"replaying against {DB().index.version}",
+            file=sys.stderr,
+        )
+
+    by_user: dict[tuple[int, int] | None, list[dict]] = {}
+    for record in records:
+        update = types.Update(**record["update"])
+        by_user.setdefault(get_update_address(update), []).append(record)
+
+    results: list[dict] = []
+    started = time.perf_counter()
+
+    async def replay_user(address, user_records: list[dict]) -> None:
+        for record in user_records:
+            due = started + record["t"] / speed if speed else 0
+            lag = time.perf_counter() - due if speed else 0
+            if lag < 0:
+                await asyncio.sleep(-lag)
+                lag = 0
+
+            update_started = time.perf_counter()
+            error = None
+            try:
+                await feed_update(dp, types.Update(**record["update"]))
+            except Exception as e:
+                error = repr(e)
+            latency = time.perf_counter() - update_started
+
+            state_after = None
+            if address is not None:
+                chat, user = address
+                state_after = await dp.storage.get_state(chat=chat, user=user)
+            results.append(
+                {
+                    "index": record["index"],
+                    "update_id": record["update"]["update_id"],
+                    "state_before": record["state_before"],
+                    "state_after": state_after,
+                    "expected_state_after": record["state_after"],
+                    "latency_ms": latency * 1000,
+                    "recorded_ms": record["elapsed_ms"],
+                    "lag_ms": lag * 1000,
+                    "error": error,
+                }
+            )
+
+    await asyncio.gather(
+        *(replay_user(address, items) for address, items in by_user.items())
+    )
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    results.sort(key=lambda result: result["index"])
+    return results
+
+
+def report(results: list[dict]) -> dict:
+    by_state: dict[str, list[float]] = {}
+    for result in results:
+        by_state.setdefault(str(result["state_before"]), []).append(
+            result["latency_ms"] / 1000
+        )
+    return {
+        "updates": len(results),
+        "errors": sum(result["error"] is not None for result in results),
+        "diverged": sum(
+            result["state_after"] != result["expected_state_after"]
+            for result in results
+        ),
+        "latency": summarize([result["latency_ms"] / 1000 for result in results]),
+        "lag": summarize([result["lag_ms"] / 1000 for result in results]),
+        "states": {state: summarize(values) for state, values in by_state.items()},
+    }
+
+
+def compare(a: dict, b: dict, top: int = 10) -> dict:
+    """Per-update latency change from build `a` to build `b`"""
+    a_updates = {result["index"]: result for result in a["updates"]}
+    diffs = []
+    for result in b["updates"]:
+        base = a_updates.get(result["index"])
+        if base is None:
+            continue
+        diffs.append(
+            {
+                "index": result["index"],
+                "state_before": result["state_before"],
+                "a_ms": base["latency_ms"],
+                "b_ms": result["latency_ms"],
+                "diff_ms": result["latency_ms"] - base["latency_ms"],
+            }
+        )
+
+    by_state: dict[str, list[float]] = {}
+    for diff in diffs:
+        by_state.setdefault(str(diff["state_before"]), []).append(
+            diff["diff_ms"] / 1000
+        )
+    return {
+        "matched": len(diffs),
+        "diff": summarize([diff["diff_ms"] / 1000 for diff in diffs]),
+        "states": {state: summarize(values) for state, values in by_state.items()},
+        "slower": sorted(diffs, key=lambda diff: -diff["diff_ms"])[:top],
+        "faster": sorted(diffs, key=lambda diff: diff["diff_ms"])[:top],
+    }
+
+
+def parse_speed(value: str) -> float | None:
+    if value == "max":
+        return None
+    speed = float(value.removesuffix("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive")
+    return speed
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("recordings", type=pathlib.Path, nargs="+")
+    run_parser.add_argument("--speed", type=parse_speed, default=None)
+    run_parser.add_argument("--storage", default="memory")
+    run_parser.add_argument("--catalog", type=pathlib.Path)
+    run_parser.add_argument("--courses", type=int, default=500)
+    run_parser.add_argument("--categories", type=int, default=5)
+    run_parser.add_argument("--nosologies", type=int, default=20)
+    run_parser.add_argument("--seed", type=int, default=0)
+    add_standin_arguments(run_parser)
+    run_parser.add_argument("--output", type=pathlib.Path)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("a", type=pathlib.Path)
+    compare_parser.add_argument("b", type=pathlib.Path)
+    compare_parser.add_argument("--top", type=int, default=10)
+    return parser
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if args.catalog is not None:
+        catalog = json.loads(args.catalog.read_text())
+    else:
+        catalog = make_catalog(
+            courses=args.courses,
+            categories=args.categories,
+            nosologies=args.nosologies,
+            seed=args.seed,
+        )
+    _, server = await start_standins(args, catalog, serve=args.storage == "gcloud")
+    records = load_recording(args.recordings)
+    json_path = str(pathlib.Path(args.output or "replay").with_suffix(".storage.json"))
+    results = await replay(
+        records,
+        speed=args.speed,
+        storage_name=args.storage,
+        json_path=json_path,
+        storage_latency=args.storage_latency,
+        telegram_latency=args.telegram_latency,
+    )
+    await DB.close()
+    if server is not None:
+        await server.close()
+    return {"report": report(results), "updates": results}
+
+
+def main() -> int:
+    args = make_parser().parse_args()
+    if args.command == "compare":
+        a = json.loads(args.a.read_text())
+        b = json.loads(args.b.read_text())
+        print(json.dumps(compare(a, b, top=args.top), indent=2))
+        return 0
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result["report"], indent=2))
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,591 @@
+import asyncio
+import collections
+import dataclasses
+import datetime
+import itertools
+import json
+import os
+import random
+import re
+import time
+import urllib.parse
+
+import httpx
+from aiogram import Bot
+from aiogram.contrib.fsm_storage.files import JSONStorage
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.contrib.fsm_storage.redis import RedisStorage2
+from aiogram.dispatcher.storage import BaseStorage
+from aiohttp import web
+
+from cost_my_chemo_bot.bitrix import Bitrix
+from cost_my_chemo_bot.bots.telegram.storage import GcloudStorage, StorageProxy
+from cost_my_chemo_bot.db import DB
+
+# Categories without nosologies, see `process_category`.
+ACCOMPANYING_CATEGORY_ID = "e11397b4-8229-11ed-810b-002590c014a5"
+
+
+class Latency:
+    """
+    Injected delay, `base` plus a random part drawn from `distribution`
+
+    "uniform" adds up to `jitter` seconds, "exponential" adds `jitter` on
+    average and "lognormal" has median `jitter` and a long tail.
+    """
+
+    DISTRIBUTIONS = ("uniform", "exponential", "lognormal")
+
+    def __init__(self, base: float = 0, jitter: float = 0, distribution="uniform"):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"unknown latency distribution: {distribution}")
+        self.base = base
+        self.jitter = jitter
+        self.distribution = distribution
+
+    def sample(self) -> float:
+        if not self.jitter:
+            return self.base
+        match self.distribution:
+            case "exponential":
+                return self.base + random.expovariate(1 / self.jitter)
+            case "lognormal":
+                return self.base + self.jitter * random.lognormvariate(0, 1)
+        return self.base + random.uniform(0, self.jitter)
+
+    async def wait(self) -> None:
+        delay = self.sample()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+NO_LATENCY = Latency()
+
+
+class Faults:
+    """
+    Injected failures, drawn independently for every request
+
+    :param rates: share of requests answered with each error status
+    :param hang_rate: share of requests held for `hang` seconds before they
+        are answered, for client timeouts to fire
+    """
+
+    def __init__(
+        self,
+        rates: dict[int, float] | None = None,
+        hang_rate: float = 0,
+        hang: float = 60,
+    ):
+        self.rates = rates or {}
+        if sum(self.rates.values()) > 1:
+            raise ValueError("error rates add up to more than 1")
+        self.hang_rate = hang_rate
+        self.hang = hang
+
+    def draw(self) -> int | None:
+        roll = random.random()
+        for status, rate in self.rates.items():
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    async def wait(self) -> None:
+        if self.hang_rate and random.random() < self.hang_rate:
+            await asyncio.sleep(self.hang)
+
+
+NO_FAULTS = Faults()
+
+
+class StandInService:
+    """
+    httpx handler of a stand-in service
+
+    Every request waits for `latency` and possibly a hang from `faults`, then
+    gets either an injected error status or the answer of `handle`. Answers
+    are counted by status.
+    """
+
+    name = "service"
+    base_url = "http://service.local"
+
+    def __init__(self, latency: Latency = NO_LATENCY, faults: Faults = NO_FAULTS):
+        self.latency = latency
+        self.faults = faults
+        self.statuses: collections.Counter[int] = collections.Counter()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        await self.latency.wait()
+        await self.faults.wait()
+        status = self.faults.draw()
+        if status is not None:
+            response = self.error(status, "injected fault")
+            if status == 429:
+                response.headers["Retry-After"] = "1"
+        else:
+            response = await self.handle(request)
+        self.statuses[response.status_code] += 1
+        return response
+
+    def error(self, status: int, message: str) -> httpx.Response:
+        return httpx.Response(status, json={"error": message})
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        raise NotImplementedError
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url, transport=httpx.MockTransport(self), **kwargs
+        )
+
+
+def make_catalog(
+    courses: int = 500, categories: int = 5, nosologies: int = 20, seed: int = 0
+) -> dict[str, list[dict]]:
+    """Synthetic 1C catalog by action, every nosology has courses"""
+    rng = random.Random(seed)
+    category_rows = [
+        {"categoryid": f"category-{i}", "categoryName": f"Категория {i}"}
+        for i in range(categories)
+    ]
+    nosology_rows = [
+        {
+            "nosologyid": f"nosology-{i}",
+            "nosologyName": f"Заболевание {i}",
+            "categoryid1": f"category-{i % categories}",
+        }
+        for i in range(nosologies)
+    ]
+    drugs = ["паклитаксел", "доцетаксел", "карбоплатин", "цисплатин", "Trastuzumab"]
+    course_rows = []
+    for i in range(courses):
+        nosology = nosology_rows[i % nosologies]
+        extra = rng.sample(nosology_rows, k=min(2, nosologies))
+        nosology_ids = [nosology["nosologyid"]] + [
+            row["nosologyid"] for row in extra if row is not nosology
+        ]
+        nosology_ids = (nosology_ids + [""] * 5)[:5]
+        course_rows.append(
+            {
+                "Courseid": f"course-{i}",
+                "Course": f"{rng.choice(drugs)} + {rng.choice(drugs)} {i}",
+                "categoryid": nosology["categoryid1"],
+                "coefficient": f"{rng.randint(1, 300)} {rng.randint(0, 999):03},50",
+                **{f"nosologyid{n + 1}": value for n, value in enumerate(nosology_ids)},
+                "fixPrice": i % 3 == 0,
+            }
+        )
+    return {"Course": course_rows, "category": category_rows, "nosology": nosology_rows}
+
+
+class OneCStandIn(StandInService):
+    """1C catalog API answering `?action=` requests from `catalog`"""
+
+    name = "onec"
+    base_url = "http://1c.local"
+
+    def __init__(self, catalog: dict[str, list[dict]], **kwargs):
+        super().__init__(**kwargs)
+        self.catalog = catalog
+        # Encoding large catalogs would block the loop the bot runs on.
+        self._bodies: dict[str, bytes] = {}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        action = request.url.params.get("action")
+        if action not in self.catalog:
+            return self.error(404, f"unknown action {action}")
+        body = self._bodies.get(action)
+        if body is None:
+            body = json.dumps({"result": self.catalog[action]}).encode()
+            self._bodies[action] = body
+        return httpx.Response(
+            200, content=body, headers={"Content-Type": "application/json"}
+        )
+
+
+class BitrixStandIn(StandInService):
+    """
+    Bitrix `crm.lead.add` and `batch`
+
+    :param command_error_rate: share of `batch` commands failing on their own,
+        reported in `result_error` of a successful answer
+    """
+
+    name = "bitrix"
+    base_url = "http://bitrix.local"
+
+    def __init__(self, command_error_rate: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.command_error_rate = command_error_rate
+        self._lead_ids = itertools.count(1)
+
+    def error(self, status: int, message: str) -> httpx.Response:
+        if status == 429:
+            code = "QUERY_LIMIT_EXCEEDED"
+        else:
+            code = "INTERNAL_SERVER_ERROR"
+        return httpx.Response(
+            status, json={"error": code, "error_description": message}
+        )
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        method = request.url.path.rsplit("/", 1)[-1].removesuffix(".json")
+        if method == "crm.lead.add":
+            return httpx.Response(200, json={"result": next(self._lead_ids)})
+        if method == "batch":
+            form = httpx.QueryParams(request.content.decode())
+            results = {}
+            errors = {}
+            for key in form.keys():
+                if not key.startswith("cmd["):
+                    continue
+                name = key[len("cmd[") : -1]
+                if random.random() < self.command_error_rate:
+                    errors[name] = {
+                        "error": "ERROR_CORE",
+                        "error_description": "injected fault",
+                    }
+                else:
+                    results[name] = next(self._lead_ids)
+            # Bitrix answers with empty lists instead of empty objects.
+            return httpx.Response(
+                200,
+                json={
+                    "result": {"result": results or [], "result_error": errors or []}
+                },
+            )
+        return httpx.Response(404, json={"error": "ERROR_METHOD_NOT_FOUND"})
+
+
+@dataclasses.dataclass
+class GcsObject:
+    data: bytes
+    generation: int
+    content_type: str
+    updated: float
+
+
+class GcsStandIn(StandInService):
+    """
+    GCS JSON API subset used by `GcloudStorage`, objects are kept in memory
+
+    Metadata and media downloads, media uploads, deletes and listing, with
+    `ifGenerationMatch` / `ifGenerationNotMatch` preconditions as query
+    parameters or `x-goog-if-generation-*` headers. Buckets spring into
+    existence on first use.
+
+    :param min_write_interval: writes to one object closer than this get 429,
+        like the per-object mutation limit of GCS
+    """
+
+    name = "gcs"
+    base_url = "http://gcs.local"
+
+    def __init__(self, min_write_interval: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.min_write_interval = min_write_interval
+        self.objects: dict[tuple[str, str], GcsObject] = {}
+        self._generation = 0
+
+    def error(self, status: int, message: str) -> httpx.Response:
+        return httpx.Response(
+            status,
+            json={
+                "error": {
+                    "code": status,
+                    "message": message,
+                    "errors": [{"message": message, "domain": "global"}],
+                }
+            },
+        )
+
+    def _next_generation(self) -> int:
+        # Real generations are microsecond timestamps.
+        self._generation = max(self._generation + 1, time.time_ns() // 1000)
+        return self._generation
+
+    @staticmethod
+    def _metadata(bucket: str, name: str, item: GcsObject) -> dict:
+        updated = datetime.datetime.fromtimestamp(
+            item.updated, datetime.timezone.utc
+        ).isoformat(timespec="milliseconds")
+        return {
+            "kind": "storage#object",
+            "id": f"{bucket}/{name}/{item.generation}",
+            "name": name,
+            "bucket": bucket,
+            "generation": str(item.generation),
+            "metageneration": "1",
+            "contentType": item.content_type,
+            "size": str(len(item.data)),
+            "timeCreated": updated,
+            "updated": updated,
+        }
+
+    @staticmethod
+    def _precondition(request: httpx.Request, name: str) -> int | None:
+        header = "x-goog-" + re.sub(r"([A-Z])", r"-\1", name).lower()
+        value = request.url.params.get(name) or request.headers.get(header)
+        return None if value is None else int(value)
+
+    def _check_preconditions(
+        self, request: httpx.Request, item: GcsObject | None, write: bool
+    ) -> httpx.Response | None:
+        generation = item.generation if item is not None else 0
+        match = self._precondition(request, "ifGenerationMatch")
+        if match is not None and match != generation:
+            return self.error(412, "Precondition Failed")
+        not_match = self._precondition(request, "ifGenerationNotMatch")
+        if not_match is not None and not_match == generation:
+            if write:
+                return self.error(412, "Precondition Failed")
+            return httpx.Response(304)
+        return None
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        # Object names are percent-encoded, "/" included.
+        path = request.url.raw_path.decode().partition("?")[0]
+        parts = [urllib.parse.unquote(part) for part in path.strip("/").split("/")]
+        match request.method, parts:
+            case "GET", ["storage", "v1", "b", bucket, "o"]:
+                return self._list(request, bucket)
+            case "GET", ["storage", "v1", "b", bucket, "o", name]:
+                return self._get(request, bucket, name)
+            case "DELETE", ["storage", "v1", "b", bucket, "o", name]:
+                return self._delete(request, bucket, name)
+            case "POST", ["upload", "storage", "v1", "b", bucket, "o"]:
+                return self._upload(request, bucket)
+        return self.error(404, f"Not Found: {request.method} {path}")
+
+    def _list(self, request: httpx.Request, bucket: str) -> httpx.Response:
+        prefix = request.url.params.get("prefix", "")
+        items = [
+            self._metadata(bucket, name, item)
+            for (item_bucket, name), item in sorted(self.objects.items())
+            if item_bucket == bucket and name.startswith(prefix)
+        ]
+        return httpx.Response(200, json={"kind": "storage#objects", "items": items})
+
+    def _get(self, request: httpx.Request, bucket: str, name: str) -> httpx.Response:
+        item = self.objects.get((bucket, name))
+        failed = self._check_preconditions(request, item, write=False)
+        if failed is not None:
+            return failed
+        if item is None:
+            return self.error(404, f"No such object: {bucket}/{name}")
+        if request.url.params.get("alt") == "media":
+            return httpx.Response(
+                200,
+                content=item.data,
+                headers={
+                    "Content-Type": item.content_type,
+                    "x-goog-generation": str(item.generation),
+                },
+            )
+        return httpx.Response(200, json=self._metadata(bucket, name, item))
+
+    def _delete(self, request: httpx.Request, bucket: str, name: str):
+        item = self.objects.get((bucket, name))
+        failed = self._check_preconditions(request, item, write=True)
+        if failed is not None:
+            return failed
+        if item is None:
+            return self.error(404, f"No such object: {bucket}/{name}")
+        del self.objects[(bucket, name)]
+        return httpx.Response(204)
+
+    def _upload(self, request: httpx.Request, bucket: str) -> httpx.Response:
+        upload_type = request.url.params.get("uploadType")
+        name = request.url.params.get("name")
+        if upload_type != "media" or not name:
+            return self.error(400, f"unsupported upload: {upload_type} {name}")
+
+        item = self.objects.get((bucket, name))
+        failed = self._check_preconditions(request, item, write=True)
+        if failed is not None:
+            return failed
+        now = time.time()
+        if item is not None and now - item.updated < self.min_write_interval:
+            return self.error(
+                429, "The object exceeded the rate limit for object mutation"
+            )
+        item = GcsObject(
+            data=request.content,
+            generation=self._next_generation(),
+            content_type=request.headers.get("Content-Type")
+            or "application/octet-stream",
+            updated=now,
+        )
+        self.objects[(bucket, name)] = item
+        return httpx.Response(200, json=self._metadata(bucket, name, item))
+
+
+class StandInServer:
+    """
+    Stand-ins served over local HTTP
+
+    Needed for `GcloudStorage`, gcloud-aio-storage makes its own aiohttp
+    sessions and finds the server through `STORAGE_EMULATOR_HOST`, and for
+    client timeouts, which mock transports don't apply. 1C and Bitrix are
+    served under /1c/ and /bitrix/, GCS at the root like the real API.
+    """
+
+    def __init__(
+        self,
+        onec: OneCStandIn | None = None,
+        bitrix: BitrixStandIn | None = None,
+        gcs: GcsStandIn | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.onec = onec
+        self.bitrix = bitrix
+        self.gcs = gcs
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.address}"
+
+    @staticmethod
+    def _route(service: StandInService):
+        async def handle(request: web.Request) -> web.Response:
+            response = await service(
+                httpx.Request(
+                    request.method,
+                    f"http://{request.host}{request.raw_path}",
+                    headers=tuple(request.headers.items()),
+                    content=await request.read(),
+                )
+            )
+            headers = {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() in ("content-type", "retry-after")
+                or name.lower().startswith("x-goog-")
+            }
+            return web.Response(
+                status=response.status_code, body=response.content, headers=headers
+            )
+
+        return handle
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        for prefix, service in (("/1c", self.onec), ("/bitrix", self.bitrix)):
+            if service is not None:
+                app.router.add_route("*", prefix + "/{tail:.*}", self._route(service))
+        if self.gcs is not None:
+            for prefix in ("/storage", "/upload"):
+                app.router.add_route("*", prefix + "/{tail:.*}", self._route(self.gcs))
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def install_http_standins(
+    onec: OneCStandIn,
+    bitrix: BitrixStandIn,
+    server: StandInServer | None = None,
+) -> None:
+    """
+    Point `DB` and `Bitrix` clients at stand-ins
+
+    Through mock transports, or through `server` with the timeouts of the
+    production clients.
+    """
+    if server is None:
+        DB.client = onec.client()
+        Bitrix.client = bitrix.client()
+    else:
+        DB.client = httpx.AsyncClient(
+            base_url=f"{server.url}/1c/", timeout=DB.client.timeout
+        )
+        Bitrix.client = httpx.AsyncClient(
+            base_url=f"{server.url}/bitrix/", timeout=Bitrix.client.timeout
+        )
+    DB.loaded = False
+
+
+class StandInBot(Bot):
+    """Telegram stand-in, answers every request locally after `latency`"""
+
+    def __init__(self, latency: Latency = NO_LATENCY, **kwargs):
+        super().__init__(token="123456:bench", **kwargs)
+        self.latency = latency
+        self._message_ids = iter(range(1, 1 << 62))
+        self.requests: collections.Counter[str] = collections.Counter()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.requests[method] += 1
+        await self.latency.wait()
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench"}
+        if method in ("sendMessage", "editMessageReplyMarkup", "editMessageText"):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(data["chat_id"]), "type": "private"},
+                "text": data.get("text", ""),
+            }
+        return True
+
+
+class StandInStorage(StorageProxy):
+    """Adds `latency` to every storage call and records call durations"""
+
+    def __init__(self, storage: BaseStorage, latency: Latency = NO_LATENCY):
+        super().__init__(storage)
+        self.latency = latency
+        self.durations: dict[str, list[float]] = collections.defaultdict(list)
+
+    async def _call(self, method: str, **kwargs):
+        started = time.perf_counter()
+        await self.latency.wait()
+        try:
+            return await super()._call(method, **kwargs)
+        finally:
+            self.durations[method].append(time.perf_counter() - started)
+
+
+def make_backend(
+    name: str, json_path: str, redis_url: str | None = None
+) -> BaseStorage:
+    match name:
+        case "memory":
+            return MemoryStorage()
+        case "json":
+            return JSONStorage(json_path)
+        case "redis":
+            # Never the configured one, it may be production.
+            if redis_url is None:
+                raise ValueError("redis backend needs an explicit redis url")
+            url = urllib.parse.urlsplit(redis_url)
+            return RedisStorage2(
+                host=url.hostname,
+                port=url.port or 6379,
+                db=int(url.path.lstrip("/") or 0),
+                password=url.password,
+            )
+        case "gcloud":
+            # Never the real API, see `StandInServer`.
+            if not os.environ.get("STORAGE_EMULATOR_HOST"):
+                raise ValueError("gcloud backend needs STORAGE_EMULATOR_HOST")
+            return GcloudStorage(bucket_name="bench")
+    raise ValueError(f"unknown storage backend: {name}")
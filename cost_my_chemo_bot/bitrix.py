@@ -0,0 +1,80 @@
+import time
+import typing
+import urllib.parse
+
+from httpx import AsyncClient, HTTPError, Limits
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot import metrics
+from cost_my_chemo_bot.config import SETTINGS
+
+logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
+
+# https://dev.1c-bitrix.ru/rest_help/general/batch.php
+BATCH_MAX_COMMANDS = 50
+
+
+class BitrixError(Exception):
+    ...
+
+
+def make_client() -> AsyncClient:
+    return AsyncClient(
+        base_url=SETTINGS.BITRIX_URL,
+        limits=Limits(max_connections=10, max_keepalive_connections=5),
+        timeout=30,
+    )
+
+
+class Bitrix:
+    client = make_client()
+
+    @staticmethod
+    def _method_url(method: str) -> str:
+        return f"{SETTINGS.BITRIX_TOKEN.get_secret_value()}/{method}.json"
+
+    async def _post(self, method: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self.client.post(self._method_url(method), **kwargs)
+        except HTTPError as e:
+            # Bitrix is down or slow, retried like any other failed call.
+            raise BitrixError(f"{method} failed: {e!r}") from e
+        finally:
+            metrics.BITRIX_LATENCY.labels(method).observe(time.perf_counter() - started)
+
+    async def add_lead(self, params: dict[str, typing.Any]) -> dict:
+        resp = await self._post("crm.lead.add", params=params)
+        if resp.status_code != 200:
+            raise BitrixError(f"can't add lead: {resp.status_code} {resp.text}")
+
+        return resp.json()
+
+    async def add_leads(
+        self, leads: dict[str, dict[str, typing.Any]]
+    ) -> tuple[dict[str, typing.Any], dict[str, typing.Any]]:
+        """
+        Add up to 50 leads with one `batch` call
+
+        :param leads: lead params by command name
+        :return: results and errors by command name
+        """
+        assert len(leads) <= BATCH_MAX_COMMANDS
+        data = {"halt": 0}
+        for name, params in leads.items():
+            data[f"cmd[{name}]"] = "crm.lead.add?" + urllib.parse.urlencode(
+                {key: value for key, value in params.items() if value is not None}
+            )
+        resp = await self._post("batch", data=data)
+        if resp.status_code != 200:
+            raise BitrixError(f"batch failed: {resp.status_code} {resp.text}")
+
+        result = resp.json()["result"]
+        # Bitrix returns empty lists instead of empty objects.
+        return result.get("result") or {}, result.get("result_error") or {}
+
+    @classmethod
+    async def close(cls):
+        await cls.client.aclose()
+        # Cloud Functions handle every request in a new event loop.
+        cls.client = make_client()
@@ -1,9 +1,16 @@
 from aiogram import Bot, Dispatcher, types
 from logfmt_logger import getLogger
 
+from cost_my_chemo_bot import validation
+from cost_my_chemo_bot.bitrix import Bitrix
+from cost_my_chemo_bot.bots.telegram.dedup import DEDUPLICATOR
 from cost_my_chemo_bot.bots.telegram.handlers import init_handlers
+from cost_my_chemo_bot.bots.telegram.prefetch import PREFETCHER
+from cost_my_chemo_bot.bots.telegram.recorder import RECORDER
 from cost_my_chemo_bot.config import SETTINGS, WEBHOOK_SETTINGS, BotMode
 from cost_my_chemo_bot.db import DB
+from cost_my_chemo_bot.outbox import LEAD_OUTBOX_WORKER
+from cost_my_chemo_bot.tracing import TRACER
 
 logger = getLogger(__name__)
 
@@ -27,6 +34,7 @@ async def init_bot(bot: Bot, dp: Dispatcher):
 
     database = DB()
     await database.load_db()
+    validation.warm_up()
 
     Dispatcher.set_current(dp)
     Bot.set_current(bot)
@@ -37,6 +45,7 @@ async def init_bot(bot: Bot, dp: Dispatcher):
             await bot.set_webhook(WEBHOOK_SETTINGS.webhook_url),
         )
     init_handlers(dp)
+    LEAD_OUTBOX_WORKER.start()
 
 
 async def close_bot(bot: Bot, dp: Dispatcher):
@@ -45,5 +54,12 @@ async def close_bot(bot: Bot, dp: Dispatcher):
     await dp.storage.close()
     await dp.storage.wait_closed()
     await DB.close()
+    await LEAD_OUTBOX_WORKER.stop()
+    await PREFETCHER.close()
+    await Bitrix.close()
+    await DEDUPLICATOR.close()
+    TRACER.close()
+    if RECORDER is not None:
+        RECORDER.close()
     session = await dp.bot.get_session()
     await session.close()
@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import contextlib
+import functools
+import pathlib
+import time
+import typing
+import uuid
+
+import aiohttp
+from aiogram import Bot
+from aiogram.dispatcher.storage import BaseStorage
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    ChatNotFound,
+    TelegramAPIError,
+    UserDeactivated,
+)
+from gcloud.aio.storage import Storage
+from logfmt_logger import getLogger
+from pydantic import BaseModel, Field
+from redis import asyncio as aioredis
+
+from cost_my_chemo_bot.bots.telegram.ratelimit import SEND_SCHEDULER
+from cost_my_chemo_bot.bots.telegram.storage import get_states_page
+from cost_my_chemo_bot.config import (
+    BROADCAST_SETTINGS,
+    REDIS_SETTINGS,
+    SETTINGS,
+    StorageType,
+)
+
+logger = getLogger(__name__)
+
+
+class BroadcastNotFound(Exception):
+    ...
+
+
+class BroadcastStatus(BaseModel):
+    broadcast_id: str
+    text: str
+    parse_mode: str | None = None
+    # Cursor of the page in progress and recipients already done on it.
+    cursor: str | None = None
+    page_done: list[str] = Field(default_factory=list)
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    started_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+    finished: bool = False
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def throughput(self) -> float:
+        elapsed = self.updated_at - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+class BroadcastCheckpoints:
+    """
+    Durable progress of broadcasts, one checkpoint per broadcast.
+
+    Every save replaces the whole checkpoint, so an interrupted broadcast
+    resumes from the last one saved.
+    """
+
+    async def load(self, broadcast_id: str) -> BroadcastStatus | None:
+        raise NotImplementedError
+
+    async def save(self, status: BroadcastStatus) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        ...
+
+
+class FileBroadcastCheckpoints(BroadcastCheckpoints):
+    """
+    Every checkpoint is a JSON file, replaced atomically.
+
+    Only durable on a persistent volume, for local runs.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+
+    def _path(self, broadcast_id: str) -> pathlib.Path:
+        return self.path / f"{broadcast_id}.json"
+
+    async def load(self, broadcast_id: str) -> BroadcastStatus | None:
+        path = self._path(broadcast_id)
+        if not path.exists():
+            return None
+
+        return BroadcastStatus.parse_file(path)
+
+    async def save(self, status: BroadcastStatus) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._path(status.broadcast_id)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(status.json())
+        tmp_path.replace(path)
+
+
+class RedisBroadcastCheckpoints(BroadcastCheckpoints):
+    """Every checkpoint is a `{key_prefix}:{broadcast_id}` value"""
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        key_prefix: str = "cost_my_chemo_bot:broadcast",
+    ):
+        self.redis = redis
+        self.key_prefix = key_prefix
+
+    async def load(self, broadcast_id: str) -> BroadcastStatus | None:
+        value = await self.redis.get(f"{self.key_prefix}:{broadcast_id}")
+        if value is None:
+            return None
+
+        return BroadcastStatus.parse_raw(value)
+
+    async def save(self, status: BroadcastStatus) -> None:
+        await self.redis.set(f"{self.key_prefix}:{status.broadcast_id}", status.json())
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+class GcloudBroadcastCheckpoints(BroadcastCheckpoints):
+    """Every checkpoint is a `{prefix}/checkpoints/{broadcast_id}.json` blob"""
+
+    def __init__(
+        self,
+        bucket_name: str = "cost-my-chemo-bot-storage",
+        prefix: str = "broadcasts",
+    ):
+        self.bucket_name = bucket_name
+        # Deeper than `{chat}/{user}.json` states, so they aren't recipients.
+        self.prefix = f"{prefix}/checkpoints/"
+
+    @contextlib.asynccontextmanager
+    async def get_storage(self) -> typing.AsyncIterator[Storage]:
+        async with aiohttp.ClientSession() as session:
+            yield Storage(session=session)
+
+    async def load(self, broadcast_id: str) -> BroadcastStatus | None:
+        async with self.get_storage() as storage:
+            try:
+                body = await storage.download(
+                    self.bucket_name, f"{self.prefix}{broadcast_id}.json"
+                )
+            except aiohttp.ClientResponseError as e:
+                if e.status == 404:
+                    return None
+                raise
+
+        return BroadcastStatus.parse_raw(body)
+
+    async def save(self, status: BroadcastStatus) -> None:
+        async with self.get_storage() as storage:
+            await storage.upload(
+                self.bucket_name,
+                f"{self.prefix}{status.broadcast_id}.json",
+                status.json(),
+                content_type="application/json",
+            )
+
+
+def make_broadcast_checkpoints() -> BroadcastCheckpoints:
+    # Next to FSM states by default, local files don't outlive an instance.
+    checkpoint_type = (
+        BROADCAST_SETTINGS.BROADCAST_CHECKPOINT_TYPE or SETTINGS.STORAGE_TYPE
+    )
+    match checkpoint_type:
+        case StorageType.JSON:
+            return FileBroadcastCheckpoints(BROADCAST_SETTINGS.BROADCAST_CHECKPOINT_DIR)
+        case StorageType.GCLOUD:
+            return GcloudBroadcastCheckpoints()
+        case StorageType.REDIS:
+            return RedisBroadcastCheckpoints(
+                aioredis.Redis(
+                    host=REDIS_SETTINGS.REDIS_HOST,
+                    port=REDIS_SETTINGS.REDIS_PORT,
+                    db=REDIS_SETTINGS.REDIS_DB,
+                    username=REDIS_SETTINGS.REDIS_USERNAME,
+                    password=REDIS_SETTINGS.REDIS_PASSWORD,
+                )
+            )
+    raise ValueError(f"unknown broadcast checkpoint type: {checkpoint_type}")
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot: Bot,
+        storage: BaseStorage,
+        checkpoints: BroadcastCheckpoints,
+        concurrency: int = BROADCAST_SETTINGS.BROADCAST_CONCURRENCY,
+        page_size: int = BROADCAST_SETTINGS.BROADCAST_PAGE_SIZE,
+        checkpoint_every: int = BROADCAST_SETTINGS.BROADCAST_CHECKPOINT_EVERY,
+    ):
+        self.bot = bot
+        self.storage = storage
+        self.checkpoints = checkpoints
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.checkpoint_every = checkpoint_every
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    async def load(self, broadcast_id: str) -> BroadcastStatus:
+        status = await self.checkpoints.load(broadcast_id)
+        if status is None:
+            raise BroadcastNotFound(f"no such broadcast: {broadcast_id}")
+
+        return status
+
+    async def save(self, status: BroadcastStatus) -> None:
+        status.updated_at = time.time()
+        await self.checkpoints.save(status)
+
+    async def _send(
+        self,
+        status: BroadcastStatus,
+        chat: str,
+        user: str,
+        semaphore: asyncio.Semaphore,
+        save_lock: asyncio.Lock,
+    ) -> None:
+        async with semaphore:
+            try:
+                await SEND_SCHEDULER.send(
+                    chat,
+                    functools.partial(
+                        self.bot.send_message,
+                        chat_id=chat,
+                        text=status.text,
+                        parse_mode=status.parse_mode,
+                    ),
+                )
+                status.sent += 1
+            except (BotBlocked, ChatNotFound, UserDeactivated):
+                status.blocked += 1
+            except TelegramAPIError:
+                logger.exception("can't broadcast to chat %s", chat)
+                status.failed += 1
+
+            status.page_done.append(f"{chat}:{user}")
+            if status.processed % self.checkpoint_every == 0:
+                # In order, an older checkpoint must not overwrite a newer one.
+                async with save_lock:
+                    await self.save(status)
+
+    async def run(
+        self, broadcast_id: str, text: str, parse_mode: str | None = None
+    ) -> BroadcastStatus:
+        try:
+            status = await self.load(broadcast_id)
+            logger.info(
+                "resume broadcast %s from cursor %s", broadcast_id, status.cursor
+            )
+        except BroadcastNotFound:
+            status = BroadcastStatus(
+                broadcast_id=broadcast_id, text=text, parse_mode=parse_mode
+            )
+            await self.save(status)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        save_lock = asyncio.Lock()
+        while not status.finished:
+            page, next_cursor = await get_states_page(
+                self.storage, cursor=status.cursor, limit=self.page_size
+            )
+            done = set(status.page_done)
+            await asyncio.gather(
+                *[
+                    self._send(status, chat, user, semaphore, save_lock)
+                    for chat, user in page
+                    if f"{chat}:{user}" not in done
+                ]
+            )
+            status.cursor = next_cursor
+            status.page_done = []
+            status.finished = next_cursor is None
+            await self.save(status)
+            logger.info(
+                "broadcast %s: sent=%s blocked=%s failed=%s throughput=%.2f/s",
+                broadcast_id,
+                status.sent,
+                status.blocked,
+                status.failed,
+                status.throughput,
+            )
+
+        return status
+
+    def start(self, text: str, parse_mode: str | None = None) -> str:
+        broadcast_id = uuid.uuid4().hex
+        self.resume(broadcast_id, text=text, parse_mode=parse_mode)
+        return broadcast_id
+
+    def resume(
+        self, broadcast_id: str, text: str = "", parse_mode: str | None = None
+    ) -> None:
+        task = self._tasks.get(broadcast_id)
+        if task is not None and not task.done():
+            return
+
+        self._tasks[broadcast_id] = asyncio.create_task(
+            self.run(broadcast_id, text=text, parse_mode=parse_mode)
+        )
+
+    def is_running(self, broadcast_id: str) -> bool:
+        task = self._tasks.get(broadcast_id)
+        return task is not None and not task.done()
+
+
+async def main(broadcast_id: str, text: str, parse_mode: str | None) -> None:
+    from cost_my_chemo_bot.bots.telegram.bot import make_bot
+    from cost_my_chemo_bot.bots.telegram.storage import make_storage
+
+    bot = make_bot()
+    storage = make_storage()
+    checkpoints = make_broadcast_checkpoints()
+    try:
+        broadcaster = Broadcaster(bot=bot, storage=storage, checkpoints=checkpoints)
+        status = await broadcaster.run(broadcast_id, text=text, parse_mode=parse_mode)
+        print(status.json(indent=2))
+    finally:
+        await checkpoints.close()
+        await storage.close()
+        await storage.wait_closed()
+        session = await bot.get_session()
+        await session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a message to every user")
+    parser.add_argument("--text", default="", help="message text")
+    parser.add_argument("--parse-mode", default=None, help="HTML or Markdown")
+    parser.add_argument(
+        "--id",
+        dest="broadcast_id",
+        default=None,
+        help="id of an interrupted broadcast to resume",
+    )
+    args = parser.parse_args()
+    if args.broadcast_id is None and not args.text:
+        parser.error("--text is required for a new broadcast")
+
+    asyncio.run(
+        main(
+            broadcast_id=args.broadcast_id or uuid.uuid4().hex,
+            text=args.text,
+            parse_mode=args.parse_mode,
+        )
+    )
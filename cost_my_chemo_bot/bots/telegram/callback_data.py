@@ -0,0 +1,70 @@
+import string
+
+from aiogram import types
+
+from cost_my_chemo_bot.db import DB
+
+# Callback data of catalog buttons is "<kind><catalog version>.<position>",
+# both numbers in base 36, e.g. "c1ky7d3.a", instead of a 36 character id.
+# Buttons from a keyboard rendered for another catalog snapshot don't decode.
+# Page buttons of paginated keyboards use the same format with the page number.
+DIGITS = string.digits + string.ascii_lowercase
+SEPARATOR = "."
+PAGE = "p"
+
+database = DB()
+
+
+def to_base36(number: int) -> str:
+    if number == 0:
+        return DIGITS[0]
+
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(DIGITS[remainder])
+    return "".join(reversed(digits))
+
+
+def _prefix(kind: str) -> str:
+    return f"{kind}{to_base36(database.index.version)}{SEPARATOR}"
+
+
+def _decode_number(kind: str, data: str | None) -> int | None:
+    if not data:
+        return None
+
+    prefix = _prefix(kind)
+    if not data.startswith(prefix):
+        return None
+
+    try:
+        number = int(data[len(prefix) :], 36)
+    except ValueError:
+        return None
+    return number if number >= 0 else None
+
+
+def encode(kind: str, item_id: str) -> str:
+    return _prefix(kind) + to_base36(database.index.position(kind, item_id))
+
+
+def decode(kind: str, data: str | None) -> str | None:
+    """Return id of the item from callback data or None if it's not a valid token"""
+    position = _decode_number(kind, data)
+    if position is None:
+        return None
+
+    return database.index.item_id(kind, position)
+
+
+def encode_page(page: int) -> str:
+    return _prefix(PAGE) + to_base36(page)
+
+
+def decode_page(data: str | None) -> int | None:
+    return _decode_number(PAGE, data)
+
+
+def button(kind: str, item_id: str, text: str) -> types.InlineKeyboardButton:
+    return types.InlineKeyboardButton(text=text, callback_data=encode(kind, item_id))
@@ -0,0 +1,115 @@
+import collections
+import sys
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from logfmt_logger import getLogger
+from redis import asyncio as aioredis
+
+from cost_my_chemo_bot.config import DEDUPLICATION_SETTINGS
+
+logger = getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Remembers recently seen ``update_id`` values.
+
+    Telegram redelivers a webhook update when we answer slowly or with an error,
+    so the same update may reach us several times. The local window is a bounded
+    FIFO of ids, the optional redis ``SET NX`` makes the check work across instances.
+    An id is claimed when the update arrives, so a redelivery during processing
+    is dropped, and released with `forget` if processing fails, so the
+    redelivery after the error is handled.
+    """
+
+    def __init__(
+        self,
+        window_size: int = 4096,
+        redis_url: str | None = None,
+        ttl: int = 60 * 60,
+        key_prefix: str = "cost_my_chemo_bot:update",
+    ):
+        self.window_size = window_size
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._seen: set[int] = set()
+        self._order: collections.deque[int] = collections.deque()
+        self._redis: aioredis.Redis | None = None
+        if redis_url is not None:
+            self._redis = aioredis.Redis.from_url(redis_url)
+        self.duplicates = 0
+
+    def _remember(self, update_id: int) -> None:
+        self._seen.add(update_id)
+        self._order.append(update_id)
+        while len(self._order) > self.window_size:
+            self._seen.discard(self._order.popleft())
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+
+        self._remember(update_id)
+        if self._redis is None:
+            return False
+
+        try:
+            is_new = await self._redis.set(
+                f"{self.key_prefix}:{update_id}", 1, nx=True, ex=self.ttl
+            )
+        except aioredis.RedisError:
+            logger.exception("can't check update %s in redis", update_id)
+            return False
+
+        if not is_new:
+            self.duplicates += 1
+            return True
+
+        return False
+
+    async def forget(self, update_id: int) -> None:
+        if update_id in self._seen:
+            self._seen.discard(update_id)
+            self._order.remove(update_id)
+        if self._redis is None:
+            return
+
+        try:
+            await self._redis.delete(f"{self.key_prefix}:{update_id}")
+        except aioredis.RedisError:
+            logger.exception("can't forget update %s in redis", update_id)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.close()
+
+
+class DeduplicationMiddleware(BaseMiddleware):
+    def __init__(self, deduplicator: UpdateDeduplicator):
+        super().__init__()
+        self.deduplicator = deduplicator
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if await self.deduplicator.is_duplicate(update.update_id):
+            logger.info("skip duplicate update: %s", update.update_id)
+            raise CancelHandler()
+        # Updates may be fed while the caller handles another exception.
+        data["dedup_handling"] = sys.exc_info()[1]
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        # Called from aiogram's `finally`, a failed update is still being raised.
+        if sys.exc_info()[1] not in (None, data.get("dedup_handling")):
+            logger.info("update %s failed, accepting redelivery", update.update_id)
+            await self.deduplicator.forget(update.update_id)
+
+
+DEDUPLICATOR = UpdateDeduplicator(
+    window_size=DEDUPLICATION_SETTINGS.DEDUP_WINDOW_SIZE,
+    redis_url=DEDUPLICATION_SETTINGS.DEDUP_REDIS_URL,
+    ttl=DEDUPLICATION_SETTINGS.DEDUP_TTL,
+)
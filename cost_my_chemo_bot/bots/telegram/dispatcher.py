@@ -1,24 +1,156 @@
+import dataclasses
+import functools
+
 import aiogram.utils.markdown as md
 from aiogram import Bot, Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.storage import BaseStorage
 from aiogram.dispatcher.webhook import SendMessage
 from aiogram.types import ParseMode
-from aiogram.utils.text_decorations import HtmlDecoration
 from logfmt_logger import getLogger
 
-from cost_my_chemo_bot.bots.telegram import messages
+from cost_my_chemo_bot.bots.telegram import callback_data, messages, templates
+from cost_my_chemo_bot.bots.telegram.dedup import DEDUPLICATOR, DeduplicationMiddleware
 from cost_my_chemo_bot.bots.telegram.keyboard import Buttons, get_keyboard_markup
+from cost_my_chemo_bot.bots.telegram.middlewares import (
+    MetricsMiddleware,
+    TracingMiddleware,
+    UpdateContextMiddleware,
+)
+from cost_my_chemo_bot.bots.telegram.pagination import COURSE_KEYBOARDS
+from cost_my_chemo_bot.bots.telegram.prefetch import PREFETCHER
+from cost_my_chemo_bot.bots.telegram.recorder import RECORDER, RecordingMiddleware
 from cost_my_chemo_bot.bots.telegram.send import send_message
-from cost_my_chemo_bot.bots.telegram.state import parse_state
-from cost_my_chemo_bot.db import DB, Course
+from cost_my_chemo_bot.bots.telegram.state import StateData, parse_state
+from cost_my_chemo_bot.bots.telegram.storage import (
+    InstrumentedStorage,
+    UpdateCachedStorage,
+)
+from cost_my_chemo_bot.bots.telegram.throttling import THROTTLER, ThrottlingMiddleware
+from cost_my_chemo_bot.db import (
+    CATEGORY,
+    COURSE,
+    DB,
+    NOSOLOGY,
+    CategoryNotFound,
+    CourseNotFound,
+    Nosology,
+    NosologyNotFound,
+)
 
 logger = getLogger(__name__)
 database = DB()
 
 
 def make_dispatcher(bot: Bot, storage: BaseStorage) -> Dispatcher:
-    return Dispatcher(bot, storage=storage)
+    dp = Dispatcher(bot, storage=UpdateCachedStorage(InstrumentedStorage(storage)))
+    dp.middleware.setup(DeduplicationMiddleware(DEDUPLICATOR))
+    dp.middleware.setup(ThrottlingMiddleware(THROTTLER))
+    dp.middleware.setup(MetricsMiddleware())
+    dp.middleware.setup(TracingMiddleware())
+    dp.middleware.setup(UpdateContextMiddleware())
+    if RECORDER is not None:
+        # After the update context, so the state read is shared with handlers.
+        dp.middleware.setup(RecordingMiddleware(RECORDER))
+    return dp
+
+
+async def feed_update(dp: Dispatcher, update: types.Update) -> list:
+    # Unlike `dp.process_update`, this runs update level middlewares,
+    # the same way polling does.
+    results = await dp.updates_handler.notify(update)
+    if not results:
+        return []
+
+    return results[0]
+
+
+@dataclasses.dataclass(frozen=True)
+class CourseSummary:
+    category_name: str
+    nosology_name: str
+    course_price: str
+
+
+async def _make_course_summary(
+    category_id: str,
+    nosology_id: str | None,
+    course_id: str | None,
+    is_custom_course: bool,
+    bsa: float | None,
+) -> CourseSummary:
+    category = database.lookup(CATEGORY, category_id)
+    if category is None:
+        raise CategoryNotFound(f"no such category: {category_id}")
+
+    nosology_name = ""
+    if nosology_id is not None:
+        nosology = database.lookup(NOSOLOGY, nosology_id)
+        if nosology is None:
+            raise NosologyNotFound(f"no such nosology: {nosology_id}")
+        nosology_name = nosology.nosologyName
+
+    if is_custom_course or bsa is None:
+        course_price = messages.PRICE_FOR_CUSTOM_COURSE
+    else:
+        course = database.lookup(COURSE, course_id)
+        if course is None:
+            raise CourseNotFound(f"no such course: {course_id}")
+        course_price = f"{course.price(bsa=bsa):.2f} {messages.CURRENCY}"
+
+    return CourseSummary(
+        category_name=category.categoryName,
+        nosology_name=nosology_name,
+        course_price=course_price,
+    )
+
+
+def _course_summary_args(state_data: StateData) -> tuple:
+    return (
+        state_data.category_id,
+        None if state_data.is_accompanying_therapy else state_data.nosology_id,
+        state_data.course_id,
+        bool(state_data.is_custom_course),
+        state_data.bsa if state_data.height and state_data.weight else None,
+    )
+
+
+async def get_course_summary(state_data: StateData) -> CourseSummary:
+    # Computed for data confirmation, kept for the contacts input message.
+    args = _course_summary_args(state_data)
+    return await PREFETCHER.get(
+        ("course_summary", *args), functools.partial(_make_course_summary, *args)
+    )
+
+
+def prefetch_course_keyboards(
+    category_id: str, nosology_ids: list[str | None], page: int = 0
+) -> None:
+    for nosology_id in nosology_ids:
+        PREFETCHER.schedule(
+            ("course_keyboard", category_id, nosology_id, page),
+            functools.partial(
+                COURSE_KEYBOARDS.get,
+                category_id=category_id,
+                nosology_id=nosology_id,
+                page=page,
+                reload=False,
+            ),
+        )
+
+
+def category_buttons() -> list[types.InlineKeyboardButton]:
+    return [
+        callback_data.button(CATEGORY, category.categoryid, category.categoryName)
+        for category in sorted(database.categories, key=lambda item: item.categoryName)
+    ]
+
+
+def nosology_buttons(nosologies: list[Nosology]) -> list[types.InlineKeyboardButton]:
+    return [
+        callback_data.button(NOSOLOGY, nosology.nosologyid, nosology.nosologyName)
+        for nosology in sorted(nosologies, key=lambda item: item.nosologyName)
+    ]
 
 
 async def send_welcome_message(message: types.Message) -> types.Message | SendMessage:
@@ -63,19 +195,11 @@ async def send_category_message(message: types.Message) -> types.Message:
     bot = Bot.get_current()
     await database.reload_db()
 
-    buttons = []
-    for category in sorted(database.categories, key=lambda item: item.categoryName):
-        buttons.append(
-            types.InlineKeyboardButton(
-                text=category.categoryName,
-                callback_data=category.categoryid,
-            )
-        )
     return await send_message(
         bot,
         chat_id=message.chat.id,
         text=messages.CATEGORY_CHOOSE,
-        reply_markup=get_keyboard_markup(buttons=buttons),
+        reply_markup=get_keyboard_markup(buttons=category_buttons()),
     )
 
 
@@ -84,23 +208,15 @@ async def send_nosology_message(
 ) -> types.Message | SendMessage:
     bot = Bot.get_current()
 
-    buttons = []
     data = await parse_state(state=state)
     nosologies = await database.find_nosologies_by_category_id(
         category_id=data.category_id
     )
-    for nosology in sorted(nosologies, key=lambda item: item.nosologyName):
-        buttons.append(
-            types.InlineKeyboardButton(
-                text=nosology.nosologyName,
-                callback_data=nosology.nosologyid,
-            )
-        )
     return await send_message(
         bot,
         chat_id=message.chat.id,
         text=messages.NOSOLOGY_CHOOSE,
-        reply_markup=get_keyboard_markup(buttons=buttons),
+        reply_markup=get_keyboard_markup(buttons=nosology_buttons(nosologies)),
     )
 
 
@@ -109,29 +225,13 @@ async def send_course_message(
 ) -> types.Message | SendMessage:
     bot = Bot.get_current()
 
-    recommended_courses: list[Course] = await database.find_courses(
-        category_id=category_id, nosology_id=nosology_id
-    )
-    buttons = []
-    for course in sorted(recommended_courses, key=lambda item: item.Course):
-        buttons.append(
-            types.InlineKeyboardButton(
-                text=course.Course,
-                callback_data=course.Courseid,
-            )
-        )
-
-    buttons.append(
-        types.InlineKeyboardButton(
-            text=Buttons.CUSTOM_COURSE.value.text,
-            callback_data=Buttons.CUSTOM_COURSE.value.callback_data,
-        )
-    )
     return await send_message(
         bot,
         chat_id=message.chat.id,
         text=messages.COURSE_CHOOSE,
-        reply_markup=get_keyboard_markup(buttons=buttons),
+        reply_markup=await COURSE_KEYBOARDS.get(
+            category_id=category_id, nosology_id=nosology_id
+        ),
     )
 
 
@@ -174,26 +274,16 @@ async def send_data_confirmation_message(
     bot = Bot.get_current()
 
     state_data = await parse_state(state=state)
-    category = await database.find_category_by_id(category_id=state_data.category_id)
-    nosology = ""
-    if not state_data.is_accompanying_therapy:
-        nosology = await database.find_nosology_by_id(
-            nosology_id=state_data.nosology_id
-        )
-    # if state_data.is_custom_course:
-    # course = await database.find_course_by_id(course_id=state_data.course_id)
-    html_decoration = HtmlDecoration()
+    summary = await get_course_summary(state_data)
     return await send_message(
         bot,
         chat_id=message.chat.id,
-        text=messages.DATA_CONFIRMATION.format(
-            height=html_decoration.bold(state_data.height),
-            weight=html_decoration.bold(state_data.weight),
-            category_name=html_decoration.bold(category.categoryName),
-            nosology_name=html_decoration.bold(
-                nosology.nosologyName if nosology else ""
-            ),
-            course_name=html_decoration.bold(state_data.course_name),
+        text=templates.DATA_CONFIRMATION.render(
+            height=state_data.height,
+            weight=state_data.weight,
+            category_name=summary.category_name,
+            nosology_name=summary.nosology_name,
+            course_name=state_data.course_name,
         ),
         reply_markup=get_keyboard_markup(
             buttons=[Buttons.YES.value, Buttons.NEED_CORRECTION.value]
@@ -208,33 +298,17 @@ async def send_contacts_input_message(
     bot = Bot.get_current()
 
     state_data = await parse_state(state=state)
-    category = await database.find_category_by_id(category_id=state_data.category_id)
-    nosology = ""
-    if not state_data.is_accompanying_therapy:
-        nosology = await database.find_nosology_by_id(
-            nosology_id=state_data.nosology_id
-        )
-    course_name = state_data.course_name
-    if state_data.is_custom_course:
-        course_price = messages.PRICE_FOR_CUSTOM_COURSE
-    else:
-        course = await database.find_course_by_id(course_id=state_data.course_id)
-        course_price = course.price(bsa=state_data.bsa)
-        course_price = f"{course_price:.2f} {messages.CURRENCY}"
-
-    html_decoration = HtmlDecoration()
+    summary = await get_course_summary(state_data)
     return await send_message(
         bot,
         chat_id=message.chat.id,
-        text=messages.DATA_CORRECT.format(
-            height=html_decoration.bold(state_data.height),
-            weight=html_decoration.bold(state_data.weight),
-            category_name=html_decoration.bold(category.categoryName),
-            nosology_name=html_decoration.bold(
-                nosology.nosologyName if nosology else ""
-            ),
-            course_name=html_decoration.bold(course_name),
-            course_price=html_decoration.bold(course_price),
+        text=templates.DATA_CORRECT.render(
+            height=state_data.height,
+            weight=state_data.weight,
+            category_name=summary.category_name,
+            nosology_name=summary.nosology_name,
+            course_name=state_data.course_name,
+            course_price=summary.course_price,
         ),
         reply_markup=get_keyboard_markup(buttons=[Buttons.CONTACTS_INPUT.value]),
         parse_mode=ParseMode.HTML,
@@ -247,7 +321,7 @@ async def send_first_name_message(
     bot = Bot.get_current()
     if add_text is None:
         add_text = ""
-    text = md.text(add_text, md.text(messages.LEAD_FIRST_NAME), sep="\n")
+    text = templates.LEAD_FIRST_NAME.render(add_text=add_text)
     return await send_message(
         bot,
         chat_id=message.chat.id,
@@ -333,15 +407,14 @@ async def send_lead_confirmation_message(
     bot = Bot.get_current()
 
     state_data = await parse_state(state=state)
-    html_decoration = HtmlDecoration()
     return await send_message(
         bot,
         chat_id=message.chat.id,
-        text=messages.LEAD_CONFIRMATION.format(
-            first_name=html_decoration.bold(state_data.first_name or ""),
-            last_name=html_decoration.bold(state_data.last_name or ""),
-            email=html_decoration.bold(state_data.email or ""),
-            phone_number=html_decoration.bold(state_data.phone_number or ""),
+        text=templates.LEAD_CONFIRMATION.render(
+            first_name=state_data.first_name or "",
+            last_name=state_data.last_name or "",
+            email=state_data.email or "",
+            phone_number=state_data.phone_number or "",
         ),
         reply_markup=get_keyboard_markup(
             buttons=[Buttons.YES.value, Buttons.NEED_CORRECTION.value]
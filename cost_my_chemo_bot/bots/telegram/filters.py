@@ -1,30 +1,17 @@
-import phonenumbers
 from aiogram import Dispatcher, types
-from aiogram.dispatcher.filters import Command, Text
 from logfmt_logger import getLogger
-from pydantic import EmailError, EmailStr
 
+from cost_my_chemo_bot import validation
+from cost_my_chemo_bot.bots.telegram import callback_data
 from cost_my_chemo_bot.bots.telegram.keyboard import Buttons
 from cost_my_chemo_bot.bots.telegram.state import parse_state
-from cost_my_chemo_bot.db import DB
+from cost_my_chemo_bot.context import memoized_filter
+from cost_my_chemo_bot.db import CATEGORY, COURSE, DB, NOSOLOGY
 
 logger = getLogger(__name__)
 database = DB()
 
 
-welcome_callback = Text(equals=["start", "menu"], ignore_case=True)
-welcome_message = Command(commands=["start", "menu"])
-welcome_message_text = Text(equals=["start", "menu"], ignore_case=True)
-back_valid = Text(equals="back", ignore_case=True)
-
-
-async def initial_step_confirmed(callback: types.CallbackQuery) -> bool:
-    if callback.data == Buttons.YES.value.callback_data:
-        return True
-
-    return False
-
-
 async def height_valid(message: types.Message) -> bool:
     if message.is_command():
         return False
@@ -53,14 +40,9 @@ async def weight_invalid(message: types.Message) -> bool:
     return not message.text.isdigit()
 
 
+@memoized_filter
 async def category_valid(callback: types.CallbackQuery) -> bool:
-    return bool(
-        [
-            category
-            for category in database.categories
-            if callback.data == category.categoryid
-        ]
-    )
+    return callback_data.decode(CATEGORY, callback.data) is not None
 
 
 async def category_invalid(callback: types.CallbackQuery) -> bool:
@@ -73,8 +55,12 @@ async def category_invalid(callback: types.CallbackQuery) -> bool:
     return not await category_valid(callback=callback)
 
 
+@memoized_filter
 async def nosology_valid(callback: types.CallbackQuery) -> bool:
-    nosology_id = callback.data
+    nosology_id = callback_data.decode(NOSOLOGY, callback.data)
+    if nosology_id is None:
+        return False
+
     message = callback.message
     dp = Dispatcher.get_current(no_error=False)
     state = dp.current_state(chat=message.chat.id, user=callback.from_user.id)
@@ -97,7 +83,12 @@ async def nosology_invalid(callback: types.CallbackQuery) -> bool:
     return not await nosology_valid(callback=callback)
 
 
+@memoized_filter
 async def course_valid(callback: types.CallbackQuery) -> bool:
+    course_id = callback_data.decode(COURSE, callback.data)
+    if course_id is None:
+        return False
+
     message = callback.message
     dp = Dispatcher.get_current()
     state = dp.current_state(user=callback.from_user.id, chat=message.chat.id)
@@ -106,7 +97,6 @@ async def course_valid(callback: types.CallbackQuery) -> bool:
         category_id=state_data.category_id,
         nosology_id=state_data.nosology_id,
     )
-    course_id = callback.data
     course_by_id_filter = [
         course for course in filtered_courses if course.Courseid == course_id
     ]
@@ -117,7 +107,14 @@ async def course_valid(callback: types.CallbackQuery) -> bool:
     return True
 
 
+async def course_page(callback: types.CallbackQuery) -> bool:
+    return callback_data.decode_page(callback.data) is not None
+
+
 async def course_invalid(callback: types.CallbackQuery) -> bool:
+    if await course_page(callback):
+        return False
+
     if callback.data in (
         Buttons.MENU.value.callback_data,
         Buttons.BACK.value.callback_data,
@@ -130,22 +127,6 @@ async def course_invalid(callback: types.CallbackQuery) -> bool:
     return not await course_valid(callback=callback)
 
 
-async def enter_custom_course(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.CUSTOM_COURSE.value.callback_data
-
-
-async def data_confirmed(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.YES.value.callback_data
-
-
-async def data_reenter(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.NEED_CORRECTION.value.callback_data
-
-
-async def contacts_input(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.CONTACTS_INPUT.value.callback_data
-
-
 async def first_name_valid(message: types.Message) -> bool:
     if message.is_command():
         return False
@@ -160,14 +141,12 @@ async def last_name_valid(message: types.Message) -> bool:
     return bool(message.text)
 
 
+@memoized_filter
 async def email_valid(message: types.Message) -> bool:
     if message.is_command():
         return False
 
-    try:
-        return bool(EmailStr.validate(message.text))
-    except EmailError:
-        return False
+    return validation.normalize_email(message.text) is not None
 
 
 async def email_invalid(message: types.Message) -> bool:
@@ -177,15 +156,12 @@ async def email_invalid(message: types.Message) -> bool:
     return not await email_valid(message)
 
 
+@memoized_filter
 async def phone_number_valid(message: types.Message) -> bool:
     if message.is_command():
         return False
 
-    try:
-        parsed_number = phonenumbers.parse(message.text, None)
-    except phonenumbers.NumberParseException:
-        return False
-    return phonenumbers.is_valid_number(parsed_number)
+    return validation.normalize_phone_number(message.text) is not None
 
 
 async def phone_number_invalid(message: types.Message) -> bool:
@@ -193,15 +169,3 @@ async def phone_number_invalid(message: types.Message) -> bool:
         return False
 
     return not await phone_number_valid(message)
-
-
-async def lead_confirmed(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.YES.value.callback_data
-
-
-async def lead_reenter(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.NEED_CORRECTION.value.callback_data
-
-
-async def skip(callback: types.CallbackQuery) -> bool:
-    return callback.data == Buttons.SKIP.value.callback_data
@@ -1,10 +1,13 @@
 from aiogram import Dispatcher
 
+from cost_my_chemo_bot.bots.telegram.router import Router
+
 from .back import back_handler, init_back_handlers
 from .cancel import cancel_handler, init_cancel_handlers
 from .category import init_category_handlers, process_category, process_category_invalid
 from .course import init_course_handlers, process_course, process_course_invalid
 from .height import init_height_handlers, process_height, process_height_invalid
+from .inline import init_inline_handlers, process_inline_query
 from .lead import (
     init_lead_handlers,
     process_email,
@@ -14,20 +17,27 @@ from .lead import (
     process_phone_number,
 )
 from .nosology import init_nosology_handlers, process_nosology, process_nosology_invalid
+from .search import init_search_handlers, process_search
 from .weight import init_weight_handlers, process_weight, process_weight_invalid
 from .welcome import init_welcome_handlers, welcome_handler
 
 
-def init_handlers(dp: Dispatcher):
-    init_back_handlers(dp)
-    init_cancel_handlers(dp)
-    init_category_handlers(dp)
-    init_height_handlers(dp)
-    init_nosology_handlers(dp)
-    init_weight_handlers(dp)
-    init_lead_handlers(dp)
-    init_welcome_handlers(dp)
-    init_course_handlers(dp)
+def init_handlers(dp: Dispatcher) -> Router:
+    router = Router()
+    init_back_handlers(router)
+    init_cancel_handlers(router)
+    init_category_handlers(router)
+    init_height_handlers(router)
+    init_nosology_handlers(router)
+    init_weight_handlers(router)
+    init_lead_handlers(router)
+    init_welcome_handlers(router)
+    init_course_handlers(router)
+    init_search_handlers(router)
+    router.setup(dp)
+    init_inline_handlers(dp)
+    dp["router"] = router
+    return router
 
 
 __all__ = (
@@ -39,6 +49,7 @@ __all__ = (
     "process_course_invalid",
     "process_height",
     "process_height_invalid",
+    "process_inline_query",
     "init_lead_handlers",
     "process_first_name",
     "process_last_name",
@@ -47,6 +58,7 @@ __all__ = (
     "process_phone_number",
     "process_nosology",
     "process_nosology_invalid",
+    "process_search",
     "process_weight",
     "process_weight_invalid",
     "welcome_handler",
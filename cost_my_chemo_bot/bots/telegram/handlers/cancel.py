@@ -1,10 +1,10 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, types
 from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters import Command, Text
 from aiogram.dispatcher.webhook import SendMessage
 from logfmt_logger import getLogger
 
 from cost_my_chemo_bot.bots.telegram import messages
+from cost_my_chemo_bot.bots.telegram.router import ANY_STATE, Router
 from cost_my_chemo_bot.bots.telegram.send import send_message
 
 logger = getLogger(__name__)
@@ -30,8 +30,6 @@ async def cancel_handler(
     )
 
 
-def init_cancel_handlers(dp: Dispatcher):
-    dp.register_callback_query_handler(
-        cancel_handler, Text(equals=["stop"], ignore_case=True), state="*"
-    )
-    dp.register_message_handler(cancel_handler, Command(commands=["stop"]), state="*")
+def init_cancel_handlers(router: Router):
+    router.callback_query(cancel_handler, state=ANY_STATE, data=["stop"])
+    router.message(cancel_handler, state=ANY_STATE, commands=["stop"])
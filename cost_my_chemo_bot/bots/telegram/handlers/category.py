@@ -1,13 +1,14 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.webhook import SendMessage
 from logfmt_logger import getLogger
 
-from cost_my_chemo_bot.bots.telegram import dispatcher, filters, messages
+from cost_my_chemo_bot.bots.telegram import callback_data, dispatcher, filters, messages
 from cost_my_chemo_bot.bots.telegram.keyboard import get_keyboard_markup
+from cost_my_chemo_bot.bots.telegram.router import Router
 from cost_my_chemo_bot.bots.telegram.send import send_message
-from cost_my_chemo_bot.bots.telegram.state import Form, parse_state
-from cost_my_chemo_bot.db import DB
+from cost_my_chemo_bot.bots.telegram.state import Form, parse_state, transition
+from cost_my_chemo_bot.db import CATEGORY, DB
 
 logger = getLogger(__name__)
 database = DB()
@@ -17,17 +18,23 @@ async def process_category(
     callback: types.CallbackQuery, state: FSMContext
 ) -> types.Message | SendMessage:
     message = callback.message
-    await state.update_data(category_id=callback.data)
-    state_data = await parse_state(state=state)
+    category_id = callback_data.decode(CATEGORY, callback.data)
+    state_data = (await parse_state(state=state)).copy(
+        update={"category_id": category_id}
+    )
     if state_data.is_accompanying_therapy:
-        await state.set_state(Form.course)
+        await transition(state, Form.course, category_id=category_id)
         return await dispatcher.send_course_message(
             message=message,
             category_id=state_data.category_id,
             nosology_id=None,
         )
 
-    await state.set_state(Form.nosology)
+    await transition(state, Form.nosology, category_id=category_id)
+    nosologies = await database.find_nosologies_by_category_id(category_id=category_id)
+    dispatcher.prefetch_course_keyboards(
+        category_id, [nosology.nosologyid for nosology in nosologies]
+    )
     return await dispatcher.send_nosology_message(message=message, state=state)
 
 
@@ -40,15 +47,14 @@ async def process_category_invalid(
         bot,
         chat_id=callback.message.chat.id,
         text=messages.CATEGORY_WRONG,
-        reply_markup=get_keyboard_markup(buttons=sorted(database.categories)),
+        reply_markup=get_keyboard_markup(buttons=dispatcher.category_buttons()),
     )
 
 
-def init_category_handlers(dp: Dispatcher):
-    dp.register_callback_query_handler(
-        process_category, filters.category_valid, state=Form.category
+def init_category_handlers(router: Router):
+    router.callback_query(
+        process_category, state=Form.category, filter=filters.category_valid
     )
-
-    dp.register_callback_query_handler(
-        process_category_invalid, filters.category_invalid, state=Form.category
+    router.callback_query(
+        process_category_invalid, state=Form.category, filter=filters.category_invalid
     )
@@ -1,13 +1,16 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, types
 from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.webhook import SendMessage
+from aiogram.dispatcher.webhook import EditMessageReplyMarkup, SendMessage
 from logfmt_logger import getLogger
 
-from cost_my_chemo_bot.bots.telegram import dispatcher, filters, messages
+from cost_my_chemo_bot.bots.telegram import callback_data, dispatcher, filters, messages
 from cost_my_chemo_bot.bots.telegram.keyboard import Buttons, get_keyboard_markup
-from cost_my_chemo_bot.bots.telegram.send import send_message
-from cost_my_chemo_bot.bots.telegram.state import Form, parse_state
-from cost_my_chemo_bot.db import DB
+from cost_my_chemo_bot.bots.telegram.pagination import COURSE_KEYBOARDS
+from cost_my_chemo_bot.bots.telegram.router import Router
+from cost_my_chemo_bot.bots.telegram.send import edit_reply_markup, send_message
+from cost_my_chemo_bot.bots.telegram.state import Form, parse_state, transition
+from cost_my_chemo_bot.config import SEARCH_SETTINGS
+from cost_my_chemo_bot.db import COURSE, DB
 
 logger = getLogger(__name__)
 database = DB()
@@ -17,12 +20,16 @@ async def process_course(
     callback: types.CallbackQuery, state: FSMContext
 ) -> types.Message | SendMessage:
     message = callback.message
-    course = await database.find_course_by_id(course_id=callback.data)
-    await state.update_data(
+    course = await database.find_course_by_id(
+        course_id=callback_data.decode(COURSE, callback.data)
+    )
+    await transition(
+        state,
+        Form.data_confirmation,
         course_id=course.Courseid,
         course_name=course.Course,
+        is_custom_course=None,
     )
-    await state.set_state(Form.data_confirmation)
     return await dispatcher.send_data_confirmation_message(message=message, state=state)
 
 
@@ -31,33 +38,84 @@ async def process_course_invalid(callback: types.CallbackQuery, state: FSMContex
 
     message = callback.message
     data = await parse_state(state=state)
-    courses = await database.find_courses(
-        category_id=data.category_id, nosology_id=data.nosology_id
-    )
     return await send_message(
         bot,
         chat_id=message.chat.id,
         text=messages.COURSE_WRONG,
-        reply_markup=get_keyboard_markup(
-            buttons=sorted(
-                [course.Course for course in courses], [Buttons.CUSTOM_COURSE.value]
-            )
+        reply_markup=await COURSE_KEYBOARDS.get(
+            category_id=data.category_id, nosology_id=data.nosology_id
+        ),
+    )
+
+
+async def process_course_page(
+    callback: types.CallbackQuery, state: FSMContext
+) -> types.Message | EditMessageReplyMarkup:
+    bot = Bot.get_current()
+
+    message = callback.message
+    data = await parse_state(state=state)
+    # Edit the keyboard in place instead of sending a new message.
+    return await edit_reply_markup(
+        bot,
+        chat_id=message.chat.id,
+        message_id=message.message_id,
+        reply_markup=await COURSE_KEYBOARDS.get(
+            category_id=data.category_id,
+            nosology_id=data.nosology_id,
+            page=callback_data.decode_page(callback.data),
         ),
     )
 
 
 async def process_enter_custom_course(callback: types.CallbackQuery, state: FSMContext):
     message = callback.message
-    await state.update_data(is_custom_course=True)
-    await state.set_state(Form.custom_course)
+    await transition(state, Form.custom_course, is_custom_course=True)
     return await dispatcher.send_custom_course_message(message=message)
 
 
 async def process_custom_course(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
+    bot = Bot.get_current()
+
+    state_data = await parse_state(state=state)
+    courses = await database.find_courses(
+        category_id=state_data.category_id, nosology_id=state_data.nosology_id
+    )
+    found = database.search_index.search(
+        message.text or "",
+        limit=SEARCH_SETTINGS.SEARCH_LIMIT,
+        min_score=SEARCH_SETTINGS.SEARCH_MIN_SCORE,
+        allowed={course.Courseid for course in courses},
+    )
+    if not found:
+        await transition(state, Form.data_confirmation, course_name=message.text)
+        return await dispatcher.send_data_confirmation_message(
+            message=message, state=state
+        )
+
+    # Offer the catalog courses for an instant price, the typed name is kept
+    # in case none of them is right.
     await state.update_data(course_name=message.text)
-    await state.set_state(Form.data_confirmation)
+    buttons = [
+        callback_data.button(COURSE, course.Courseid, course.Course)
+        for course, _ in found
+    ]
+    buttons.append(Buttons.CUSTOM_COURSE_CONFIRM.value)
+    return await send_message(
+        bot,
+        chat_id=message.chat.id,
+        text=messages.CUSTOM_COURSE_FOUND,
+        reply_markup=get_keyboard_markup(buttons=buttons),
+    )
+
+
+async def process_custom_course_confirm(
+    callback: types.CallbackQuery, state: FSMContext
+) -> types.Message | SendMessage:
+    message = callback.message
+    await transition(state, Form.data_confirmation)
     return await dispatcher.send_data_confirmation_message(message=message, state=state)
 
 
@@ -65,33 +123,49 @@ async def process_data_confirmation(
     callback: types.CallbackQuery, state: FSMContext
 ) -> types.Message | SendMessage:
     message = callback.message
-    await state.update_data(data_confirmation=message.text)
-    await state.set_state(Form.contacts_input)
+    await transition(state, Form.contacts_input, data_confirmation=message.text)
     return await dispatcher.send_contacts_input_message(message=message, state=state)
 
 
 async def process_data_reenter(callback: types.CallbackQuery, state: FSMContext):
     message = callback.message
-    await state.set_state(Form.height)
+    await transition(state, Form.height)
     return await dispatcher.send_height_message(message=message)
 
 
-def init_course_handlers(dp: Dispatcher):
-    dp.register_callback_query_handler(
-        process_course, filters.course_valid, state=Form.course
+def init_course_handlers(router: Router):
+    router.callback_query(
+        process_course_page, state=Form.course, filter=filters.course_page
     )
-    dp.register_callback_query_handler(
-        process_course_invalid, filters.course_invalid, state=Form.course
+    router.callback_query(
+        process_course, state=Form.course, filter=filters.course_valid
+    )
+    router.callback_query(
+        process_course_invalid, state=Form.course, filter=filters.course_invalid
     )
 
-    dp.register_callback_query_handler(
-        process_enter_custom_course, filters.enter_custom_course, state=Form.course
+    router.callback_query(
+        process_enter_custom_course,
+        state=Form.course,
+        data=[Buttons.CUSTOM_COURSE.value.callback_data],
+    )
+    router.message(process_custom_course, state=Form.custom_course)
+    router.callback_query(
+        process_course, state=Form.custom_course, filter=filters.course_valid
+    )
+    router.callback_query(
+        process_custom_course_confirm,
+        state=Form.custom_course,
+        data=[Buttons.CUSTOM_COURSE_CONFIRM.value.callback_data],
     )
-    dp.register_message_handler(process_custom_course, state=Form.custom_course)
 
-    dp.register_callback_query_handler(
-        process_data_confirmation, filters.data_confirmed, state=Form.data_confirmation
+    router.callback_query(
+        process_data_confirmation,
+        state=Form.data_confirmation,
+        data=[Buttons.YES.value.callback_data],
     )
-    dp.register_callback_query_handler(
-        process_data_reenter, filters.data_reenter, state=Form.data_confirmation
+    router.callback_query(
+        process_data_reenter,
+        state=Form.data_confirmation,
+        data=[Buttons.NEED_CORRECTION.value.callback_data],
     )
@@ -1,12 +1,13 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.webhook import SendMessage
 from logfmt_logger import getLogger
 
 from cost_my_chemo_bot.bots.telegram import dispatcher, filters, messages
 from cost_my_chemo_bot.bots.telegram.keyboard import get_keyboard_markup
+from cost_my_chemo_bot.bots.telegram.router import Router
 from cost_my_chemo_bot.bots.telegram.send import send_message
-from cost_my_chemo_bot.bots.telegram.state import Form
+from cost_my_chemo_bot.bots.telegram.state import Form, transition
 from cost_my_chemo_bot.db import DB
 
 logger = getLogger(__name__)
@@ -16,8 +17,7 @@ database = DB()
 async def process_height(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
-    await state.update_data(height=int(message.text))
-    await state.set_state(Form.weight)
+    await transition(state, Form.weight, height=int(message.text))
     return await dispatcher.send_weight_message(message=message)
 
 
@@ -32,9 +32,8 @@ async def process_height_invalid(message: types.Message):
     )
 
 
-def init_height_handlers(dp: Dispatcher):
-    dp.register_message_handler(process_height, filters.height_valid, state=Form.height)
-
-    dp.register_message_handler(
-        process_height_invalid, filters.height_invalid, state=Form.height
+def init_height_handlers(router: Router):
+    router.message(process_height, state=Form.height, filter=filters.height_valid)
+    router.message(
+        process_height_invalid, state=Form.height, filter=filters.height_invalid
     )
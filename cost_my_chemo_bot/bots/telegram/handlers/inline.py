@@ -0,0 +1,99 @@
+import collections
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import AnswerInlineQuery
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot import tracing
+from cost_my_chemo_bot.bots.telegram import messages
+from cost_my_chemo_bot.bots.telegram.send import answer_inline_query
+from cost_my_chemo_bot.config import SEARCH_SETTINGS
+from cost_my_chemo_bot.db import DB, Course
+from cost_my_chemo_bot.search import normalize
+
+logger = getLogger(__name__)
+database = DB()
+
+
+class InlineResultsCache:
+    """Rendered inline results by (normalized query, catalog content), LRU."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._results: collections.OrderedDict[
+            tuple[tuple[str, ...], int], list[types.InlineQueryResultArticle]
+        ] = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> list[types.InlineQueryResultArticle] | None:
+        results = self._results.get(key)
+        if results is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._results.move_to_end(key)
+        return results
+
+    def put(self, key, results: list[types.InlineQueryResultArticle]) -> None:
+        self._results[key] = results
+        if len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+
+INLINE_RESULTS_CACHE = InlineResultsCache(max_size=SEARCH_SETTINGS.INLINE_CACHE_SIZE)
+
+
+def render_course(course: Course, bot_username: str) -> types.InlineQueryResultArticle:
+    if course.fixPrice:
+        course_price = f"{course.coefficient:.2f} {messages.CURRENCY}"
+    else:
+        course_price = messages.INLINE_PRICE_DEPENDS
+    return types.InlineQueryResultArticle(
+        id=course.Courseid,
+        title=course.Course,
+        description=course_price,
+        input_message_content=types.InputTextMessageContent(
+            message_text=messages.INLINE_COURSE.format(
+                course_name=course.Course,
+                course_price=course_price,
+                bot_username=bot_username,
+            )
+        ),
+    )
+
+
+@tracing.traced("handler")
+async def process_inline_query(
+    inline_query: types.InlineQuery,
+) -> bool | AnswerInlineQuery:
+    bot = Bot.get_current()
+
+    # Results show names and fixed prices, which change without changing ids.
+    key = (normalize(inline_query.query), database.index.content_version)
+    results = INLINE_RESULTS_CACHE.get(key)
+    if results is None:
+        me = await bot.me
+        results = [
+            render_course(course, bot_username=me.username)
+            for course in database.prefix_index.search(
+                inline_query.query, limit=SEARCH_SETTINGS.INLINE_RESULTS_LIMIT
+            )
+        ]
+        INLINE_RESULTS_CACHE.put(key, results)
+
+    # Results don't depend on the user, Telegram can serve repeats itself.
+    return await answer_inline_query(
+        bot,
+        inline_query_id=inline_query.id,
+        results=results,
+        cache_time=SEARCH_SETTINGS.INLINE_CACHE_TIME,
+        is_personal=False,
+    )
+
+
+def init_inline_handlers(dp: Dispatcher):
+    # Inline queries aren't bound to a chat, so they bypass the state router.
+    dp.register_inline_handler(process_inline_query, state="*")
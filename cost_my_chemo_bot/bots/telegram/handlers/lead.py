@@ -1,16 +1,19 @@
-import httpx
-from aiogram import Dispatcher, types
+from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.webhook import SendMessage
 from logfmt_logger import getLogger
 
+from cost_my_chemo_bot import tracing, validation
 from cost_my_chemo_bot.bots.telegram import dispatcher, filters
-from cost_my_chemo_bot.bots.telegram.state import Form, parse_state
-from cost_my_chemo_bot.config import SETTINGS
+from cost_my_chemo_bot.bots.telegram.keyboard import Buttons
+from cost_my_chemo_bot.bots.telegram.router import Router
+from cost_my_chemo_bot.bots.telegram.state import Form, parse_state, transition
+from cost_my_chemo_bot.outbox import LEAD_OUTBOX_WORKER
 
 logger = getLogger(__name__)
 
 
+@tracing.traced("save_lead")
 async def save_lead(message: types.Message, state: FSMContext):
     state_data = await parse_state(state=state)
 
@@ -26,49 +29,39 @@ async def save_lead(message: types.Message, state: FSMContext):
                                  Курс: {state_data.course_name} | Вес: {state_data.weight} | Рост: {state_data.height} 
                              """,
     }
-    logger.info("save lead: %s", params)
-    async with httpx.AsyncClient(base_url=SETTINGS.BITRIX_URL) as client:
-        resp = await client.post(
-            f"{SETTINGS.BITRIX_TOKEN.get_secret_value()}/crm.lead.add.json",
-            params=params,
-        )
-
-    if resp.status_code != 200:
-        logger.error("save lead: %s", resp.text)
-    else:
-        logger.info("save lead: %s", resp.text)
+    # Delivered to Bitrix in background, see `LeadOutboxWorker`.
+    await LEAD_OUTBOX_WORKER.enqueue(params)
 
 
 async def process_contacts_input(
     callback: types.CallbackQuery, state: FSMContext
 ) -> types.Message | SendMessage:
     message = callback.message
-    await state.update_data(contacts_input=callback.data)
-    await state.set_state(Form.first_name)
+    await transition(state, Form.first_name, contacts_input=callback.data)
     return await dispatcher.send_first_name_message(message=message)
 
 
 async def process_first_name(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
-    await state.update_data(first_name=message.text)
-    await state.set_state(Form.last_name)
+    await transition(state, Form.last_name, first_name=message.text)
     return await dispatcher.send_last_name_message(message=message)
 
 
 async def process_last_name(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
-    await state.update_data(last_name=message.text)
-    await state.set_state(Form.email)
+    await transition(state, Form.email, last_name=message.text)
     return await dispatcher.send_email_message(message=message)
 
 
 async def process_email(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
-    await state.update_data(email=message.text)
-    await state.set_state(Form.phone_number)
+    # Validated by the filter, the normalized value comes from its cache.
+    await transition(
+        state, Form.phone_number, email=validation.normalize_email(message.text)
+    )
     return await dispatcher.send_phone_number_message(message=message)
 
 
@@ -81,8 +74,11 @@ async def process_email_invalid(
 async def process_phone_number(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
-    await state.update_data(phone_number=message.text)
-    await state.set_state(Form.lead_confirmation)
+    await transition(
+        state,
+        Form.lead_confirmation,
+        phone_number=validation.normalize_phone_number(message.text),
+    )
     return await dispatcher.send_lead_confirmation_message(message=message, state=state)
 
 
@@ -103,7 +99,7 @@ async def process_lead_confirmation(
 
 async def process_lead_reenter(callback: types.CallbackQuery, state: FSMContext):
     message = callback.message
-    await state.set_state(Form.first_name)
+    await transition(state, Form.first_name)
     return await dispatcher.send_first_name_message(message=message)
 
 
@@ -126,41 +122,46 @@ async def process_skip(
         return await process_phone_number(message=message, state=state)
 
 
-def init_lead_handlers(dp: Dispatcher):
-    dp.register_callback_query_handler(
-        process_contacts_input, filters.contacts_input, state=Form.contacts_input
+def init_lead_handlers(router: Router):
+    router.callback_query(
+        process_contacts_input,
+        state=Form.contacts_input,
+        data=[Buttons.CONTACTS_INPUT.value.callback_data],
     )
-    dp.register_message_handler(
-        process_first_name, filters.first_name_valid, state=Form.first_name
+    router.message(
+        process_first_name, state=Form.first_name, filter=filters.first_name_valid
     )
-    dp.register_message_handler(
-        process_last_name, filters.last_name_valid, state=Form.last_name
+    router.message(
+        process_last_name, state=Form.last_name, filter=filters.last_name_valid
     )
-    dp.register_message_handler(process_email, filters.email_valid, state=Form.email)
-    dp.register_message_handler(
-        process_email_invalid, filters.email_invalid, state=Form.email
+    router.message(process_email, state=Form.email, filter=filters.email_valid)
+    router.message(
+        process_email_invalid, state=Form.email, filter=filters.email_invalid
     )
-    dp.register_message_handler(
-        process_phone_number, filters.phone_number_valid, state=Form.phone_number
+    router.message(
+        process_phone_number,
+        state=Form.phone_number,
+        filter=filters.phone_number_valid,
     )
-    dp.register_message_handler(
+    router.message(
         process_phone_number_invalid,
-        filters.phone_number_invalid,
         state=Form.phone_number,
+        filter=filters.phone_number_invalid,
     )
 
-    dp.register_callback_query_handler(
-        process_lead_confirmation, filters.lead_confirmed, state=Form.lead_confirmation
+    router.callback_query(
+        process_lead_confirmation,
+        state=Form.lead_confirmation,
+        data=[Buttons.YES.value.callback_data],
     )
-    dp.register_callback_query_handler(
-        process_lead_reenter, filters.lead_reenter, state=Form.lead_confirmation
+    router.callback_query(
+        process_lead_reenter,
+        state=Form.lead_confirmation,
+        data=[Buttons.NEED_CORRECTION.value.callback_data],
     )
 
-    dp.register_callback_query_handler(
-        process_skip, filters.skip, state=Form.first_name
-    )
-    dp.register_callback_query_handler(process_skip, filters.skip, state=Form.last_name)
-    dp.register_callback_query_handler(process_skip, filters.skip, state=Form.email)
-    dp.register_callback_query_handler(
-        process_skip, filters.skip, state=Form.phone_number
+    router.callback_query(
+        process_skip,
+        state=[Form.first_name, Form.last_name, Form.email, Form.phone_number],
+        data=[Buttons.SKIP.value.callback_data],
     )
@@ -1,12 +1,13 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, types
 from aiogram.dispatcher import FSMContext
 from logfmt_logger import getLogger
 
-from cost_my_chemo_bot.bots.telegram import dispatcher, filters, messages
+from cost_my_chemo_bot.bots.telegram import callback_data, dispatcher, filters, messages
 from cost_my_chemo_bot.bots.telegram.keyboard import get_keyboard_markup
+from cost_my_chemo_bot.bots.telegram.router import Router
 from cost_my_chemo_bot.bots.telegram.send import send_message
-from cost_my_chemo_bot.bots.telegram.state import Form, parse_state
-from cost_my_chemo_bot.db import DB
+from cost_my_chemo_bot.bots.telegram.state import Form, parse_state, transition
+from cost_my_chemo_bot.db import DB, NOSOLOGY
 
 logger = getLogger(__name__)
 database = DB()
@@ -16,44 +17,38 @@ async def process_nosology(
     callback: types.CallbackQuery, state: FSMContext
 ) -> types.Message:
     message = callback.message
-    await state.update_data(nosology_id=callback.data)
+    nosology_id = callback_data.decode(NOSOLOGY, callback.data)
     state_data = await parse_state(state=state)
-    await state.set_state(Form.course)
+    await transition(state, Form.course, nosology_id=nosology_id)
+    dispatcher.prefetch_course_keyboards(state_data.category_id, [nosology_id], page=1)
     return await dispatcher.send_course_message(
         message=message,
         category_id=state_data.category_id,
-        nosology_id=state_data.nosology_id,
+        nosology_id=nosology_id,
     )
 
 
-async def process_nosology_invalid(message: types.Message, state: FSMContext):
+async def process_nosology_invalid(callback: types.CallbackQuery, state: FSMContext):
     bot = Bot.get_current()
 
-    buttons = []
     data = await parse_state(state=state)
     nosologies = await database.find_nosologies_by_category_id(
         category_id=data.category_id
     )
-    for nosology in sorted(nosologies, key=lambda item: item.nosologyName):
-        buttons.append(
-            types.InlineKeyboardButton(
-                text=nosology.nosologyName,
-                callback_data=nosology.nosologyid,
-            )
-        )
     return await send_message(
         bot,
-        chat_id=message.chat.id,
+        chat_id=callback.message.chat.id,
         text=messages.NOSOLOGY_WRONG,
-        reply_markup=get_keyboard_markup(buttons=buttons),
+        reply_markup=get_keyboard_markup(
+            buttons=dispatcher.nosology_buttons(nosologies)
+        ),
     )
 
 
-def init_nosology_handlers(dp: Dispatcher):
-    dp.register_callback_query_handler(
-        process_nosology, filters.nosology_valid, state=Form.nosology
+def init_nosology_handlers(router: Router):
+    router.callback_query(
+        process_nosology, state=Form.nosology, filter=filters.nosology_valid
     )
-
-    dp.register_callback_query_handler(
-        process_nosology_invalid, filters.nosology_invalid, state=Form.nosology
+    router.callback_query(
+        process_nosology_invalid, state=Form.nosology, filter=filters.nosology_invalid
     )
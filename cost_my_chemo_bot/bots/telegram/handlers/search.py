@@ -0,0 +1,60 @@
+from aiogram import Bot, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.webhook import SendMessage
+from aiogram.types import ParseMode
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot.bots.telegram import messages, templates
+from cost_my_chemo_bot.bots.telegram.router import ANY_STATE, Router
+from cost_my_chemo_bot.bots.telegram.send import send_message
+from cost_my_chemo_bot.bots.telegram.state import parse_state
+from cost_my_chemo_bot.config import SEARCH_SETTINGS
+from cost_my_chemo_bot.db import DB
+
+logger = getLogger(__name__)
+database = DB()
+
+
+async def process_search(
+    message: types.Message, state: FSMContext
+) -> types.Message | SendMessage:
+    bot = Bot.get_current()
+
+    query = message.get_args()
+    if not query:
+        return await send_message(
+            bot, chat_id=message.chat.id, text=messages.SEARCH_USAGE
+        )
+
+    found = database.search_index.search(
+        query,
+        limit=SEARCH_SETTINGS.SEARCH_LIMIT,
+        min_score=SEARCH_SETTINGS.SEARCH_MIN_SCORE,
+    )
+    logger.debug("search %r: %s results", query, len(found))
+    if not found:
+        return await send_message(
+            bot, chat_id=message.chat.id, text=messages.SEARCH_NOT_FOUND
+        )
+
+    # Prices are shown once height and weight are known.
+    state_data = await parse_state(state=state)
+    lines = [messages.SEARCH_FOUND]
+    for course, _ in found:
+        line = templates.HTML.quote(course.Course)
+        if state_data.height and state_data.weight:
+            course_price = course.price(bsa=state_data.bsa)
+            line += " — " + templates.bold_html(
+                f"{course_price:.2f} {messages.CURRENCY}"
+            )
+        lines.append(line)
+    return await send_message(
+        bot,
+        chat_id=message.chat.id,
+        text="\n".join(lines),
+        parse_mode=ParseMode.HTML,
+    )
+
+
+def init_search_handlers(router: Router):
+    router.message(process_search, state=ANY_STATE, commands=["search"])
@@ -1,12 +1,13 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.webhook import SendMessage
 from logfmt_logger import getLogger
 
 from cost_my_chemo_bot.bots.telegram import dispatcher, filters, messages
 from cost_my_chemo_bot.bots.telegram.keyboard import get_keyboard_markup
+from cost_my_chemo_bot.bots.telegram.router import Router
 from cost_my_chemo_bot.bots.telegram.send import send_message
-from cost_my_chemo_bot.bots.telegram.state import Form
+from cost_my_chemo_bot.bots.telegram.state import Form, transition
 
 logger = getLogger(__name__)
 
@@ -14,8 +15,7 @@ logger = getLogger(__name__)
 async def process_weight(
     message: types.Message, state: FSMContext
 ) -> types.Message | SendMessage:
-    await state.update_data(weight=int(message.text))
-    await state.set_state(Form.category)
+    await transition(state, Form.category, weight=int(message.text))
     return await dispatcher.send_category_message(message=message)
 
 
@@ -30,9 +30,8 @@ async def process_weight_invalid(message: types.Message):
     )
 
 
-def init_weight_handlers(dp: Dispatcher):
-    dp.register_message_handler(process_weight, filters.weight_valid, state=Form.weight)
-
-    dp.register_message_handler(
-        process_weight_invalid, filters.weight_invalid, state=Form.weight
+def init_weight_handlers(router: Router):
+    router.message(process_weight, state=Form.weight, filter=filters.weight_valid)
+    router.message(
+        process_weight_invalid, state=Form.weight, filter=filters.weight_invalid
     )
@@ -1,11 +1,12 @@
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters import CommandStart
 from aiogram.dispatcher.webhook import SendMessage
 from logfmt_logger import getLogger
 
-from cost_my_chemo_bot.bots.telegram import dispatcher, filters
-from cost_my_chemo_bot.bots.telegram.state import Form
+from cost_my_chemo_bot.bots.telegram import dispatcher
+from cost_my_chemo_bot.bots.telegram.keyboard import Buttons
+from cost_my_chemo_bot.bots.telegram.router import ANY_STATE, Router
+from cost_my_chemo_bot.bots.telegram.state import Form, transition
 
 logger = getLogger(__name__)
 
@@ -30,8 +31,7 @@ async def welcome_handler(
         logger.info("Cancelling state %r", current_state)
         await state.finish()
 
-    await state.update_data(initial=True)
-    await state.set_state(Form.initial)
+    await transition(state, Form.initial, initial=True)
     return await dispatcher.send_welcome_message(message=message)
 
 
@@ -43,31 +43,24 @@ async def process_initial_step(
     else:
         message = callback_or_message
 
-    await state.set_state(Form.height)
+    await transition(state, Form.height)
     return await dispatcher.send_height_message(message=message)
 
 
-def init_welcome_handlers(dp: Dispatcher):
-    # We need to register welcome handler with each filter separately, because
-    # it won't process commands otherwise.
-    dp.register_message_handler(
+def init_welcome_handlers(router: Router):
+    router.message(
         welcome_handler,
-        CommandStart(),
-        state="*",
+        state=ANY_STATE,
+        commands=["start", "menu"],
+        text=["start", "menu"],
     )
-    dp.register_message_handler(
+    router.callback_query(
         welcome_handler,
-        filters.welcome_message,
-        state="*",
+        state=ANY_STATE,
+        data=["start", Buttons.MENU.value.callback_data],
     )
-    dp.register_message_handler(
-        welcome_handler,
-        filters.welcome_message_text,
-        state="*",
-    )
-    dp.register_callback_query_handler(
-        welcome_handler, filters.welcome_callback, state="*"
-    )
-    dp.register_callback_query_handler(
-        process_initial_step, filters.initial_step_confirmed, state=Form.initial
+    router.callback_query(
+        process_initial_step,
+        state=Form.initial,
+        data=[Buttons.YES.value.callback_data],
     )
@@ -21,6 +21,9 @@ class Buttons(enum.Enum):
     CUSTOM_COURSE = types.InlineKeyboardButton(
         "❓Не нашли свой курс?", callback_data="custom_course"
     )
+    CUSTOM_COURSE_CONFIRM = types.InlineKeyboardButton(
+        "✏ Моего курса нет в списке", callback_data="custom_course_confirm"
+    )
 
 
 def get_keyboard_markup(
@@ -24,6 +24,8 @@ COURSE_CHOOSE = (
 COURSE_WRONG = (
     "Неверно выбран курс или препарат. Выберите курс или препарат на клавиатуре."
 )
+PREVIOUS_PAGE = "◀ Предыдущие"
+NEXT_PAGE = "Следующие ▶"
 CUSTOM_COURSE_INPUT = "Напишите название курса, который вы искали, или названия препаратов – и мы рассчитаем их стоимость."
 DATA_CONFIRMATION = dedent(
     """
@@ -37,6 +39,16 @@ DATA_CONFIRMATION = dedent(
 """
 )
 PRICE_FOR_CUSTOM_COURSE = "Цена по запросу"
+CUSTOM_COURSE_FOUND = "Возможно, вы имели в виду один из этих курсов? Выберите его, чтобы сразу узнать стоимость."
+SEARCH_USAGE = (
+    "Напишите название курса или препарата после команды, например: /search паклитаксел"
+)
+SEARCH_NOT_FOUND = "Ничего не нашлось. Попробуйте написать название иначе."
+SEARCH_FOUND = "Вот что нашлось:"
+INLINE_PRICE_DEPENDS = "Стоимость зависит от роста и веса"
+INLINE_COURSE = (
+    "{course_name}\n{course_price}\n\nРассчитать стоимость курса: @{bot_username}"
+)
 CURRENCY = "рублей"
 DATA_CORRECT = dedent(
     """
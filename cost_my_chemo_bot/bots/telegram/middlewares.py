@@ -0,0 +1,49 @@
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from cost_my_chemo_bot import context, metrics
+from cost_my_chemo_bot.tracing import TRACER
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        context.begin_update()
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        context.end_update()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Observes update processing time
+
+    Router sets the state and handler labels, other handlers are labeled by
+    their function name.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        metrics.reset_update_route()
+        data["metrics_started"] = time.perf_counter()
+
+    async def on_process_inline_query(self, inline_query: types.InlineQuery, data):
+        metrics.set_update_route(None, current_handler.get().__name__)
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        metrics.observe_update(time.perf_counter() - data["metrics_started"])
+
+
+class TracingMiddleware(BaseMiddleware):
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        TRACER.start_trace("update", update_id=update.update_id)
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        TRACER.finish_trace()
@@ -0,0 +1,126 @@
+import collections
+import math
+
+from aiogram import types
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot.bots.telegram import callback_data, messages
+from cost_my_chemo_bot.bots.telegram.keyboard import Buttons, get_keyboard_markup
+from cost_my_chemo_bot.config import KEYBOARD_SETTINGS, SETTINGS
+from cost_my_chemo_bot.db import COURSE, DB
+
+logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
+database = DB()
+
+PageKey = tuple[str, str | None, int]
+
+
+class CourseKeyboards:
+    """
+    Paginated course keyboards, rendered on demand.
+
+    Sorted course lists and rendered pages are kept per (category, nosology) for
+    the current catalog content, everything is dropped when it changes.
+    Pages are evicted in LRU order above `max_pages`.
+    """
+
+    def __init__(self, page_size: int, max_pages: int):
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._version: int | None = None
+        self._courses: dict[tuple[str, str | None], tuple] = {}
+        self._pages: collections.OrderedDict[
+            PageKey, types.InlineKeyboardMarkup
+        ] = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self) -> None:
+        # Labels and groupings change with names and links, not only with ids.
+        version = database.index.content_version
+        if version != self._version:
+            self._version = version
+            self._courses.clear()
+            self._pages.clear()
+
+    def _sorted_courses(self, category_id: str, nosology_id: str | None):
+        key = (category_id, nosology_id)
+        courses = self._courses.get(key)
+        if courses is None:
+            found = database.filter_courses(
+                category_id=category_id, nosology_id=nosology_id
+            )
+            courses = tuple(sorted(found, key=lambda item: item.Course))
+            self._courses[key] = courses
+        return courses
+
+    def _render(self, courses: tuple, page: int) -> types.InlineKeyboardMarkup:
+        pages = max(math.ceil(len(courses) / self.page_size), 1)
+        start = page * self.page_size
+        buttons = [
+            callback_data.button(COURSE, course.Courseid, course.Course)
+            for course in courses[start : start + self.page_size]
+        ]
+        buttons.append(Buttons.CUSTOM_COURSE.value)
+        keyboard_markup = get_keyboard_markup(buttons=buttons)
+
+        navigation = []
+        if page > 0:
+            navigation.append(
+                types.InlineKeyboardButton(
+                    text=messages.PREVIOUS_PAGE,
+                    callback_data=callback_data.encode_page(page - 1),
+                )
+            )
+        if page + 1 < pages:
+            navigation.append(
+                types.InlineKeyboardButton(
+                    text=messages.NEXT_PAGE,
+                    callback_data=callback_data.encode_page(page + 1),
+                )
+            )
+        if navigation:
+            # Above "custom course" and "back / menu" rows.
+            keyboard_markup.inline_keyboard.insert(-2, navigation)
+        return keyboard_markup
+
+    async def get(
+        self,
+        category_id: str,
+        nosology_id: str | None,
+        page: int = 0,
+        reload: bool = True,
+    ) -> types.InlineKeyboardMarkup:
+        """
+        Keyboard with a page of courses
+
+        :param reload: reload the catalog first, background warming uses the
+            loaded one
+        """
+        if reload:
+            await database.reload_db()
+        self._check_version()
+        courses = self._sorted_courses(category_id, nosology_id)
+        pages = max(math.ceil(len(courses) / self.page_size), 1)
+        page = min(max(page, 0), pages - 1)
+
+        key = (category_id, nosology_id, page)
+        keyboard_markup = self._pages.get(key)
+        if keyboard_markup is not None:
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return keyboard_markup
+
+        self.misses += 1
+        keyboard_markup = self._render(courses, page)
+        self._pages[key] = keyboard_markup
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return keyboard_markup
+
+
+COURSE_KEYBOARDS = CourseKeyboards(
+    page_size=KEYBOARD_SETTINGS.KEYBOARD_PAGE_SIZE,
+    max_pages=KEYBOARD_SETTINGS.KEYBOARD_CACHE_SIZE,
+)
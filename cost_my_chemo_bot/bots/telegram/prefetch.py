@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import contextvars
+import dataclasses
+import typing
+
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot.config import PREFETCH_SETTINGS, SETTINGS
+from cost_my_chemo_bot.db import DB
+
+logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
+database = DB()
+
+T = typing.TypeVar("T")
+
+
+@dataclasses.dataclass
+class PrefetchStats:
+    scheduled: int = 0
+    dropped: int = 0
+    failed: int = 0
+    # Value was ready, still being computed in background, or not there.
+    hits: int = 0
+    inflight_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.inflight_hits + self.misses
+        return (self.hits + self.inflight_hits) / total if total else 0.0
+
+
+class Prefetcher:
+    """
+    Values for the likely next funnel step, computed in background.
+
+    Handlers `schedule` what the next update will probably need and `get` it
+    when it's needed; a value still being computed is awaited instead of being
+    computed twice. At most `concurrency` values are computed at a time and at
+    most `max_pending` wait for their turn, extra work is dropped. Values are
+    kept per catalog content, LRU above `max_size`.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int, max_size: int):
+        self.max_pending = max_pending
+        self.max_size = max_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._version: int | None = None
+        self._values: collections.OrderedDict[
+            typing.Hashable, typing.Any
+        ] = collections.OrderedDict()
+        self._pending: dict[typing.Hashable, asyncio.Task] = {}
+        self.stats = PrefetchStats()
+
+    def _check_version(self) -> None:
+        # Values are rendered from names and prices, not only from ids.
+        version = database.index.content_version
+        if version != self._version:
+            self._version = version
+            self._values.clear()
+
+    def _store(self, key: typing.Hashable, value: typing.Any) -> None:
+        self._values[key] = value
+        if len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    async def _compute(
+        self,
+        key: typing.Hashable,
+        factory: typing.Callable[[], typing.Awaitable[T]],
+    ) -> T:
+        try:
+            async with self._semaphore:
+                value = await factory()
+            self._store(key, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+    def schedule(
+        self,
+        key: typing.Hashable,
+        factory: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> None:
+        self._check_version()
+        if key in self._values or key in self._pending:
+            return
+
+        if len(self._pending) >= self.max_pending:
+            self.stats.dropped += 1
+            return
+
+        # A fresh context, so the task doesn't use the update's memoized values.
+        # Tasks copy the current context, `create_task(context=...)` is 3.11+.
+        task = contextvars.Context().run(
+            asyncio.create_task, self._compute(key, factory)
+        )
+        task.add_done_callback(self._log_failure)
+        self._pending[key] = task
+        self.stats.scheduled += 1
+
+    def _log_failure(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.stats.failed += 1
+            logger.warning("prefetch failed: %r", task.exception())
+
+    async def get(
+        self,
+        key: typing.Hashable,
+        factory: typing.Callable[[], typing.Awaitable[T]],
+    ) -> T:
+        self._check_version()
+        try:
+            value = self._values[key]
+        except KeyError:
+            pass
+        else:
+            self.stats.hits += 1
+            self._values.move_to_end(key)
+            return value
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.stats.inflight_hits += 1
+            try:
+                return await asyncio.shield(task)
+            except Exception:
+                # Computed again below, the failure is logged by the callback.
+                pass
+
+        self.stats.misses += 1
+        value = await factory()
+        self._store(key, value)
+        return value
+
+    async def close(self) -> None:
+        for task in list(self._pending.values()):
+            task.cancel()
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+        self._pending.clear()
+
+
+PREFETCHER = Prefetcher(
+    concurrency=PREFETCH_SETTINGS.PREFETCH_CONCURRENCY,
+    max_pending=PREFETCH_SETTINGS.PREFETCH_MAX_PENDING,
+    max_size=PREFETCH_SETTINGS.PREFETCH_CACHE_SIZE,
+)
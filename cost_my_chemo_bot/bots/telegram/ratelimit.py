@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import time
+import typing
+
+from aiogram.utils.exceptions import RetryAfter
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot.config import RATE_LIMIT_SETTINGS
+
+logger = getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token, possibly in debt, and return how long to wait for it."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+
+        return -self.tokens / self.rate
+
+    def try_consume(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class SendScheduler:
+    """
+    Paces outgoing messages against Telegram limits.
+
+    Every send waits for its chat bucket first and for the global bucket after
+    that, so a busy chat doesn't hold global tokens. `RetryAfter` pauses only the
+    chat it was raised for, and all queued sends to that chat wake up together
+    after the pause instead of retrying one by one.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        max_chats: int = 10_000,
+    ):
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chat_buckets: collections.OrderedDict[
+            int | str, TokenBucket
+        ] = collections.OrderedDict()
+        self._paused_until: dict[int | str, float] = {}
+
+        self.sent = 0
+        self.retried = 0
+        self.queued = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(rate=self.chat_rate, capacity=self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_pause(self, chat_id: int | str) -> None:
+        while True:
+            paused_until = self._paused_until.get(chat_id)
+            if paused_until is None:
+                break
+            delay = paused_until - time.monotonic()
+            if delay <= 0:
+                self._paused_until.pop(chat_id, None)
+                break
+            await asyncio.sleep(delay)
+
+    async def _wait_turn(self, chat_id: int | str) -> None:
+        await self._wait_pause(chat_id)
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay:
+            await asyncio.sleep(delay)
+            # The chat could have been flooded while we were waiting.
+            await self._wait_pause(chat_id)
+
+        delay = self.global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _pause_chat(self, chat_id: int | str, timeout: float) -> None:
+        paused_until = time.monotonic() + timeout
+        if paused_until > self._paused_until.get(chat_id, 0):
+            self._paused_until[chat_id] = paused_until
+
+    def _observe_wait(self, wait: float) -> None:
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    async def send(
+        self, chat_id: int | str, send: typing.Callable[[], typing.Awaitable[T]]
+    ) -> T:
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            self.queued += 1
+            try:
+                await self._wait_turn(chat_id)
+            finally:
+                self.queued -= 1
+            wait = time.monotonic() - started
+            self._observe_wait(wait)
+            if wait > 1:
+                logger.info("send to chat %s waited in queue %.3fs", chat_id, wait)
+
+            try:
+                result = await send()
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    "chat %s is flooded, retry in %ss, attempt %s",
+                    chat_id,
+                    e.timeout,
+                    attempt,
+                )
+                self.retried += 1
+                self._pause_chat(chat_id, e.timeout)
+                continue
+
+            self.sent += 1
+            return result
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "queued": self.queued,
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+            "wait_avg": self.wait_total / self.sent if self.sent else 0.0,
+        }
+
+
+SEND_SCHEDULER = SendScheduler(
+    global_rate=RATE_LIMIT_SETTINGS.TELEGRAM_GLOBAL_RATE,
+    chat_rate=RATE_LIMIT_SETTINGS.TELEGRAM_CHAT_RATE,
+    chat_burst=RATE_LIMIT_SETTINGS.TELEGRAM_CHAT_BURST,
+    max_retries=RATE_LIMIT_SETTINGS.TELEGRAM_MAX_RETRIES,
+)
@@ -0,0 +1,252 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import time
+import typing
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot import validation
+from cost_my_chemo_bot.bots.telegram.state import Form
+from cost_my_chemo_bot.bots.telegram.throttling import get_update_address
+from cost_my_chemo_bot.config import RECORDER_SETTINGS
+from cost_my_chemo_bot.db import DB
+
+logger = getLogger(__name__)
+database = DB()
+
+# Objects with user identity, by key in Telegram objects.
+IDENTITY_KEYS = {"from", "chat", "user", "sender_chat"}
+PERSONAL_KEYS = {"first_name", "last_name", "username", "title", "bio"}
+DROPPED_KEYS = {"contact", "location", "photo", "document", "voice", "video"}
+# Messages in Telegram objects, by key. Only the text the user typed in the
+# update is kept, bot messages under callback queries repeat the contacts back
+# and replies quote them.
+MESSAGE_KEYS = {
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "reply_to_message",
+    "pinned_message",
+}
+TEXT_KEYS = {"text", "caption"}
+# Offsets into replaced texts.
+ENTITY_KEYS = {"entities", "caption_entities"}
+REDACTED = "..."
+# Flushed records survive a crash, the rest of the gzip stream doesn't.
+FLUSH_EVERY = 100
+CONTACT_STATES = {
+    Form.first_name.state,
+    Form.last_name.state,
+    Form.email.state,
+    Form.phone_number.state,
+}
+
+
+class UpdateRecorder:
+    """
+    Writes anonymized updates with timing and FSM transitions as JSON lines
+
+    User and chat ids are replaced with keyed hashes, so one user's updates
+    stay together but can't be traced back without the salt. Names and
+    contacts typed in the funnel are replaced with placeholders that pass
+    the same validation, texts of all other messages in an update (bot
+    messages of callback queries, replies, edits) are redacted. Files are
+    gzipped and rotated every `updates_per_file` updates.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        updates_per_file: int = 10_000,
+        salt: bytes | None = None,
+    ):
+        self.directory = directory
+        self.updates_per_file = updates_per_file
+        self._salt = salt if salt is not None else os.urandom(16)
+        self._started = time.monotonic()
+        self._file: typing.TextIO | None = None
+        self._file_updates = 0
+        self._files = 0
+
+        self.recorded = 0
+
+    def pseudonym(self, value: int) -> int:
+        digest = hashlib.blake2b(str(value).encode(), key=self._salt, digest_size=6)
+        return int.from_bytes(digest.digest(), "big")
+
+    def _anonymize_object(self, value: typing.Any) -> typing.Any:
+        if isinstance(value, list):
+            return [self._anonymize_object(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        for key, item in value.items():
+            if key in DROPPED_KEYS or key in PERSONAL_KEYS:
+                continue
+            anonymized = self._anonymize_object(item)
+            if key in IDENTITY_KEYS and isinstance(item, dict):
+                if isinstance(item.get("id"), int):
+                    sign = -1 if item["id"] < 0 else 1
+                    anonymized["id"] = sign * self.pseudonym(item["id"])
+                if "first_name" in item:
+                    # Required by Telegram objects.
+                    anonymized["first_name"] = "user"
+            result[key] = anonymized
+        return result
+
+    def _placeholder(self, state: str, text: str, user_id: int) -> str:
+        match state:
+            case Form.email.state:
+                if validation.normalize_email(text) is None:
+                    return "invalid email"
+                return f"user{user_id}@example.com"
+            case Form.phone_number.state:
+                if validation.normalize_phone_number(text) is None:
+                    return "invalid phone"
+                return f"+7 999 {user_id % 10_000_000:07}"
+            case Form.last_name.state:
+                return "Фамилия"
+        return "Имя"
+
+    @staticmethod
+    def _redact(message: dict) -> None:
+        for key in TEXT_KEYS:
+            if key in message:
+                message[key] = REDACTED
+        for key in ENTITY_KEYS:
+            message.pop(key, None)
+
+    def _redact_messages(self, value: typing.Any) -> None:
+        """Replace texts of all messages under `value`"""
+        if isinstance(value, list):
+            for item in value:
+                self._redact_messages(item)
+            return
+        if not isinstance(value, dict):
+            return
+
+        for key, item in value.items():
+            if key in MESSAGE_KEYS and isinstance(item, dict):
+                self._redact(item)
+            self._redact_messages(item)
+
+    def _anonymize_input(self, message: dict, state: str | None, edited: bool) -> None:
+        text = message.get("text")
+        if state not in CONTACT_STATES:
+            # Edits can come from any earlier step, contacts included, and
+            # aren't handled, there's nothing to replay.
+            if edited:
+                self._redact(message)
+            return
+
+        if isinstance(text, str) and not text.startswith("/"):
+            message["text"] = self._placeholder(state, text, message["from"]["id"])
+            message.pop("entities", None)
+        if "caption" in message:
+            message["caption"] = REDACTED
+            message.pop("caption_entities", None)
+
+    def anonymize(self, update: types.Update, state: str | None) -> dict:
+        data = self._anonymize_object(update.to_python())
+        for key, value in data.items():
+            if key in ("message", "edited_message") and isinstance(value, dict):
+                self._redact_messages(value)
+                self._anonymize_input(value, state, edited=key == "edited_message")
+            else:
+                self._redact_messages({key: value})
+        return data
+
+    def _open(self) -> typing.TextIO:
+        if self._file is None or self._file_updates >= self.updates_per_file:
+            self.close()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            name = datetime.datetime.now().strftime("updates-%Y%m%d-%H%M%S")
+            path = self.directory / f"{name}-{self._files:04}.jsonl.gz"
+            self._file = gzip.open(path, "at", encoding="utf-8")
+            self._file_updates = 0
+            self._files += 1
+            logger.info("recording updates to %s", path)
+        return self._file
+
+    def record(
+        self,
+        update: types.Update,
+        started: float,
+        elapsed: float,
+        state_before: str | None,
+        state_after: str | None,
+    ) -> None:
+        record = {
+            "t": round(started - self._started, 6),
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "state_before": state_before,
+            "state_after": state_after,
+            "catalog_version": database.index.version if DB.loaded else None,
+            "update": self.anonymize(update, state_before),
+        }
+        file = self._open()
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file_updates += 1
+        self.recorded += 1
+        if self.recorded % FLUSH_EVERY == 0:
+            file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RecordingMiddleware(BaseMiddleware):
+    def __init__(self, recorder: UpdateRecorder):
+        super().__init__()
+        self.recorder = recorder
+
+    async def _get_state(self, update: types.Update) -> str | None:
+        address = get_update_address(update)
+        if address is None:
+            return None
+        chat, user = address
+        return await self.manager.dispatcher.storage.get_state(chat=chat, user=user)
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["recorder_state"] = await self._get_state(update)
+        data["recorder_started"] = time.monotonic()
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        elapsed = time.monotonic() - data["recorder_started"]
+        try:
+            self.recorder.record(
+                update,
+                started=data["recorder_started"],
+                elapsed=elapsed,
+                state_before=data["recorder_state"],
+                state_after=await self._get_state(update),
+            )
+        except Exception:
+            logger.exception("can't record update %s", update.update_id)
+
+
+RECORDER = (
+    UpdateRecorder(
+        directory=RECORDER_SETTINGS.RECORD_DIR,
+        updates_per_file=RECORDER_SETTINGS.RECORD_UPDATES_PER_FILE,
+        salt=(
+            RECORDER_SETTINGS.RECORD_SALT.get_secret_value().encode()
+            if RECORDER_SETTINGS.RECORD_SALT is not None
+            else None
+        ),
+    )
+    if RECORDER_SETTINGS.RECORD_UPDATES
+    else None
+)
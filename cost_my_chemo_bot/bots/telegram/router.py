@@ -0,0 +1,173 @@
+import dataclasses
+import inspect
+import typing
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot import metrics, tracing
+from cost_my_chemo_bot.config import SETTINGS
+
+logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
+
+MESSAGE = "message"
+CALLBACK_QUERY = "callback_query"
+ANY_STATE = "*"
+
+Handler = typing.Callable[..., typing.Awaitable[typing.Any]]
+Filter = typing.Callable[[typing.Any], typing.Awaitable[bool]]
+StateType = State | str | None
+
+
+@dataclasses.dataclass(frozen=True)
+class Route:
+    handler: Handler
+    filter: Filter | None = None
+    pass_state: bool = False
+
+    async def __call__(self, obj, state: FSMContext):
+        if self.pass_state:
+            return await self.handler(obj, state=state)
+        return await self.handler(obj)
+
+
+@dataclasses.dataclass
+class RouterStats:
+    updates: int = 0
+    exact: int = 0
+    fallback: int = 0
+    unhandled: int = 0
+    filters_checked: int = 0
+
+
+class Router:
+    """
+    Dispatch table for message and callback query handlers.
+
+    Routes are keyed by (update type, FSM state, callback data or command/text),
+    so a button press goes to its handler with one dict lookup. Free-text input
+    has no key to match on, it's served by the state's fallback routes, which are
+    checked with their filters in registration order like aiogram does.
+    Routes registered for `ANY_STATE` take precedence over state routes.
+    """
+
+    def __init__(self):
+        self._exact: dict[tuple[str, str | None, str], Route] = {}
+        self._fallback: dict[tuple[str, str | None], list[Route]] = {}
+        self.stats = RouterStats()
+
+    @staticmethod
+    def _state_names(state: StateType | typing.Iterable[StateType]) -> list:
+        if isinstance(state, (State, str)) or state is None:
+            state = [state]
+        return [item.state if isinstance(item, State) else item for item in state]
+
+    @staticmethod
+    def _route(handler: Handler, filter: Filter | None = None) -> Route:
+        pass_state = "state" in inspect.signature(handler).parameters
+        return Route(handler=handler, filter=filter, pass_state=pass_state)
+
+    def _add(
+        self,
+        kind: str,
+        handler: Handler,
+        state: StateType | typing.Iterable[StateType],
+        keys: typing.Iterable[str],
+        filter: Filter | None,
+    ) -> None:
+        route = self._route(handler, filter=filter)
+        keys = list(keys)
+        for state_name in self._state_names(state):
+            if not keys:
+                self._fallback.setdefault((kind, state_name), []).append(route)
+                continue
+
+            for key in keys:
+                if (kind, state_name, key) in self._exact:
+                    raise ValueError(f"route already exists: {kind} {state_name} {key}")
+                self._exact[(kind, state_name, key)] = route
+
+    def message(
+        self,
+        handler: Handler,
+        *,
+        state: StateType | typing.Iterable[StateType],
+        commands: typing.Iterable[str] = (),
+        text: typing.Iterable[str] = (),
+        filter: Filter | None = None,
+    ) -> None:
+        keys = [f"/{command.lower()}" for command in commands]
+        keys.extend(item.lower() for item in text)
+        self._add(MESSAGE, handler, state=state, keys=keys, filter=filter)
+
+    def callback_query(
+        self,
+        handler: Handler,
+        *,
+        state: StateType | typing.Iterable[StateType],
+        data: typing.Iterable[str] = (),
+        filter: Filter | None = None,
+    ) -> None:
+        self._add(CALLBACK_QUERY, handler, state=state, keys=data, filter=filter)
+
+    async def _find_route(
+        self, kind: str, obj, key: str, state_name: str | None
+    ) -> Route | None:
+        route = self._exact.get((kind, ANY_STATE, key)) or self._exact.get(
+            (kind, state_name, key)
+        )
+        if route is not None:
+            self.stats.exact += 1
+            return route
+
+        for route in self._fallback.get((kind, state_name), ()):
+            if route.filter is not None:
+                self.stats.filters_checked += 1
+                with tracing.span("filter", filter=route.filter.__name__):
+                    passed = await route.filter(obj)
+                if not passed:
+                    continue
+            self.stats.fallback += 1
+            return route
+
+        return None
+
+    async def _dispatch(self, kind: str, obj, key: str, state: FSMContext):
+        self.stats.updates += 1
+        filters_checked = self.stats.filters_checked
+        state_name = await state.get_state()
+        route = await self._find_route(kind, obj, key, state_name)
+        logger.debug(
+            "route %s state=%s key=%s handler=%s filters=%s",
+            kind,
+            state_name,
+            key,
+            route.handler.__name__ if route else None,
+            self.stats.filters_checked - filters_checked,
+        )
+        if route is None:
+            self.stats.unhandled += 1
+            metrics.set_update_route(state_name, metrics.UNHANDLED)
+            return None
+
+        metrics.set_update_route(state_name, route.handler.__name__)
+        with tracing.span("handler", handler=route.handler.__name__, state=state_name):
+            return await route(obj, state=state)
+
+    async def route_message(self, message: types.Message, state: FSMContext):
+        if message.is_command():
+            key = f"/{message.get_command(pure=True).lower()}"
+        else:
+            key = (message.text or "").lower()
+        return await self._dispatch(MESSAGE, message, key, state)
+
+    async def route_callback_query(
+        self, callback: types.CallbackQuery, state: FSMContext
+    ):
+        return await self._dispatch(CALLBACK_QUERY, callback, callback.data, state)
+
+    def setup(self, dp: Dispatcher) -> None:
+        dp.register_message_handler(self.route_message, state="*")
+        dp.register_callback_query_handler(self.route_callback_query, state="*")
@@ -1,9 +1,18 @@
+import functools
+
 from aiogram import Bot, types
-from aiogram.dispatcher.webhook import SendMessage
+from aiogram.dispatcher.webhook import (
+    AnswerInlineQuery,
+    EditMessageReplyMarkup,
+    SendMessage,
+)
 
+from cost_my_chemo_bot import tracing
+from cost_my_chemo_bot.bots.telegram.ratelimit import SEND_SCHEDULER
 from cost_my_chemo_bot.config import SETTINGS, BotMode
 
 
+@tracing.traced("telegram")
 async def send_message(
     bot: Bot,
     *,
@@ -32,13 +41,66 @@ async def send_message(
             reply_markup=reply_markup,
         )
 
-    return await bot.send_message(
-        chat_id=chat_id,
-        text=text,
-        parse_mode=parse_mode,
-        disable_web_page_preview=disable_web_page_preview,
-        disable_notification=disable_notification,
-        protect_content=protect_content,
-        reply_to_message_id=reply_to_message_id,
-        reply_markup=reply_markup,
+    return await SEND_SCHEDULER.send(
+        chat_id,
+        functools.partial(
+            bot.send_message,
+            chat_id=chat_id,
+            text=text,
+            parse_mode=parse_mode,
+            disable_web_page_preview=disable_web_page_preview,
+            disable_notification=disable_notification,
+            protect_content=protect_content,
+            reply_to_message_id=reply_to_message_id,
+            reply_markup=reply_markup,
+        ),
+    )
+
+
+@tracing.traced("telegram")
+async def edit_reply_markup(
+    bot: Bot,
+    *,
+    chat_id: int | str,
+    message_id: int,
+    reply_markup: types.InlineKeyboardMarkup | None = None,
+) -> types.Message | EditMessageReplyMarkup:
+    if SETTINGS.BOT_MODE is BotMode.WEBHOOK:
+        return EditMessageReplyMarkup(
+            chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+        )
+
+    return await SEND_SCHEDULER.send(
+        chat_id,
+        functools.partial(
+            bot.edit_message_reply_markup,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup,
+        ),
+    )
+
+
+@tracing.traced("telegram")
+async def answer_inline_query(
+    bot: Bot,
+    *,
+    inline_query_id: str,
+    results: list[types.InlineQueryResult],
+    cache_time: int | None = None,
+    is_personal: bool | None = None,
+) -> bool | AnswerInlineQuery:
+    if SETTINGS.BOT_MODE is BotMode.WEBHOOK:
+        return AnswerInlineQuery(
+            inline_query_id=inline_query_id,
+            results=results,
+            cache_time=cache_time,
+            is_personal=is_personal,
+        )
+
+    return await bot.answer_inline_query(
+        inline_query_id=inline_query_id,
+        results=results,
+        cache_time=cache_time,
+        is_personal=is_personal,
     )
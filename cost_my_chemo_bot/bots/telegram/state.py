@@ -4,6 +4,8 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from pydantic import BaseModel, EmailStr
 
+from cost_my_chemo_bot import context
+
 
 class StateData(BaseModel):
     height: int | None = None
@@ -46,6 +48,137 @@ class Form(StatesGroup):
     lead_confirmation = State()
 
 
-async def parse_state(state: FSMContext) -> StateData:
+# Forward transitions of the funnel. Category goes straight to course for
+# accompanying therapy, course goes to data confirmation through custom course
+# input when the course isn't in the list. "Need correction" jumps are not here.
+TRANSITIONS: dict[State, tuple[State, ...]] = {
+    Form.initial: (Form.height,),
+    Form.height: (Form.weight,),
+    Form.weight: (Form.category,),
+    Form.category: (Form.nosology, Form.course),
+    Form.nosology: (Form.course,),
+    Form.course: (Form.data_confirmation, Form.custom_course),
+    Form.custom_course: (Form.data_confirmation,),
+    Form.data_confirmation: (Form.contacts_input,),
+    Form.contacts_input: (Form.first_name,),
+    Form.first_name: (Form.last_name,),
+    Form.last_name: (Form.email,),
+    Form.email: (Form.phone_number,),
+    Form.phone_number: (Form.lead_confirmation,),
+    Form.lead_confirmation: (),
+}
+# Back navigation passes through these states without stopping.
+TRANSIENT_STATES = frozenset({Form.custom_course.state})
+# Data a state collects, dropped when the user gets back to it.
+STATE_FIELDS: dict[str, tuple[str, ...]] = {
+    Form.initial.state: ("initial",),
+    Form.height.state: ("height",),
+    Form.weight.state: ("weight",),
+    Form.category.state: ("category_id",),
+    Form.nosology.state: ("nosology_id",),
+    Form.course.state: ("course_id", "is_custom_course", "course_name"),
+    Form.data_confirmation.state: ("data_confirmation",),
+    Form.contacts_input.state: ("contacts_input",),
+    Form.first_name.state: ("first_name",),
+    Form.last_name.state: ("last_name",),
+    Form.email.state: ("email",),
+    Form.phone_number.state: ("phone_number",),
+}
+
+# History of visited states is kept in data as a list of state indexes.
+HISTORY_KEY = "history"
+MAX_HISTORY = 32
+STATE_NAMES: tuple[str, ...] = tuple(state.state for state in TRANSITIONS)
+STATE_INDEXES: dict[str, int] = {name: i for i, name in enumerate(STATE_NAMES)}
+PREDECESSORS: dict[str, tuple[str, ...]] = {
+    name: tuple(
+        source.state
+        for source, targets in TRANSITIONS.items()
+        if any(target.state == name for target in targets)
+    )
+    for name in STATE_NAMES
+}
+
+
+def next_history(
+    history: list[int], current: str | None, target: str | None
+) -> list[int]:
+    if target is None:
+        return []
+
+    target_index = STATE_INDEXES[target]
+    if target_index in history:
+        # Jump back to a visited state, e.g. "need correction".
+        return history[: history.index(target_index)]
+
+    if current is None or current == target:
+        return history
+
+    return [*history, STATE_INDEXES[current]][-MAX_HISTORY:]
+
+
+def back_target(
+    current: str | None, history: list[int], skip_nosology: bool = False
+) -> tuple[str, list[int]]:
+    """
+    Find the state to go back to from `current`
+
+    :return: target state name and history at the target state
+    """
+    history = list(history)
+    while history:
+        target = STATE_NAMES[history.pop()]
+        if target not in TRANSIENT_STATES:
+            return target, history
+
+    # No history, e.g. the conversation started before it was recorded.
+    predecessors = PREDECESSORS.get(current, ())
+    if not predecessors:
+        return Form.initial.state, []
+    if current == Form.course.state and skip_nosology:
+        return Form.category.state, []
+    target = predecessors[0]
+    if target in TRANSIENT_STATES:
+        return back_target(target, [], skip_nosology=skip_nosology)
+    return target, []
+
+
+async def transition(state: FSMContext, target: State | None, **data) -> None:
+    """Set state and update data with one storage write, recording history."""
+    current = await state.get_state()
+    old_data = await state.get_data()
+    target_name = target.state if target is not None else None
+    data[HISTORY_KEY] = next_history(
+        old_data.get(HISTORY_KEY) or [], current=current, target=target_name
+    )
+    await state.storage.update_state_and_data(
+        chat=state.chat, user=state.user, state=target_name, data=data
+    )
+
+
+async def go_back(state: FSMContext, state_data: "StateData") -> str:
+    """Move to the previous state with one storage write and return it."""
+    current = await state.get_state()
+    old_data = await state.get_data()
+    target, history = back_target(
+        current,
+        old_data.get(HISTORY_KEY) or [],
+        skip_nosology=state_data.is_accompanying_therapy,
+    )
+    data = {field: None for field in STATE_FIELDS.get(target, ())}
+    data[HISTORY_KEY] = history
+    await state.storage.update_state_and_data(
+        chat=state.chat, user=state.user, state=target, data=data
+    )
+    return target
+
+
+async def _parse_state(state: FSMContext) -> StateData:
     data = await state.get_data()
     return StateData(**data)
+
+
+async def parse_state(state: FSMContext) -> StateData:
+    return await context.memoize(
+        context.STATE_DATA, (state.chat, state.user), lambda: _parse_state(state)
+    )
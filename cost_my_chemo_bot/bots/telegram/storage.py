@@ -5,17 +5,21 @@ This module has mongo storage for finite-state machine
 
 import asyncio
 import contextlib
+import copy
 import json
+import time
 import typing
 from typing import AnyStr, Dict, Generator, List, Optional, Tuple, Union
 
 import aiohttp
 from aiogram.contrib.fsm_storage.files import JSONStorage
-from aiogram.contrib.fsm_storage.redis import RedisStorage2
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.contrib.fsm_storage.redis import STATE_KEY, RedisStorage2
 from aiogram.dispatcher.storage import BaseStorage
 from gcloud.aio.storage import Storage
 from logfmt_logger import getLogger
 
+from cost_my_chemo_bot import context, metrics, tracing
 from cost_my_chemo_bot.config import (
     JSON_STORAGE_SETTINGS,
     REDIS_SETTINGS,
@@ -253,6 +257,30 @@ class FirestoreStorage(BaseStorage):
         items = db.collection(STATE).stream()
         return [(int(item.get("chat")), int(item.get("user"))) async for item in items]
 
+    async def get_states_page(
+        self, cursor: str | None = None, limit: int = 100
+    ) -> tuple[list[tuple[str, str]], str | None]:
+        """
+        Get one page of stored chat's and user's ordered by document id
+
+        :param cursor: document id to start after, None for the first page
+        :param limit: page size
+        :return: page and cursor of the next page, None if it's the last one
+        """
+        db = self._db
+        collection = db.collection(STATE)
+        query = collection.order_by(firestore.FieldPath.document_id()).limit(limit)
+        if cursor is not None:
+            query = query.start_after({"__name__": collection.document(cursor)})
+
+        page = []
+        last_id = None
+        async for item in query.stream():
+            page.append((str(item.get("chat")), str(item.get("user"))))
+            last_id = item.id
+
+        return page, last_id if len(page) == limit else None
+
 
 class LockTimeoutError(Exception):
     pass
@@ -355,6 +383,7 @@ class GcloudStorage(BaseStorage):
 
         return chat_id, user_id
 
+    @tracing.traced("gcs.download")
     async def download_state(
         self, *, chat: str | int | None = None, user: str | int | None = None
     ) -> dict:
@@ -365,6 +394,7 @@ class GcloudStorage(BaseStorage):
             blob_content = await user_blob.download()
             return json.loads(blob_content)
 
+    @tracing.traced("gcs.upload")
     async def upload_state(
         self,
         *,
@@ -373,11 +403,13 @@ class GcloudStorage(BaseStorage):
         data: dict,
     ):
         async with self.get_storage() as storage:
+            # Time of the upload span not spent here is spent on the lock.
             async with self.lock(storage, chat=chat, user=user):
-                user_blob = await storage.get_bucket(
-                    bucket_name=self.bucket_name
-                ).get_blob(blob_name=f"{chat}/{user}.json")
-                await user_blob.upload(json.dumps(data))
+                with tracing.span("gcs.blob_upload"):
+                    user_blob = await storage.get_bucket(
+                        bucket_name=self.bucket_name
+                    ).get_blob(blob_name=f"{chat}/{user}.json")
+                    await user_blob.upload(json.dumps(data))
 
     async def get_state(
         self,
@@ -428,6 +460,20 @@ class GcloudStorage(BaseStorage):
         data["state"] = self.resolve_state(state)
         await self.upload_state(chat=chat, user=user, data=data)
 
+    async def update_state_and_data(
+        self,
+        *,
+        chat: str | int | None = None,
+        user: str | int | None = None,
+        state: typing.AnyStr = None,
+        data: dict = None,
+    ):
+        chat, user = await self.resolve_address(chat=chat, user=user)
+        old_data = await self.download_state(chat=chat, user=user)
+        old_data["state"] = self.resolve_state(state)
+        old_data["data"].update(data or {})
+        await self.upload_state(chat=chat, user=user, data=old_data)
+
     async def set_data(
         self,
         *,
@@ -495,6 +541,27 @@ class GcloudStorage(BaseStorage):
         data.get["bucket"].update(bucket, **kwargs)
         await self.upload_state(chat=chat, user=user, data=data)
 
+    async def get_states_page(
+        self, cursor: str | None = None, limit: int = 100
+    ) -> tuple[list[tuple[str, str]], str | None]:
+        async with self.get_storage() as storage:
+            params = {"maxResults": str(limit)}
+            if cursor is not None:
+                params["pageToken"] = cursor
+            result = await storage.list_objects(self.bucket_name, params=params)
+
+        page = []
+        for item in result.get("items", []):
+            name: str = item["name"]
+            # States are `{chat}/{user}.json`, leads of the outbox and broadcast
+            # checkpoints are deeper.
+            if not name.endswith(".json") or name.count("/") != 1:
+                continue
+            chat, user = name.removesuffix(".json").split("/", maxsplit=1)
+            page.append((chat, user))
+
+        return page, result.get("nextPageToken")
+
     async def _cleanup(self, chat, user):
         async with self.get_storage() as storage:
             chat, user = await self.resolve_address(chat=chat, user=user)
@@ -506,6 +573,190 @@ class GcloudStorage(BaseStorage):
                     )
 
 
+class StorageProxy(BaseStorage):
+    """
+    Storage wrapper, every storage call goes through `_call`.
+
+    Subclasses override `_call` to add behaviour around the wrapped storage,
+    anything not defined by `BaseStorage` is looked up on the wrapped storage.
+    """
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+    async def _call(self, method: str, **kwargs):
+        return await getattr(self.storage, method)(**kwargs)
+
+    async def close(self):
+        return await self.storage.close()
+
+    async def wait_closed(self):
+        return await self.storage.wait_closed()
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        return await self._call("get_state", chat=chat, user=user, default=default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        return await self._call("get_data", chat=chat, user=user, default=default)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        return await self._call("set_state", chat=chat, user=user, state=state)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        return await self._call("set_data", chat=chat, user=user, data=data)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        return await self._call(
+            "update_data", chat=chat, user=user, data=data, **kwargs
+        )
+
+    async def reset_data(self, *, chat=None, user=None):
+        return await self._call("reset_data", chat=chat, user=user)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        return await self._call(
+            "reset_state", chat=chat, user=user, with_data=with_data
+        )
+
+    async def finish(self, *, chat=None, user=None):
+        return await self._call("finish", chat=chat, user=user)
+
+    async def update_state_and_data(
+        self, *, chat=None, user=None, state=None, data=None
+    ):
+        if not hasattr(self.storage, "update_state_and_data"):
+            await self.update_data(chat=chat, user=user, data=data)
+            await self.set_state(chat=chat, user=user, state=state)
+            return
+
+        return await self._call(
+            "update_state_and_data", chat=chat, user=user, state=state, data=data
+        )
+
+    def has_bucket(self):
+        return self.storage.has_bucket()
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        return await self._call("get_bucket", chat=chat, user=user, default=default)
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        return await self._call("set_bucket", chat=chat, user=user, bucket=bucket)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        return await self._call(
+            "update_bucket", chat=chat, user=user, bucket=bucket, **kwargs
+        )
+
+    async def reset_bucket(self, *, chat=None, user=None):
+        return await self._call("reset_bucket", chat=chat, user=user)
+
+
+def unwrap_storage(storage: BaseStorage) -> BaseStorage:
+    while isinstance(storage, StorageProxy):
+        storage = storage.storage
+    return storage
+
+
+class InstrumentedStorage(StorageProxy):
+    """Observes latency of every call to the wrapped storage and traces it."""
+
+    def __init__(self, storage: BaseStorage):
+        super().__init__(storage)
+        self.backend = type(unwrap_storage(storage)).__name__
+        self._latency: dict[str, metrics.HistogramSeries] = {}
+
+    async def _call(self, method: str, **kwargs):
+        series = self._latency.get(method)
+        if series is None:
+            series = metrics.STORAGE_LATENCY.labels(self.backend, method)
+            self._latency[method] = series
+
+        started = time.perf_counter()
+        try:
+            with tracing.span("storage", backend=self.backend, method=method):
+                return await super()._call(method, **kwargs)
+        finally:
+            series.observe(time.perf_counter() - started)
+
+
+class UpdateCachedStorage(StorageProxy):
+    """
+    Reads state and data at most once per update.
+
+    Any write drops everything memoized from storage for the current update.
+    """
+
+    _reads = {"get_state": context.STATE, "get_data": context.DATA}
+    _writes = {
+        "set_state",
+        "set_data",
+        "update_data",
+        "reset_data",
+        "reset_state",
+        "finish",
+        "update_state_and_data",
+    }
+
+    async def _call(self, method: str, **kwargs):
+        tag = self._reads.get(method)
+        if tag is not None:
+            key = (kwargs["chat"], kwargs["user"], repr(kwargs["default"]))
+            value = await context.memoize(
+                tag,
+                key,
+                lambda: super(UpdateCachedStorage, self)._call(method, **kwargs),
+            )
+            # Callers may change returned data in place.
+            return copy.copy(value)
+
+        if method in self._writes:
+            context.invalidate(*context.STORAGE_TAGS)
+
+        return await super()._call(method, **kwargs)
+
+
+async def get_states_page(
+    storage: BaseStorage, cursor: str | None = None, limit: int = 100
+) -> tuple[list[tuple[str, str]], str | None]:
+    """
+    Get one page of stored chat's and user's without loading all of them
+
+    :return: page and cursor of the next page, None if it's the last one
+    """
+    storage = unwrap_storage(storage)
+    if hasattr(storage, "get_states_page"):
+        return await storage.get_states_page(cursor=cursor, limit=limit)
+
+    if isinstance(storage, RedisStorage2):
+        next_cursor, keys = await storage._redis.scan(
+            int(cursor or 0),
+            match=storage.generate_key("*", "*", STATE_KEY),
+            count=limit,
+        )
+        page = []
+        for key in keys:
+            *_, chat, user, _ = key.split(":")
+            page.append((chat, user))
+        return page, str(next_cursor) if next_cursor else None
+
+    if isinstance(storage, MemoryStorage):
+        offset = int(cursor or 0)
+        addresses = sorted(
+            (chat, user)
+            for chat, users in storage.data.items()
+            for user, record in users.items()
+            if record.get("state") is not None
+        )
+        page = addresses[offset : offset + limit]
+        next_offset = offset + limit
+        return page, str(next_offset) if next_offset < len(addresses) else None
+
+    raise TypeError(f"can't paginate states of {type(storage)}")
+
+
 def make_storage() -> JSONStorage | GcloudStorage | RedisStorage2:
     match SETTINGS.STORAGE_TYPE:
         case StorageType.JSON:
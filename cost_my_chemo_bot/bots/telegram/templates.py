@@ -0,0 +1,77 @@
+import string
+import typing
+
+from aiogram.utils.text_decorations import HtmlDecoration
+
+from cost_my_chemo_bot.bots.telegram import messages
+
+# Decorations keep no state, one instance is enough.
+HTML = HtmlDecoration()
+
+
+def bold_html(value: typing.Any) -> str:
+    return HTML.bold(HTML.quote(str(value)))
+
+
+def quote_html(value: typing.Any) -> str:
+    return HTML.quote(str(value))
+
+
+# Static parts around a bold HTML slot, "<b>" and "</b>".
+BOLD_HTML = tuple(HTML.bold("\0").split("\0"))
+
+
+class Template:
+    """
+    `str.format` template parsed once into static text and slots
+
+    Rendering joins the static parts with the slot values passed through
+    `escape`. Decoration around slots (`wrap`, e.g. "<b>" and "</b>") is
+    merged into the static parts when the template is parsed.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        escape: typing.Callable[[typing.Any], str] = str,
+        wrap: tuple[str, str] = ("", ""),
+    ):
+        self.source = source
+        self.escape = escape
+        self._static: list[str] = []
+        self._fields: list[str] = []
+        prefix, suffix = wrap
+        static = ""
+        for literal, field, format_spec, conversion in string.Formatter().parse(source):
+            static += literal
+            if field is None:
+                continue
+            if not field or format_spec or conversion:
+                raise ValueError(f"unsupported template field: {field!r}")
+            self._static.append(static + prefix)
+            self._fields.append(field)
+            static = suffix
+        self._static.append(static)
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        return tuple(self._fields)
+
+    def render(self, **values: typing.Any) -> str:
+        escape = self.escape
+        parts = [self._static[0]]
+        for field, static in zip(self._fields, self._static[1:]):
+            parts.append(escape(values[field]))
+            parts.append(static)
+        return "".join(parts)
+
+
+DATA_CONFIRMATION = Template(
+    messages.DATA_CONFIRMATION, escape=quote_html, wrap=BOLD_HTML
+)
+DATA_CORRECT = Template(messages.DATA_CORRECT, escape=quote_html, wrap=BOLD_HTML)
+LEAD_CONFIRMATION = Template(
+    messages.LEAD_CONFIRMATION, escape=quote_html, wrap=BOLD_HTML
+)
+# Same text as `md.text(add_text, md.text(message), sep="\n")`.
+LEAD_FIRST_NAME = Template("{add_text}\n" + messages.LEAD_FIRST_NAME)
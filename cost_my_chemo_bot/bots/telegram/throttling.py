@@ -0,0 +1,123 @@
+import collections
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.storage import BaseStorage
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot.bots.telegram.ratelimit import TokenBucket
+from cost_my_chemo_bot.config import THROTTLING_SETTINGS
+
+logger = getLogger(__name__)
+
+BUCKET_KEY = "throttling"
+
+
+def get_update_address(update: types.Update) -> tuple[int, int] | None:
+    """Chat and user the update came from, chat is the user for inline queries"""
+    if update.message is not None:
+        return update.message.chat.id, update.message.from_user.id
+    if update.callback_query is not None:
+        callback = update.callback_query
+        if callback.message is not None:
+            return callback.message.chat.id, callback.from_user.id
+        return callback.from_user.id, callback.from_user.id
+    if update.inline_query is not None:
+        user_id = update.inline_query.from_user.id
+        return user_id, user_id
+    return None
+
+
+class UpdateThrottler:
+    """
+    Per-user token bucket for incoming updates.
+
+    Buckets are kept in a local LRU of `max_users` users by default. With
+    `use_storage` they are kept in the FSM storage bucket instead, which costs
+    a bucket read and write per update but works across instances.
+    """
+
+    def __init__(
+        self,
+        rate: float = 2,
+        burst: float = 10,
+        max_users: int = 10_000,
+        use_storage: bool = False,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.use_storage = use_storage
+        self._buckets: collections.OrderedDict[
+            int, TokenBucket
+        ] = collections.OrderedDict()
+
+        self.passed = 0
+        self.throttled = 0
+
+    def _local_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(rate=self.rate, capacity=self.burst)
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    async def _consume_stored(self, storage: BaseStorage, chat: int, user: int) -> bool:
+        bucket = await storage.get_bucket(chat=chat, user=user, default={})
+        stored = bucket.get(BUCKET_KEY) or {}
+        # Wall clock time, the bucket may be shared between instances.
+        now = time.time()
+        tokens = min(
+            self.burst,
+            stored.get("tokens", self.burst)
+            + (now - stored.get("updated", now)) * self.rate,
+        )
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        bucket[BUCKET_KEY] = {"tokens": tokens, "updated": now}
+        await storage.set_bucket(chat=chat, user=user, bucket=bucket)
+        return allowed
+
+    async def allow(self, storage: BaseStorage, chat: int, user: int) -> bool:
+        if self.use_storage and storage.has_bucket():
+            allowed = await self._consume_stored(storage, chat=chat, user=user)
+        else:
+            allowed = self._local_bucket(user).try_consume()
+
+        if allowed:
+            self.passed += 1
+        else:
+            self.throttled += 1
+        return allowed
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, throttler: UpdateThrottler):
+        super().__init__()
+        self.throttler = throttler
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        address = get_update_address(update)
+        if address is None:
+            return
+
+        chat, user = address
+        storage = self.manager.dispatcher.storage
+        if not await self.throttler.allow(storage, chat=chat, user=user):
+            logger.info("throttle update %s from user %s", update.update_id, user)
+            raise CancelHandler()
+
+
+THROTTLER = UpdateThrottler(
+    rate=THROTTLING_SETTINGS.THROTTLE_RATE,
+    burst=THROTTLING_SETTINGS.THROTTLE_BURST,
+    max_users=THROTTLING_SETTINGS.THROTTLE_MAX_USERS,
+    use_storage=THROTTLING_SETTINGS.THROTTLE_USE_STORAGE,
+)
@@ -1,5 +1,6 @@
 import enum
 import logging
+import pathlib
 
 from pydantic import BaseSettings, Field, FilePath, HttpUrl, SecretStr
 
@@ -74,6 +75,166 @@ class RedisSettings(BaseSettings):
         env_file = ".env"
 
 
+class DeduplicationSettings(BaseSettings):
+    DEDUP_WINDOW_SIZE: int = 4096
+    # Set to share seen update ids between instances, e.g. redis://host:6379/0
+    DEDUP_REDIS_URL: str | None = None
+    DEDUP_TTL: int = 60 * 60 * 1  # 1 hour.
+
+    class Config:
+        env_file = ".env"
+
+
+class RateLimitSettings(BaseSettings):
+    # https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+    TELEGRAM_GLOBAL_RATE: float = 30  # messages per second.
+    TELEGRAM_CHAT_RATE: float = 1  # messages per second.
+    TELEGRAM_CHAT_BURST: float = 3
+    TELEGRAM_MAX_RETRIES: int = 3
+
+    class Config:
+        env_file = ".env"
+
+
+class BroadcastSettings(BaseSettings):
+    # Where broadcast progress is kept, STORAGE_TYPE if unset.
+    BROADCAST_CHECKPOINT_TYPE: StorageType | None = None
+    # For the json type, keep it on a persistent volume, otherwise an
+    # interrupted broadcast can't resume after a restart.
+    BROADCAST_CHECKPOINT_DIR: pathlib.Path = pathlib.Path("broadcasts")
+    BROADCAST_CONCURRENCY: int = 10
+    BROADCAST_PAGE_SIZE: int = 100
+    BROADCAST_CHECKPOINT_EVERY: int = 20
+
+    class Config:
+        env_file = ".env"
+
+
+class LeadOutboxSettings(BaseSettings):
+    # Where queued leads are kept, STORAGE_TYPE if unset.
+    LEAD_OUTBOX_TYPE: StorageType | None = None
+    # For the json type, keep it on a persistent volume, otherwise queued leads
+    # die with the instance.
+    LEAD_OUTBOX_DIR: pathlib.Path = pathlib.Path("outbox")
+    LEAD_OUTBOX_BATCH_SIZE: int = 50
+    LEAD_OUTBOX_MAX_ATTEMPTS: int = 8
+    LEAD_OUTBOX_BACKOFF_BASE: float = 5  # seconds.
+    LEAD_OUTBOX_BACKOFF_MAX: float = 60 * 60  # 1 hour.
+    LEAD_OUTBOX_POLL_INTERVAL: float = 30  # seconds.
+
+    class Config:
+        env_file = ".env"
+
+
+class KeyboardSettings(BaseSettings):
+    KEYBOARD_PAGE_SIZE: int = 10
+    KEYBOARD_CACHE_SIZE: int = 1024
+
+    class Config:
+        env_file = ".env"
+
+
+class CatalogSettings(BaseSettings):
+    # Decode and validate 1C responses of at least this size in a process pool,
+    # smaller ones are parsed in a thread. Disabled if unset. Pool processes
+    # are spawned and import the main module, it must be import safe.
+    CATALOG_PROCESS_POOL_MIN_BYTES: int | None = None
+    CATALOG_PROCESS_POOL_WORKERS: int = 1
+    # Decode and validate 1C responses as they arrive instead of buffering
+    # them, the process pool still gets whole responses.
+    CATALOG_STREAMING: bool = True
+
+    class Config:
+        env_file = ".env"
+
+
+class SearchSettings(BaseSettings):
+    SEARCH_LIMIT: int = 5
+    SEARCH_MIN_SCORE: float = 0.3
+    # Telegram allows up to 50 inline results.
+    INLINE_RESULTS_LIMIT: int = 50
+    INLINE_CACHE_SIZE: int = 4096
+    # Seconds Telegram keeps inline results on its side.
+    INLINE_CACHE_TIME: int = 3600
+
+    class Config:
+        env_file = ".env"
+
+
+class PrefetchSettings(BaseSettings):
+    PREFETCH_CONCURRENCY: int = 4
+    PREFETCH_MAX_PENDING: int = 100
+    PREFETCH_CACHE_SIZE: int = 4096
+
+    class Config:
+        env_file = ".env"
+
+
+class ValidationSettings(BaseSettings):
+    VALIDATION_CACHE_SIZE: int = 4096
+    # Phone number metadata loaded at startup, others are loaded on first use.
+    VALIDATION_PHONE_REGIONS: list[str] = ["RU", "BY", "KZ", "UA", "UZ", "AM", "GE"]
+
+    class Config:
+        env_file = ".env"
+
+
+class ThrottlingSettings(BaseSettings):
+    # Updates per second per user and how many may come at once.
+    THROTTLE_RATE: float = 2
+    THROTTLE_BURST: float = 10
+    THROTTLE_MAX_USERS: int = 10_000
+    # Keep buckets in FSM storage to share limits between instances.
+    THROTTLE_USE_STORAGE: bool = False
+
+    class Config:
+        env_file = ".env"
+
+
+class MetricsSettings(BaseSettings):
+    # Port for /metrics of the aiogram app, fastapi app serves it itself.
+    METRICS_PORT: int | None = None
+    METRICS_HOST: str = "0.0.0.0"
+
+    class Config:
+        env_file = ".env"
+
+
+class TracingSettings(BaseSettings):
+    # Share of updates traced, decided when the update arrives.
+    TRACING_SAMPLE_RATE: float = 0.01
+    TRACING_KEEP_SLOWEST: int = 20
+    # Append sampled traces to this file as JSON lines.
+    TRACING_JSONL_PATH: pathlib.Path | None = None
+
+    class Config:
+        env_file = ".env"
+
+
+class RecorderSettings(BaseSettings):
+    # Record anonymized updates for replaying them in benchmarks.
+    RECORD_UPDATES: bool = False
+    RECORD_DIR: pathlib.Path = pathlib.Path("recordings")
+    RECORD_UPDATES_PER_FILE: int = 10_000
+    # Keeps pseudonyms stable across restarts, random for every process if unset.
+    RECORD_SALT: SecretStr | None = None
+
+    class Config:
+        env_file = ".env"
+
+
+class LoopMonitorSettings(BaseSettings):
+    # Measure event loop lag and log stacks of callbacks blocking it.
+    LOOP_MONITOR: bool = False
+    LOOP_MONITOR_INTERVAL: float = 0.05
+    # Seconds the loop may be held by one callback before its stack is taken.
+    LOOP_MONITOR_THRESHOLD: float = 0.1
+    LOOP_MONITOR_MAX_REPORTS: int = 20
+
+    class Config:
+        env_file = ".env"
+
+
 SETTINGS = Settings()
 WEBHOOK_SETTINGS = None
 if SETTINGS.BOT_MODE is BotMode.WEBHOOK:
@@ -86,3 +247,18 @@ if SETTINGS.STORAGE_TYPE is StorageType.JSON:
 REDIS_SETTINGS = None
 if SETTINGS.STORAGE_TYPE is StorageType.REDIS:
     REDIS_SETTINGS = RedisSettings()
+
+DEDUPLICATION_SETTINGS = DeduplicationSettings()
+RATE_LIMIT_SETTINGS = RateLimitSettings()
+BROADCAST_SETTINGS = BroadcastSettings()
+LEAD_OUTBOX_SETTINGS = LeadOutboxSettings()
+KEYBOARD_SETTINGS = KeyboardSettings()
+CATALOG_SETTINGS = CatalogSettings()
+SEARCH_SETTINGS = SearchSettings()
+PREFETCH_SETTINGS = PrefetchSettings()
+VALIDATION_SETTINGS = ValidationSettings()
+THROTTLING_SETTINGS = ThrottlingSettings()
+METRICS_SETTINGS = MetricsSettings()
+TRACING_SETTINGS = TracingSettings()
+RECORDER_SETTINGS = RecorderSettings()
+LOOP_MONITOR_SETTINGS = LoopMonitorSettings()
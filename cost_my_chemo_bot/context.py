@@ -0,0 +1,70 @@
+import contextvars
+import functools
+import typing
+
+T = typing.TypeVar("T")
+
+# Values computed while processing one update, by tag and key.
+# None means that we are outside of an update and nothing is memoized.
+_update_cache: contextvars.ContextVar[
+    dict[str, dict[typing.Hashable, typing.Any]] | None
+] = contextvars.ContextVar("update_cache", default=None)
+
+CATALOG = "catalog"
+FILTER = "filter"
+STATE = "state"
+DATA = "data"
+STATE_DATA = "state_data"
+# Everything derived from FSM storage, dropped whenever storage is written.
+STORAGE_TAGS = (FILTER, STATE, DATA, STATE_DATA)
+
+
+def begin_update() -> None:
+    _update_cache.set({})
+
+
+def end_update() -> None:
+    _update_cache.set(None)
+
+
+def in_update() -> bool:
+    return _update_cache.get() is not None
+
+
+async def memoize(
+    tag: str,
+    key: typing.Hashable,
+    factory: typing.Callable[[], typing.Awaitable[T]],
+) -> T:
+    cache = _update_cache.get()
+    if cache is None:
+        return await factory()
+
+    values = cache.setdefault(tag, {})
+    try:
+        return values[key]
+    except KeyError:
+        value = await factory()
+        values[key] = value
+        return value
+
+
+def invalidate(*tags: str) -> None:
+    cache = _update_cache.get()
+    if cache is None:
+        return
+
+    for tag in tags:
+        cache.pop(tag, None)
+
+
+def memoized_filter(
+    func: typing.Callable[..., typing.Awaitable[bool]]
+) -> typing.Callable[..., typing.Awaitable[bool]]:
+    # Paired filters (`*_valid` / `*_invalid`) are checked for the same update,
+    # so the result is kept until the update is processed or storage changes.
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> bool:
+        return await memoize(FILTER, func.__qualname__, lambda: func(*args, **kwargs))
+
+    return wrapper
@@ -1,13 +1,24 @@
 import asyncio
+import concurrent.futures
 import decimal
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import pickle
+import time
 import typing
 import unicodedata
 
-from httpx import AsyncClient
+from httpx import AsyncClient, Response
 from logfmt_logger import getLogger
 from pydantic import BaseModel, ValidationError, validator
 
-from cost_my_chemo_bot.config import SETTINGS
+from cost_my_chemo_bot import context, metrics, tracing
+from cost_my_chemo_bot.config import CATALOG_SETTINGS, SETTINGS
+from cost_my_chemo_bot.jsonstream import JSONArrayStream
+from cost_my_chemo_bot.search import CoursePrefixIndex, CourseSearchIndex
 
 logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
 
@@ -24,18 +35,24 @@ class CourseNotFound(Exception):
     ...
 
 
-class Category(BaseModel):
+class CatalogItem(BaseModel):
+    class Config:
+        # Loaded catalogs are shared by all updates and parser threads.
+        allow_mutation = False
+
+
+class Category(CatalogItem):
     categoryid: str
     categoryName: str
 
 
-class Nosology(BaseModel):
+class Nosology(CatalogItem):
     nosologyid: str
     nosologyName: str
     categoryid1: str | None
 
 
-class Course(BaseModel):
+class Course(CatalogItem):
     Courseid: str
     Course: str
     categoryid: str
@@ -67,11 +84,132 @@ class Course(BaseModel):
         return self.coefficient * decimal.Decimal(str(bsa)) * decimal.Decimal("0.75")
 
 
+CatalogModel = typing.TypeVar("CatalogModel", bound=CatalogItem)
+
+
+def validate_rows(
+    model: type[CatalogModel], rows: typing.Iterable[dict]
+) -> list[CatalogModel]:
+    return [model(**row) for row in rows]
+
+
+def parse_catalog(model: type[CatalogModel], body: bytes) -> tuple[CatalogModel, ...]:
+    """Decode and validate a 1C response, runs in parser threads and processes"""
+    return tuple(validate_rows(model, json.loads(body)["result"]))
+
+
+def parse_catalog_chunk(
+    decoder: JSONArrayStream, model: type[CatalogModel], chunk: bytes
+) -> list[CatalogModel]:
+    """Validate the rows of a streamed 1C response completed by `chunk`"""
+    return validate_rows(model, decoder.feed(chunk))
+
+
+# Items per pickle passed back from parser processes.
+PICKLE_CHUNK_SIZE = 1000
+
+
+def parse_catalog_pickled(model: type[CatalogModel], body: bytes) -> list[bytes]:
+    """
+    `parse_catalog` for parser processes
+
+    Items come back pickled in chunks: one pickle of the whole catalog would
+    hold the GIL of the bot process for as long as it takes to unpickle it.
+    """
+    items = parse_catalog(model, body)
+    return [
+        pickle.dumps(items[i : i + PICKLE_CHUNK_SIZE])
+        for i in range(0, len(items), PICKLE_CHUNK_SIZE)
+    ]
+
+
+def unpickle_catalog(chunks: list[bytes]) -> tuple[CatalogItem, ...]:
+    return tuple(itertools.chain.from_iterable(map(pickle.loads, chunks)))
+
+
+# Parsing holds the GIL, one thread is enough to keep it off the event loop.
+_thread_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="catalog-parser"
+)
+_process_pool: concurrent.futures.ProcessPoolExecutor | None = None
+
+
+def _get_process_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # Forking a process with running threads and an event loop isn't safe.
+        _process_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=CATALOG_SETTINGS.CATALOG_PROCESS_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+# Kinds of catalog items in `CatalogIndex`.
+CATEGORY = "c"
+NOSOLOGY = "n"
+COURSE = "k"
+
+
+class CatalogIndex:
+    """
+    Positions of catalog items in a loaded snapshot
+
+    Items are referred to by (kind, position) instead of their 36 character ids.
+    `version` is a digest of all ids, so positions from another snapshot can
+    be told apart while the catalog content stays the same across reloads.
+    `content_version` is a digest of all fields: names, prices and links
+    change without changing ids, caches of rendered items are keyed on it.
+    """
+
+    def __init__(
+        self,
+        courses: typing.Sequence[Course],
+        categories: typing.Sequence[Category],
+        nosologies: typing.Sequence[Nosology],
+    ):
+        self.ids: dict[str, tuple[str, ...]] = {
+            CATEGORY: tuple(category.categoryid for category in categories),
+            NOSOLOGY: tuple(nosology.nosologyid for nosology in nosologies),
+            COURSE: tuple(course.Courseid for course in courses),
+        }
+        self.positions: dict[str, dict[str, int]] = {
+            kind: {item_id: i for i, item_id in enumerate(ids)}
+            for kind, ids in self.ids.items()
+        }
+        digest = hashlib.blake2b(digest_size=4)
+        for kind, ids in self.ids.items():
+            digest.update(kind.encode())
+            digest.update("\n".join(ids).encode())
+        self.version = int.from_bytes(digest.digest(), "big")
+        content = hashlib.blake2b(digest_size=8)
+        for items in (categories, nosologies, courses):
+            content.update(
+                "\n".join(
+                    repr(tuple(item.__dict__.values())) for item in items
+                ).encode()
+            )
+        self.content_version = int.from_bytes(content.digest(), "big")
+
+    def position(self, kind: str, item_id: str) -> int:
+        return self.positions[kind][item_id]
+
+    def item_id(self, kind: str, position: int) -> str | None:
+        ids = self.ids[kind]
+        if 0 <= position < len(ids):
+            return ids[position]
+        return None
+
+
 class DB:
-    _courses: typing.ClassVar[list[Course] | None] = None
-    _categories: typing.ClassVar[list[Category] | None] = None
-    _nosologies: typing.ClassVar[list[Nosology] | None] = None
+    _courses: typing.ClassVar[tuple[Course, ...] | None] = None
+    _categories: typing.ClassVar[tuple[Category, ...] | None] = None
+    _nosologies: typing.ClassVar[tuple[Nosology, ...] | None] = None
+    _index: typing.ClassVar[CatalogIndex | None] = None
+    _search_index: typing.ClassVar[CourseSearchIndex | None] = None
+    _prefix_index: typing.ClassVar[CoursePrefixIndex | None] = None
     loaded: typing.ClassVar[bool] = False
+    _loading: typing.ClassVar[asyncio.Future | None] = None
     client = AsyncClient(
         base_url=SETTINGS.ONCO_MEDCONSULT_API_URL,
         auth=(
@@ -82,20 +220,35 @@ class DB:
     )
 
     @property
-    def courses(self) -> list[Course]:
+    def courses(self) -> tuple[Course, ...]:
         assert DB.loaded
         return DB._courses
 
     @property
-    def categories(self) -> list[Category]:
+    def categories(self) -> tuple[Category, ...]:
         assert DB.loaded
         return DB._categories
 
     @property
-    def nosologies(self) -> list[Nosology]:
+    def nosologies(self) -> tuple[Nosology, ...]:
         assert DB.loaded
         return DB._nosologies
 
+    @property
+    def index(self) -> CatalogIndex:
+        assert DB._index is not None
+        return DB._index
+
+    @property
+    def search_index(self) -> CourseSearchIndex:
+        assert DB._search_index is not None
+        return DB._search_index
+
+    @property
+    def prefix_index(self) -> CoursePrefixIndex:
+        assert DB._prefix_index is not None
+        return DB._prefix_index
+
     @staticmethod
     def parse_courses(values: list[list]) -> list[Course]:
         courses: list[Course] = []
@@ -119,23 +272,100 @@ class DB:
 
         return courses
 
-    async def _fetch_courses(self) -> list[Course]:
-        resp = await self.client.get("", params={"action": "Course"})
-        resp.raise_for_status()
-        result = resp.json()["result"]
-        return [Course(**course_raw) for course_raw in result]
+    async def _fetch(
+        self, action: str, model: type[CatalogModel]
+    ) -> tuple[CatalogModel, ...]:
+        min_bytes = CATALOG_SETTINGS.CATALOG_PROCESS_POOL_MIN_BYTES
+        started = time.perf_counter()
+        with tracing.span("catalog.fetch", action=action) as span:
+            async with self.client.stream("GET", "", params={"action": action}) as resp:
+                resp.raise_for_status()
+                size = int(resp.headers.get("Content-Length", 0))
+                # Responses for the process pool are parsed whole anyway.
+                if CATALOG_SETTINGS.CATALOG_STREAMING and (
+                    min_bytes is None or size < min_bytes
+                ):
+                    items, size, parse_seconds = await self._stream(action, model, resp)
+                    if span is not None:
+                        span.attributes["parse_seconds"] = round(parse_seconds, 6)
+                    body = None
+                else:
+                    body = await resp.aread()
+                    size, parse_seconds = len(body), 0.0
+
+        # Parsing a stream is interleaved with the download, it's not fetch time.
+        metrics.CATALOG_FETCH_LATENCY.labels(action).observe(
+            time.perf_counter() - started - parse_seconds
+        )
+        metrics.CATALOG_FETCH_BYTES.labels(action).observe(size)
+        if body is None:
+            metrics.CATALOG_PARSE_LATENCY.labels(action).observe(parse_seconds)
+            return items
+        return await self._parse(action, model, body)
 
-    async def _fetch_categories(self) -> list[Category]:
-        resp = await self.client.get("", params={"action": "category"})
-        resp.raise_for_status()
-        result = resp.json()["result"]
-        return [Category(**category_raw) for category_raw in result]
+    @staticmethod
+    async def _stream(
+        action: str, model: type[CatalogModel], resp: Response
+    ) -> tuple[tuple[CatalogModel, ...], int, float]:
+        """
+        Decode and validate a 1C response as it arrives
+
+        Only the models and the undecoded tail of the response are kept, not
+        the body and its JSON tree, so the peak memory of a reload is about the
+        catalog itself. Returns the items, the body size and the parse time.
+        """
+        loop = asyncio.get_running_loop()
+        decoder = JSONArrayStream("result")
+        items: list[CatalogModel] = []
+        size = 0
+        parse_seconds = 0.0
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            started = time.perf_counter()
+            items.extend(
+                await loop.run_in_executor(
+                    _thread_pool, parse_catalog_chunk, decoder, model, chunk
+                )
+            )
+            parse_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        items.extend(validate_rows(model, decoder.close()))
+        parse_seconds += time.perf_counter() - started
+        logger.debug("streamed %s: %d items, %d bytes", action, len(items), size)
+        return tuple(items), size, parse_seconds
+
+    async def _parse(
+        self, action: str, model: type[CatalogModel], body: bytes
+    ) -> tuple[CatalogModel, ...]:
+        min_bytes = CATALOG_SETTINGS.CATALOG_PROCESS_POOL_MIN_BYTES
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        with tracing.span("catalog.parse", action=action, bytes=len(body)):
+            if min_bytes is not None and len(body) >= min_bytes:
+                chunks = await loop.run_in_executor(
+                    _get_process_pool(), parse_catalog_pickled, model, body
+                )
+                items = await loop.run_in_executor(
+                    _thread_pool, unpickle_catalog, chunks
+                )
+            else:
+                items = await loop.run_in_executor(
+                    _thread_pool, parse_catalog, model, body
+                )
+        metrics.CATALOG_PARSE_LATENCY.labels(action).observe(
+            time.perf_counter() - started
+        )
+        return items
 
-    async def _fetch_nosologies(self) -> list[Nosology]:
-        resp = await self.client.get("", params={"action": "nosology"})
-        resp.raise_for_status()
-        result = resp.json()["result"]
-        return [Nosology(**nosology_raw) for nosology_raw in result]
+    async def _fetch_courses(self) -> tuple[Course, ...]:
+        return await self._fetch("Course", Course)
+
+    async def _fetch_categories(self) -> tuple[Category, ...]:
+        return await self._fetch("category", Category)
+
+    async def _fetch_nosologies(self) -> tuple[Nosology, ...]:
+        return await self._fetch("nosology", Nosology)
 
     async def load_db(self) -> None:
         logger.debug("loading db")
@@ -143,21 +373,65 @@ class DB:
             logger.debug("already loaded!")
             return
 
-        DB._courses = await self._fetch_courses()
-        DB._categories = await self._fetch_categories()
-        DB._nosologies = await self._fetch_nosologies()
+        await self._load()
+
+    async def _load(self) -> None:
+        courses = await self._fetch_courses()
+        categories = await self._fetch_categories()
+        nosologies = await self._fetch_nosologies()
+        # Indexes of large catalogs take longer to build than to parse.
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(
+            _thread_pool, CatalogIndex, courses, categories, nosologies
+        )
+        search_index, prefix_index = DB._search_index, DB._prefix_index
+        # The catalog is reloaded often and rarely changes. Search results are
+        # the indexed courses themselves, stale names and prices included.
+        if DB._index is None or DB._index.content_version != index.content_version:
+            search_index = await loop.run_in_executor(
+                _thread_pool, CourseSearchIndex, courses
+            )
+            prefix_index = await loop.run_in_executor(
+                _thread_pool, CoursePrefixIndex, courses
+            )
+        # Swapped at once, updates never see parts of different snapshots.
+        DB._courses, DB._categories, DB._nosologies = courses, categories, nosologies
+        DB._index = index
+        DB._search_index, DB._prefix_index = search_index, prefix_index
         DB.loaded = True
+        metrics.catalog_loaded(index.version)
         logger.debug("loaded db successfully")
 
-    async def reload_db(self) -> None:
+    async def _reload_db(self) -> None:
         logger.debug("reloading db")
-        DB.loaded = False
-        await self.load_db()
+        # Updates arriving during a reload share it instead of queueing their
+        # own behind it in the parser. A failed reload keeps the previous
+        # snapshot.
+        if DB._loading is None or DB._loading.done():
+            DB._loading = asyncio.ensure_future(self._load())
+        await asyncio.shield(DB._loading)
+
+    async def reload_db(self) -> None:
+        # Catalog is reloaded at most once per update.
+        await context.memoize(context.CATALOG, "reload_db", self._reload_db)
 
     async def find_courses(
         self, category_id: str, nosology_id: str | None
+    ) -> list[Course]:
+        return await context.memoize(
+            context.CATALOG,
+            ("find_courses", category_id, nosology_id),
+            functools.partial(self._find_courses, category_id, nosology_id),
+        )
+
+    async def _find_courses(
+        self, category_id: str, nosology_id: str | None
     ) -> list[Course]:
         await self.reload_db()
+        return self.filter_courses(category_id=category_id, nosology_id=nosology_id)
+
+    def filter_courses(self, category_id: str, nosology_id: str | None) -> list[Course]:
+        """Courses of the loaded catalog, without reloading it"""
         if nosology_id is None:
             return [
                 course for course in self.courses if course.categoryid == category_id
@@ -176,6 +450,21 @@ class DB:
 
         return found
 
+    def lookup(
+        self, kind: str, item_id: str | None
+    ) -> Category | Nosology | Course | None:
+        """Item of the loaded catalog by id in O(1), without reloading it"""
+        position = self.index.positions[kind].get(item_id)
+        if position is None:
+            return None
+
+        items = {
+            CATEGORY: self.categories,
+            NOSOLOGY: self.nosologies,
+            COURSE: self.courses,
+        }[kind]
+        return items[position]
+
     async def find_course_by_name(self, name: str) -> Course:
         for course in self.courses:
             if course.Course != name:
@@ -220,6 +509,8 @@ class DB:
     @classmethod
     async def close(cls):
         await cls.client.aclose()
+        if _process_pool is not None:
+            _process_pool.shutdown(cancel_futures=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+import codecs
+import enum
+import json
+import re
+import typing
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789.eE+-"
+# Separator after an array item, with the whitespace around it.
+ITEM_SEPARATOR = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+
+
+class State(enum.Enum):
+    START = "start"
+    KEY = "key"
+    COLON = "colon"
+    VALUE = "value"
+    NEXT_KEY = "next_key"
+    ARRAY = "array"
+    FIRST_ITEM = "first_item"
+    ITEM = "item"
+    NEXT_ITEM = "next_item"
+    DONE = "done"
+    MISSING = "missing"
+
+
+_INCOMPLETE = object()
+
+
+class JSONArrayStream:
+    """
+    Incremental decoder of the array under `key` of a top level JSON object
+
+    Bytes are fed as they arrive and array items are returned as soon as they
+    are complete, so only the undecoded tail of the data fed so far is kept,
+    about one item. Other top level values are decoded and dropped, anything
+    after the array isn't decoded at all.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._decoder = json.JSONDecoder()
+        # The C scanner behind `raw_decode`, without its per call overhead.
+        self._scan = self._decoder.scan_once
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        self._state = State.START
+        self._key: str | None = None
+        self._final = False
+
+    def feed(self, data: bytes) -> list[typing.Any]:
+        """Items completed by `data`"""
+        self._buffer = self._buffer[self._position :] + self._text.decode(data)
+        self._position = 0
+        return self._parse()
+
+    def close(self) -> list[typing.Any]:
+        """Items left, raises if the array isn't complete"""
+        self._buffer = self._buffer[self._position :] + self._text.decode(
+            b"", final=True
+        )
+        self._position = 0
+        self._final = True
+        items = self._parse()
+        if self._state == State.MISSING:
+            raise KeyError(self.key)
+        if self._state != State.DONE:
+            raise ValueError(f"JSON ends before the end of {self.key!r} array")
+        return items
+
+    def _skip_whitespace(self) -> bool:
+        """Skip to the next token, False if there's none yet"""
+        buffer, position = self._buffer, self._position
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+        self._position = position
+        return position < len(buffer)
+
+    def _decode(self) -> typing.Any:
+        try:
+            value, end = self._scan(self._buffer, self._position)
+        except (StopIteration, json.JSONDecodeError):
+            if self._final:
+                # For the error message, the scanner doesn't explain.
+                self._decoder.raw_decode(self._buffer, self._position)
+                raise
+            return _INCOMPLETE
+        # Numbers may continue in the next chunk: "1" of "1.5" decodes by itself.
+        if not self._final and (
+            end == len(self._buffer) or self._buffer[end] in NUMBER_CHARS
+        ):
+            return _INCOMPLETE
+        self._position = end
+        return value
+
+    def _expect(self, char: str, expected: str) -> None:
+        if char != expected:
+            raise ValueError(
+                f"expected {expected!r} at {self._position} of chunk, got {char!r}"
+            )
+        self._position += 1
+
+    def _parse(self) -> list[typing.Any]:
+        items = []
+        while (
+            self._state not in (State.DONE, State.MISSING) and self._skip_whitespace()
+        ):
+            char = self._buffer[self._position]
+            match self._state:
+                case State.START:
+                    self._expect(char, "{")
+                    self._state = State.KEY
+                case State.KEY:
+                    if char == "}":
+                        self._position += 1
+                        self._state = State.MISSING
+                        continue
+                    if char != '"':
+                        self._expect(char, '"')
+                    key = self._decode()
+                    if key is _INCOMPLETE:
+                        break
+                    self._key = key
+                    self._state = State.COLON
+                case State.COLON:
+                    self._expect(char, ":")
+                    self._state = State.ARRAY if self._key == self.key else State.VALUE
+                case State.VALUE:
+                    if self._decode() is _INCOMPLETE:
+                        break
+                    self._state = State.NEXT_KEY
+                case State.NEXT_KEY:
+                    if char == "}":
+                        self._position += 1
+                        self._state = State.MISSING
+                        continue
+                    self._expect(char, ",")
+                    self._state = State.KEY
+                case State.ARRAY:
+                    self._expect(char, "[")
+                    self._state = State.FIRST_ITEM
+                case State.FIRST_ITEM:
+                    if char == "]":
+                        self._position += 1
+                        self._state = State.DONE
+                        continue
+                    self._state = State.ITEM
+                case State.ITEM:
+                    item = self._decode()
+                    if item is _INCOMPLETE:
+                        break
+                    items.append(item)
+                    # Most items are followed by a separator in the same chunk.
+                    separator = ITEM_SEPARATOR.match(self._buffer, self._position)
+                    if separator is None:
+                        self._state = State.NEXT_ITEM
+                        continue
+                    self._position = separator.end()
+                    if separator.group(1) == "]":
+                        self._state = State.DONE
+                case State.NEXT_ITEM:
+                    if char == "]":
+                        self._position += 1
+                        self._state = State.DONE
+                        continue
+                    self._expect(char, ",")
+                    self._state = State.ITEM
+
+        if self._state in (State.DONE, State.MISSING):
+            # The rest of the document isn't needed.
+            self._buffer = ""
+            self._position = 0
+        return items
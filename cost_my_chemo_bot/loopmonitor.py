@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import sys
+import threading
+import time
+import traceback
+
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot import metrics
+from cost_my_chemo_bot.config import LOOP_MONITOR_SETTINGS
+
+logger = getLogger(__name__)
+
+
+class LoopMonitor:
+    """
+    Event loop lag and blocking call detector
+
+    A task sleeps for `interval` in a loop and records how late it wakes up,
+    that's the delay every other callback sees too. A watchdog thread checks
+    the heartbeat of that task: when the loop hasn't come back for more than
+    `threshold`, it takes the stack of the loop thread, which is the stack of
+    the blocking callback while it's still running.
+    """
+
+    def __init__(self, interval: float, threshold: float, max_reports: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.reports: collections.deque[dict] = collections.deque(maxlen=max_reports)
+        self.blocked = 0
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+        # Report of the stall in progress, completed with its duration.
+        self._pending: dict | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        """Start monitoring the running loop"""
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._tick(), name="loop-monitor")
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-monitor", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            # From the previous heartbeat, not from the sleep call: the loop may
+            # be blocked before this task runs for the first time.
+            now = time.monotonic()
+            lag = max(now - self._heartbeat - self.interval, 0)
+            self._heartbeat = now
+            metrics.EVENT_LOOP_LAG.observe(lag)
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                pending["blocked_seconds"] = round(lag, 6)
+                logger.warning(
+                    "event loop was blocked for %.3fs, stack:\n%s",
+                    lag,
+                    "".join(pending["stack"]),
+                )
+
+    def _watch(self) -> None:
+        reported = None
+        period = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(period):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled <= self.threshold or heartbeat == reported:
+                continue
+
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            # Drop the reference, frames keep their locals alive.
+            frame = None
+            report = {
+                "at": time.time(),
+                # Updated with the whole stall when the loop is back.
+                "blocked_seconds": round(stalled, 6),
+                "stack": stack,
+            }
+            self.blocked += 1
+            metrics.EVENT_LOOP_BLOCKED.inc()
+            self.reports.append(report)
+            self._pending = report
+
+    def stats(self) -> dict:
+        lag = metrics.EVENT_LOOP_LAG
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "threshold": self.threshold,
+            # No checks yet without the monitor running.
+            "lag": {
+                f"p{round(q * 100)}": lag.quantile(q) if lag.count else None
+                for q in lag.quantiles
+            },
+            "blocked": self.blocked,
+            "reports": list(self.reports),
+        }
+
+
+LOOP_MONITOR = LoopMonitor(
+    interval=LOOP_MONITOR_SETTINGS.LOOP_MONITOR_INTERVAL,
+    threshold=LOOP_MONITOR_SETTINGS.LOOP_MONITOR_THRESHOLD,
+    max_reports=LOOP_MONITOR_SETTINGS.LOOP_MONITOR_MAX_REPORTS,
+)
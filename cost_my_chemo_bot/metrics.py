@@ -0,0 +1,317 @@
+import bisect
+import collections
+import contextvars
+import math
+import time
+import typing
+
+from aiohttp import web
+
+# Prometheus text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 5e7)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class HistogramSeries:
+    """
+    Bucket counts of one label set
+
+    Counts are stored per bucket in a preallocated list and made cumulative
+    only when rendered, so an observation is a bisect and two additions.
+    """
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # The last one is the +Inf bucket.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], HistogramSeries] = {}
+
+    def labels(self, *values: str) -> HistogramSeries:
+        """
+        Series of the label set, callers on hot paths should keep it
+        instead of looking it up for every observation
+        """
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            series = HistogramSeries(self.buckets)
+            self._series[values] = series
+        return series
+
+    def collect(self) -> typing.Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for values, series in list(self._series.items()):
+            labels = _format_labels(self.labelnames, values)
+            cumulative = 0
+            for bound, count in zip(bounds, series.counts):
+                cumulative += count
+                bucket_labels = _format_labels(
+                    self.labelnames + ("le",), values + (bound,)
+                )
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{labels} {_format_value(series.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Single value gauge, `function` computes the value when scraped"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: typing.Callable[[], float] | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.value = math.nan
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def collect(self) -> typing.Iterator[str]:
+        value = self.function() if self.function is not None else self.value
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def collect(self) -> typing.Iterator[str]:
+        name = f"{self.name}_total"
+        yield f"# HELP {name} {self.documentation}"
+        yield f"# TYPE {name} counter"
+        yield f"{name} {_format_value(self.value)}"
+
+
+class Summary:
+    """
+    Quantiles of the last `window` observations, computed when scraped
+
+    Unlike histograms they can't be aggregated across processes, use them for
+    values watched per process.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        quantiles: typing.Sequence[float] = (0.5, 0.9, 0.99, 1),
+        window: int = 1024,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.quantiles = tuple(quantiles)
+        self._values: collections.deque[float] = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._values.append(value)
+        self.count += 1
+        self.sum += value
+
+    @staticmethod
+    def _quantile(values: list[float], q: float) -> float:
+        if not values:
+            return math.nan
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    def quantile(self, q: float) -> float:
+        return self._quantile(sorted(self._values), q)
+
+    def collect(self) -> typing.Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} summary"
+        values = sorted(self._values)
+        for q in self.quantiles:
+            value = _format_value(self._quantile(values, q))
+            yield f'{self.name}{{quantile="{q}"}} {value}'
+        yield f"{self.name}_sum {_format_value(self.sum)}"
+        yield f"{self.name}_count {self.count}"
+
+
+Metric = Histogram | Gauge | Counter | Summary
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+UPDATE_LATENCY = REGISTRY.register(
+    Histogram(
+        "bot_update_seconds",
+        "Time to process an update by FSM state and handler.",
+        labelnames=("state", "handler"),
+    )
+)
+STORAGE_LATENCY = REGISTRY.register(
+    Histogram(
+        "bot_storage_seconds",
+        "FSM storage call latency by backend and method.",
+        labelnames=("backend", "method"),
+    )
+)
+CATALOG_FETCH_LATENCY = REGISTRY.register(
+    Histogram(
+        "catalog_fetch_seconds",
+        "1C catalog request latency by action.",
+        labelnames=("action",),
+    )
+)
+CATALOG_PARSE_LATENCY = REGISTRY.register(
+    Histogram(
+        "catalog_parse_seconds",
+        "Time to decode and validate a 1C catalog response by action.",
+        labelnames=("action",),
+    )
+)
+CATALOG_FETCH_BYTES = REGISTRY.register(
+    Histogram(
+        "catalog_fetch_bytes",
+        "1C catalog response size by action.",
+        labelnames=("action",),
+        buckets=SIZE_BUCKETS,
+    )
+)
+BITRIX_LATENCY = REGISTRY.register(
+    Histogram(
+        "bitrix_request_seconds",
+        "Bitrix REST call latency by method.",
+        labelnames=("method",),
+    )
+)
+CATALOG_LOADED_AT = REGISTRY.register(
+    Gauge("catalog_loaded_timestamp_seconds", "When the catalog was last loaded.")
+)
+CATALOG_AGE = REGISTRY.register(
+    Gauge(
+        "catalog_age_seconds",
+        "Seconds since the catalog was last loaded.",
+        function=lambda: time.time() - CATALOG_LOADED_AT.value,
+    )
+)
+CATALOG_VERSION = REGISTRY.register(
+    Gauge("catalog_version", "Version of the loaded catalog, see `CatalogIndex`.")
+)
+EVENT_LOOP_LAG = REGISTRY.register(
+    Summary(
+        "event_loop_lag_seconds",
+        "How late the event loop runs a timer, over recent checks.",
+    )
+)
+EVENT_LOOP_BLOCKED = REGISTRY.register(
+    Counter("event_loop_blocked", "Times the event loop was blocked over threshold.")
+)
+
+NO_STATE = "none"
+UNHANDLED = "unhandled"
+# (state, handler) the current update was routed to.
+_update_route: contextvars.ContextVar[tuple[str, str]] = contextvars.ContextVar(
+    "update_route", default=(NO_STATE, UNHANDLED)
+)
+
+
+def set_update_route(state: str | None, handler: str) -> None:
+    _update_route.set((state or NO_STATE, handler))
+
+
+def reset_update_route() -> None:
+    _update_route.set((NO_STATE, UNHANDLED))
+
+
+def observe_update(elapsed: float) -> None:
+    UPDATE_LATENCY.labels(*_update_route.get()).observe(elapsed)
+
+
+def catalog_loaded(version: int) -> None:
+    CATALOG_LOADED_AT.set(time.time())
+    CATALOG_VERSION.set(version)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve /metrics on a separate port, for the bot running without fastapi"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
@@ -0,0 +1,366 @@
+import asyncio
+import contextlib
+import pathlib
+import time
+import typing
+import uuid
+
+import aiohttp
+from gcloud.aio.storage import Storage
+from logfmt_logger import getLogger
+from pydantic import BaseModel, Field
+from redis import asyncio as aioredis
+
+from cost_my_chemo_bot.bitrix import BATCH_MAX_COMMANDS, Bitrix, BitrixError
+from cost_my_chemo_bot.config import (
+    LEAD_OUTBOX_SETTINGS,
+    REDIS_SETTINGS,
+    SETTINGS,
+    StorageType,
+)
+
+logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
+
+
+class Lead(BaseModel):
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    params: dict[str, typing.Any]
+    attempts: int = 0
+    created_at: float = Field(default_factory=time.time)
+    next_attempt_at: float = 0
+    last_error: str | None = None
+
+
+class LeadOutbox:
+    """
+    Durable queue of leads waiting for delivery to Bitrix.
+
+    Leads are kept in `pending` until delivered, leads that failed too many
+    times are moved to `dead`. Every write replaces a whole lead at once, so a
+    crash never leaves a half written lead behind.
+    """
+
+    async def put(self, lead: Lead) -> None:
+        raise NotImplementedError
+
+    async def done(self, lead: Lead) -> None:
+        raise NotImplementedError
+
+    async def bury(self, lead: Lead) -> None:
+        raise NotImplementedError
+
+    async def pending(self) -> list[Lead]:
+        raise NotImplementedError
+
+    async def dead(self) -> list[Lead]:
+        raise NotImplementedError
+
+    async def due(self, limit: int, now: float | None = None) -> list[Lead]:
+        if now is None:
+            now = time.time()
+        leads = [lead for lead in await self.pending() if lead.next_attempt_at <= now]
+        leads.sort(key=lambda lead: lead.created_at)
+        return leads[:limit]
+
+    async def close(self) -> None:
+        ...
+
+
+class FileLeadOutbox(LeadOutbox):
+    """
+    Every lead is a JSON file in `pending` or `dead`, replaced atomically.
+
+    Only durable on a persistent volume, for local runs.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.pending_dir = pathlib.Path(path) / "pending"
+        self.dead_dir = pathlib.Path(path) / "dead"
+
+    @staticmethod
+    def _write(path: pathlib.Path, lead: Lead) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(lead.json())
+        tmp_path.replace(path)
+
+    async def put(self, lead: Lead) -> None:
+        self._write(self.pending_dir / f"{lead.id}.json", lead)
+
+    async def done(self, lead: Lead) -> None:
+        (self.pending_dir / f"{lead.id}.json").unlink(missing_ok=True)
+
+    async def bury(self, lead: Lead) -> None:
+        self._write(self.dead_dir / f"{lead.id}.json", lead)
+        await self.done(lead)
+
+    @staticmethod
+    def _read_all(directory: pathlib.Path) -> list[Lead]:
+        if not directory.exists():
+            return []
+
+        leads = []
+        for path in directory.glob("*.json"):
+            try:
+                leads.append(Lead.parse_file(path))
+            except (OSError, ValueError):
+                logger.exception("can't read lead: %s", path)
+        return leads
+
+    async def pending(self) -> list[Lead]:
+        return self._read_all(self.pending_dir)
+
+    async def dead(self) -> list[Lead]:
+        return self._read_all(self.dead_dir)
+
+
+class RedisLeadOutbox(LeadOutbox):
+    """Leads are values of `pending` and `dead` hashes, by lead id"""
+
+    def __init__(
+        self, redis: aioredis.Redis, key_prefix: str = "cost_my_chemo_bot:outbox"
+    ):
+        self.redis = redis
+        self.pending_key = f"{key_prefix}:pending"
+        self.dead_key = f"{key_prefix}:dead"
+
+    async def put(self, lead: Lead) -> None:
+        await self.redis.hset(self.pending_key, lead.id, lead.json())
+
+    async def done(self, lead: Lead) -> None:
+        await self.redis.hdel(self.pending_key, lead.id)
+
+    async def bury(self, lead: Lead) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.dead_key, lead.id, lead.json())
+            pipe.hdel(self.pending_key, lead.id)
+            await pipe.execute()
+
+    async def _read_all(self, key: str) -> list[Lead]:
+        leads = []
+        for lead_id, value in (await self.redis.hgetall(key)).items():
+            try:
+                leads.append(Lead.parse_raw(value))
+            except ValueError:
+                logger.exception("can't read lead: %s", lead_id)
+        return leads
+
+    async def pending(self) -> list[Lead]:
+        return await self._read_all(self.pending_key)
+
+    async def dead(self) -> list[Lead]:
+        return await self._read_all(self.dead_key)
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+class GcloudLeadOutbox(LeadOutbox):
+    """Every lead is a `{prefix}/pending/` or `{prefix}/dead/` JSON blob"""
+
+    def __init__(
+        self, bucket_name: str = "cost-my-chemo-bot-storage", prefix: str = "outbox"
+    ):
+        self.bucket_name = bucket_name
+        self.pending_prefix = f"{prefix}/pending/"
+        self.dead_prefix = f"{prefix}/dead/"
+
+    @contextlib.asynccontextmanager
+    async def get_storage(self) -> typing.AsyncIterator[Storage]:
+        async with aiohttp.ClientSession() as session:
+            yield Storage(session=session)
+
+    async def _write(self, storage: Storage, name: str, lead: Lead) -> None:
+        await storage.upload(
+            self.bucket_name, name, lead.json(), content_type="application/json"
+        )
+
+    async def _delete(self, storage: Storage, name: str) -> None:
+        try:
+            await storage.delete(self.bucket_name, name)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404:
+                raise
+
+    async def put(self, lead: Lead) -> None:
+        async with self.get_storage() as storage:
+            await self._write(storage, f"{self.pending_prefix}{lead.id}.json", lead)
+
+    async def done(self, lead: Lead) -> None:
+        async with self.get_storage() as storage:
+            await self._delete(storage, f"{self.pending_prefix}{lead.id}.json")
+
+    async def bury(self, lead: Lead) -> None:
+        async with self.get_storage() as storage:
+            await self._write(storage, f"{self.dead_prefix}{lead.id}.json", lead)
+            await self._delete(storage, f"{self.pending_prefix}{lead.id}.json")
+
+    async def _read_all(self, prefix: str) -> list[Lead]:
+        leads = []
+        async with self.get_storage() as storage:
+            params = {"prefix": prefix}
+            while True:
+                result = await storage.list_objects(self.bucket_name, params=params)
+                for item in result.get("items", []):
+                    try:
+                        body = await storage.download(self.bucket_name, item["name"])
+                        leads.append(Lead.parse_raw(body))
+                    except aiohttp.ClientResponseError as e:
+                        # Delivered or buried since the listing.
+                        if e.status != 404:
+                            raise
+                    except ValueError:
+                        logger.exception("can't read lead: %s", item["name"])
+                if not result.get("nextPageToken"):
+                    return leads
+                params["pageToken"] = result["nextPageToken"]
+
+    async def pending(self) -> list[Lead]:
+        return await self._read_all(self.pending_prefix)
+
+    async def dead(self) -> list[Lead]:
+        return await self._read_all(self.dead_prefix)
+
+
+class LeadOutboxWorker:
+    def __init__(
+        self,
+        outbox: LeadOutbox,
+        bitrix: Bitrix,
+        batch_size: int = BATCH_MAX_COMMANDS,
+        max_attempts: int = 8,
+        backoff_base: float = 5,
+        backoff_max: float = 60 * 60,
+        poll_interval: float = 30,
+    ):
+        self.outbox = outbox
+        self.bitrix = bitrix
+        self.batch_size = min(batch_size, BATCH_MAX_COMMANDS)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        self.delivered = 0
+        self.retried = 0
+        self.buried = 0
+
+    async def enqueue(self, params: dict[str, typing.Any]) -> Lead:
+        lead = Lead(params=params)
+        await self.outbox.put(lead)
+        self._wakeup.set()
+        logger.info("lead %s queued", lead.id)
+        return lead
+
+    async def _fail(self, lead: Lead, error: str) -> None:
+        lead.attempts += 1
+        lead.last_error = error
+        if lead.attempts >= self.max_attempts:
+            logger.error("lead %s is dead after %s attempts", lead.id, lead.attempts)
+            await self.outbox.bury(lead)
+            self.buried += 1
+            return
+
+        backoff = min(self.backoff_base * 2 ** (lead.attempts - 1), self.backoff_max)
+        lead.next_attempt_at = time.time() + backoff
+        logger.warning(
+            "lead %s failed, retry in %ss: %s", lead.id, backoff, lead.last_error
+        )
+        await self.outbox.put(lead)
+        self.retried += 1
+
+    async def flush(self) -> int:
+        """Deliver one batch of due leads and return how many were sent."""
+        leads = await self.outbox.due(limit=self.batch_size)
+        if not leads:
+            return 0
+
+        try:
+            results, errors = await self.bitrix.add_leads(
+                {lead.id: lead.params for lead in leads}
+            )
+        except (BitrixError, OSError, ValueError) as e:
+            logger.exception("can't deliver %s leads", len(leads))
+            for lead in leads:
+                await self._fail(lead, repr(e))
+            return 0
+
+        delivered = 0
+        for lead in leads:
+            if lead.id in results:
+                logger.info("lead %s saved: %s", lead.id, results[lead.id])
+                await self.outbox.done(lead)
+                delivered += 1
+            else:
+                await self._fail(lead, str(errors.get(lead.id, "no result")))
+
+        self.delivered += delivered
+        return delivered
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delivered = await self.flush()
+            except Exception:
+                logger.exception("lead outbox worker failed")
+                delivered = 0
+
+            if delivered >= self.batch_size:
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Leads left are delivered by the next worker or `deliver_leads` call,
+        # not while a webhook request waits for the shutdown.
+        await self.outbox.close()
+
+
+def make_lead_outbox() -> LeadOutbox:
+    # Next to FSM states by default, local files don't outlive a function instance.
+    outbox_type = LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_TYPE or SETTINGS.STORAGE_TYPE
+    match outbox_type:
+        case StorageType.JSON:
+            return FileLeadOutbox(LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_DIR)
+        case StorageType.GCLOUD:
+            return GcloudLeadOutbox()
+        case StorageType.REDIS:
+            return RedisLeadOutbox(
+                aioredis.Redis(
+                    host=REDIS_SETTINGS.REDIS_HOST,
+                    port=REDIS_SETTINGS.REDIS_PORT,
+                    db=REDIS_SETTINGS.REDIS_DB,
+                    username=REDIS_SETTINGS.REDIS_USERNAME,
+                    password=REDIS_SETTINGS.REDIS_PASSWORD,
+                )
+            )
+    raise ValueError(f"unknown lead outbox type: {outbox_type}")
+
+
+LEAD_OUTBOX_WORKER = LeadOutboxWorker(
+    outbox=make_lead_outbox(),
+    bitrix=Bitrix(),
+    batch_size=LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_BATCH_SIZE,
+    max_attempts=LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_MAX_ATTEMPTS,
+    backoff_base=LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_BACKOFF_BASE,
+    backoff_max=LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_BACKOFF_MAX,
+    poll_interval=LEAD_OUTBOX_SETTINGS.LEAD_OUTBOX_POLL_INTERVAL,
+)
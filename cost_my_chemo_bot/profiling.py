@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import cProfile
+import io
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+from logfmt_logger import getLogger
+
+logger = getLogger(__name__)
+
+MAX_SECONDS = 120
+CPU = "cpu"
+WALL = "wall"
+# Checked before profiling, pstats only rejects unknown keys afterwards.
+SORT_KEYS = tuple(key.value for key in pstats.SortKey)
+# Top frames of the event loop waiting for IO.
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "_run_once"}
+
+
+class ProfilerBusy(Exception):
+    ...
+
+
+# Profiles change process wide state, one at a time.
+_lock = asyncio.Lock()
+
+
+def _short_path(path: str) -> str:
+    prefixes = [prefix for prefix in sys.path if prefix and path.startswith(prefix)]
+    if not prefixes:
+        return path
+    return path[len(max(prefixes, key=len)) :].lstrip("/")
+
+
+def _frame_label(name: str, path: str, line: int) -> str:
+    return f"{name} ({_short_path(path)}:{line})"
+
+
+def _collapse(frame: types.FrameType | None) -> str:
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(_frame_label(code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def format_collapsed(stacks: collections.Counter[str]) -> str:
+    """Brendan Gregg's collapsed format, input of flamegraph.pl and speedscope"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _sample_thread(
+    thread_id: int, seconds: float, interval: float, include_idle: bool
+) -> collections.Counter[str]:
+    stacks: collections.Counter[str] = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None and (
+            include_idle or frame.f_code.co_name not in IDLE_FUNCTIONS
+        ):
+            stacks[_collapse(frame)] += 1
+        # Drop the reference, frames keep their locals alive.
+        frame = None
+        time.sleep(interval)
+    return stacks
+
+
+async def _sample_cpu(seconds: float, interval: float) -> collections.Counter[str]:
+    stacks: collections.Counter[str] = collections.Counter()
+
+    def sample(signum, frame):
+        stacks[_collapse(frame)] += 1
+
+    previous = signal.signal(signal.SIGPROF, sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+    return stacks
+
+
+async def sample_stacks(
+    seconds: float,
+    interval: float = 0.005,
+    mode: str = CPU,
+    include_idle: bool = False,
+) -> collections.Counter[str]:
+    """
+    Sample stacks of the event loop thread
+
+    `cpu` mode samples on SIGPROF every `interval` of CPU time, it runs in
+    the main thread and sees exactly what the loop is executing.
+    `wall` mode samples from a helper thread by wall clock. It gets the GIL
+    mostly when the loop releases it, so it's good at finding blocking IO
+    and poor at short CPU bursts.
+    """
+    if _lock.locked():
+        raise ProfilerBusy()
+    async with _lock:
+        if mode == CPU:
+            if threading.current_thread() is threading.main_thread():
+                return await _sample_cpu(seconds, interval)
+            # Signal handlers can be set only from the main thread.
+            logger.warning("event loop isn't in the main thread, sample wall time")
+        thread_id = threading.get_ident()
+        return await asyncio.to_thread(
+            _sample_thread, thread_id, seconds, interval, include_idle
+        )
+
+
+async def profile_calls(
+    seconds: float, sort: str = "cumulative", limit: int = 50
+) -> str:
+    """Deterministic profile of everything the event loop runs, pstats text"""
+    if _lock.locked():
+        raise ProfilerBusy()
+    async with _lock:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+
+    output = io.StringIO()
+    pstats.Stats(profile, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+async def memory_growth(
+    seconds: float, frames: int = 25, limit: int = 200
+) -> collections.Counter[str]:
+    """
+    Allocation stacks that grew over `seconds`, by bytes
+
+    tracemalloc is started for the time of the measurement unless it's
+    already tracing, only memory allocated meanwhile is seen.
+    """
+    if _lock.locked():
+        raise ProfilerBusy()
+    async with _lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(frames)
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+    stacks: collections.Counter[str] = collections.Counter()
+    for diff in after.compare_to(before, "traceback")[:limit]:
+        if diff.size_diff <= 0:
+            continue
+        # Frames are ordered from the oldest one.
+        stack = ";".join(
+            f"{_short_path(frame.filename)}:{frame.lineno}" for frame in diff.traceback
+        )
+        stacks[stack] += diff.size_diff
+    return stacks
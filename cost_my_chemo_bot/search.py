@@ -0,0 +1,167 @@
+import bisect
+import collections
+import functools
+import itertools
+import re
+import typing
+import unicodedata
+
+if typing.TYPE_CHECKING:
+    from cost_my_chemo_bot.db import Course
+
+# Course names are written both in Cyrillic and Latin, so everything is
+# transliterated to Latin and folded to a rough phonetic form before indexing:
+# "Паклитаксел" and "Paclitaxel" both become "paklitaksel".
+TRANSLITERATION = str.maketrans(
+    {
+        "а": "a",
+        "б": "b",
+        "в": "v",
+        "г": "g",
+        "д": "d",
+        "е": "e",
+        "ё": "e",
+        "ж": "zh",
+        "з": "z",
+        "и": "i",
+        "й": "i",
+        "к": "k",
+        "л": "l",
+        "м": "m",
+        "н": "n",
+        "о": "o",
+        "п": "p",
+        "р": "r",
+        "с": "s",
+        "т": "t",
+        "у": "u",
+        "ф": "f",
+        "х": "h",
+        "ц": "ts",
+        "ч": "ch",
+        "ш": "sh",
+        "щ": "sch",
+        "ъ": "",
+        "ы": "i",
+        "ь": "",
+        "э": "e",
+        "ю": "iu",
+        "я": "ia",
+    }
+)
+FOLDING = (
+    ("ph", "f"),
+    ("th", "t"),
+    ("x", "ks"),
+    ("c", "k"),
+    ("q", "k"),
+    ("y", "i"),
+    ("w", "v"),
+)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(text: str) -> tuple[str, ...]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = text.translate(TRANSLITERATION)
+    for old, new in FOLDING:
+        text = text.replace(old, new)
+    return tuple(TOKEN_RE.findall(text))
+
+
+def trigrams(tokens: typing.Iterable[str]) -> frozenset[str]:
+    grams = set()
+    for token in tokens:
+        padded = f"  {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class CourseSearchIndex:
+    """
+    Trigram index over course names
+
+    Candidates are scored by Dice coefficient of their trigram sets, counted
+    from the posting lists of query trigrams only, so a search touches just the
+    courses sharing at least one trigram with the query.
+    """
+
+    def __init__(self, courses: typing.Sequence["Course"]):
+        self.courses = tuple(courses)
+        self._sizes: list[int] = []
+        self._postings: dict[str, list[int]] = collections.defaultdict(list)
+        for i, course in enumerate(self.courses):
+            grams = trigrams(normalize(course.Course))
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+        self._postings = dict(self._postings)
+
+    def search(
+        self,
+        query: str,
+        limit: int = 5,
+        min_score: float = 0.3,
+        allowed: typing.Container[str] | None = None,
+    ) -> list[tuple["Course", float]]:
+        """
+        Find courses with names similar to `query`
+
+        :param allowed: ids of courses to choose from, all courses if None
+        :return: courses with their scores from 0 to 1, best first
+        """
+        grams = trigrams(normalize(query))
+        if not grams:
+            return []
+
+        common: collections.Counter[int] = collections.Counter()
+        for gram in grams:
+            common.update(self._postings.get(gram, ()))
+
+        found = []
+        for i, count in common.items():
+            score = 2 * count / (len(grams) + self._sizes[i])
+            if score < min_score:
+                continue
+            course = self.courses[i]
+            if allowed is not None and course.Courseid not in allowed:
+                continue
+            found.append((course, score))
+
+        found.sort(key=lambda item: (-item[1], item[0].Course))
+        return found[:limit]
+
+
+class CoursePrefixIndex:
+    """
+    Sorted array of normalized course names for prefix search
+
+    Every name is added once per token, starting from that token, so a query
+    matches the beginning of any word: "karbo" finds "Paklitaksel + karboplatin".
+    """
+
+    def __init__(self, courses: typing.Sequence["Course"]):
+        self.courses = tuple(courses)
+        entries = []
+        for i, course in enumerate(self.courses):
+            tokens = normalize(course.Course)
+            for start in range(len(tokens)):
+                entries.append((" ".join(tokens[start:]), i))
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._positions = [position for _, position in entries]
+
+    def search(self, query: str, limit: int = 50) -> list["Course"]:
+        prefix = " ".join(normalize(query))
+        found: dict[int, None] = {}
+        start = bisect.bisect_left(self._keys, prefix)
+        for key, position in zip(
+            itertools.islice(self._keys, start, None),
+            itertools.islice(self._positions, start, None),
+        ):
+            if not key.startswith(prefix) or len(found) >= limit:
+                break
+            found[position] = None
+        return [self.courses[position] for position in found]
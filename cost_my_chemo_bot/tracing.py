@@ -0,0 +1,221 @@
+import contextlib
+import contextvars
+import functools
+import heapq
+import itertools
+import json
+import pathlib
+import random
+import time
+import typing
+
+from logfmt_logger import getLogger
+
+from cost_my_chemo_bot.config import TRACING_SETTINGS
+
+logger = getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+
+class Span:
+    __slots__ = ("name", "attributes", "started", "finished", "children")
+
+    def __init__(self, name: str, attributes: dict[str, typing.Any]):
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        self.children: list[Span] = []
+
+    @property
+    def duration(self) -> float:
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        return finished - self.started
+
+    def as_dict(self, origin: float) -> dict:
+        """Times are in milliseconds, `start` is relative to `origin`"""
+        return {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "children": [child.as_dict(origin) for child in self.children],
+        }
+
+
+class Trace:
+    _ids = itertools.count(1)
+
+    def __init__(self, root: Span):
+        self.id = next(self._ids)
+        self.timestamp = time.time()
+        self.root = root
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.id,
+            "timestamp": self.timestamp,
+            "duration_ms": round(self.duration * 1000, 3),
+            "root": self.root.as_dict(self.root.started),
+        }
+
+
+class SpanExporter:
+    """Receives every finished sampled trace"""
+
+    def export(self, trace: Trace) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JSONLinesExporter(SpanExporter):
+    """Appends one JSON line per trace, lines are small so writes are sync"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._file: typing.TextIO | None = None
+
+    def export(self, trace: Trace) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", buffering=1)
+        self._file.write(json.dumps(trace.as_dict(), default=str) + "\n")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Tracer:
+    """
+    Span trees of sampled updates
+
+    Sampling is decided when a trace starts, spans of unsampled traces cost one
+    context variable lookup. The slowest `keep_slowest` traces are kept in
+    memory for the admin endpoint.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        keep_slowest: int = 20,
+        exporter: SpanExporter | None = None,
+    ):
+        self.sample_rate = sample_rate
+        self.keep_slowest = keep_slowest
+        self.exporter = exporter
+        # Min-heap by duration, the fastest kept trace is replaced first.
+        self._slowest: list[tuple[float, int, Trace]] = []
+
+        self.started = 0
+        self.sampled = 0
+
+    def start_trace(self, name: str, **attributes: typing.Any) -> Trace | None:
+        self.started += 1
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            _current_trace.set(None)
+            _current_span.set(None)
+            return None
+
+        self.sampled += 1
+        trace = Trace(Span(name, attributes))
+        _current_trace.set(trace)
+        _current_span.set(trace.root)
+        return trace
+
+    def finish_trace(self) -> Trace | None:
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+
+        _current_trace.set(None)
+        _current_span.set(None)
+        trace.root.finished = time.perf_counter()
+        item = (trace.duration, trace.id, trace)
+        if len(self._slowest) < self.keep_slowest:
+            heapq.heappush(self._slowest, item)
+        elif self._slowest and item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+        if self.exporter is not None:
+            try:
+                self.exporter.export(trace)
+            except Exception:
+                logger.exception("can't export trace %s", trace.id)
+        return trace
+
+    def slowest(self) -> list[Trace]:
+        return [trace for *_, trace in sorted(self._slowest, reverse=True)]
+
+    def close(self) -> None:
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: typing.Any) -> typing.Iterator[Span | None]:
+    """Child span of the current one, does nothing outside a sampled trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    current = Span(name, attributes)
+    parent.children.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = repr(e)
+        raise
+    finally:
+        current.finished = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(
+    name: str,
+) -> typing.Callable[
+    [typing.Callable[..., typing.Awaitable[T]]],
+    typing.Callable[..., typing.Awaitable[T]],
+]:
+    """Run the coroutine function in a span named `name`"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, function=func.__name__):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def make_exporter() -> SpanExporter | None:
+    if TRACING_SETTINGS.TRACING_JSONL_PATH is None:
+        return None
+    return JSONLinesExporter(TRACING_SETTINGS.TRACING_JSONL_PATH)
+
+
+TRACER = Tracer(
+    sample_rate=TRACING_SETTINGS.TRACING_SAMPLE_RATE,
+    keep_slowest=TRACING_SETTINGS.TRACING_KEEP_SLOWEST,
+    exporter=make_exporter(),
+)
@@ -0,0 +1,72 @@
+import functools
+import re
+import time
+
+import phonenumbers
+from logfmt_logger import getLogger
+from pydantic import EmailError, EmailStr
+
+from cost_my_chemo_bot.config import SETTINGS, VALIDATION_SETTINGS
+
+logger = getLogger(__name__, level=SETTINGS.LOG_LEVEL)
+
+# Cheap checks rejecting obvious garbage before the parsers run.
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+# International format only, like `phonenumbers.parse(text, None)` expects.
+PHONE_NUMBER_RE = re.compile(r"\+[\d\s()\-.]{6,30}")
+PHONE_NUMBER_MIN_DIGITS = 7
+PHONE_NUMBER_MAX_DIGITS = 15
+
+
+@functools.lru_cache(maxsize=VALIDATION_SETTINGS.VALIDATION_CACHE_SIZE)
+def normalize_email(text: str | None) -> str | None:
+    """Return normalized email or None if `text` is not a valid email"""
+    if not text or len(text) > 254 or not EMAIL_RE.fullmatch(text.strip()):
+        return None
+
+    try:
+        return EmailStr.validate(text.strip())
+    except EmailError:
+        return None
+
+
+@functools.lru_cache(maxsize=VALIDATION_SETTINGS.VALIDATION_CACHE_SIZE)
+def normalize_phone_number(text: str | None) -> str | None:
+    """Return phone number in E.164 format or None if `text` is not valid"""
+    if not text or not PHONE_NUMBER_RE.fullmatch(text.strip()):
+        return None
+
+    digits = sum(char.isdigit() for char in text)
+    if not PHONE_NUMBER_MIN_DIGITS <= digits <= PHONE_NUMBER_MAX_DIGITS:
+        return None
+
+    try:
+        parsed_number = phonenumbers.parse(text, None)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(parsed_number):
+        return None
+
+    return phonenumbers.format_number(
+        parsed_number, phonenumbers.PhoneNumberFormat.E164
+    )
+
+
+def warm_up() -> None:
+    """Load phonenumbers metadata now instead of on the first user's message."""
+    started_at = time.perf_counter()
+    for region in VALIDATION_SETTINGS.VALIDATION_PHONE_REGIONS:
+        example = phonenumbers.example_number(region)
+        if example is None:
+            logger.warning("unknown phone number region: %s", region)
+            continue
+        phonenumbers.is_valid_number(
+            phonenumbers.parse(
+                phonenumbers.format_number(
+                    example, phonenumbers.PhoneNumberFormat.INTERNATIONAL
+                ),
+                None,
+            )
+        )
+    EmailStr.validate("warm.up@example.com")
+    logger.info("validation warmed up in %.3fs", time.perf_counter() - started_at)
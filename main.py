@@ -6,10 +6,12 @@ from aiogram import Dispatcher, types
 from flask import Request
 from logfmt_logger import getLogger
 
+from cost_my_chemo_bot.bitrix import Bitrix
 from cost_my_chemo_bot.bots.telegram.bot import close_bot, make_bot
-from cost_my_chemo_bot.bots.telegram.dispatcher import make_dispatcher
+from cost_my_chemo_bot.bots.telegram.dispatcher import feed_update, make_dispatcher
 from cost_my_chemo_bot.bots.telegram.storage import make_storage
 from cost_my_chemo_bot.config import SETTINGS
+from cost_my_chemo_bot.outbox import LEAD_OUTBOX_WORKER
 
 logger = getLogger(__name__)
 
@@ -35,7 +37,7 @@ async def process_event(event) -> dict:
     try:
         update = types.Update.to_object(event)
         logger.info(f"new_update={update}")
-        results = await dp.process_update(update)
+        results = await feed_update(dp, update)
         results = [json.loads(r.get_web_response().body) for r in results]
         logger.info(f"results={results}")
         if not results:
@@ -65,3 +67,21 @@ def process_webhook(request: Request):
     return asyncio.new_event_loop().run_until_complete(
         process_event(event=request_json)
     )
+
+
+async def process_outbox() -> dict:
+    """Delivering queued leads to Bitrix, out of the webhook requests."""
+    delivered = 0
+    try:
+        while sent := await LEAD_OUTBOX_WORKER.flush():
+            delivered += sent
+        return {"delivered": delivered}
+    finally:
+        await LEAD_OUTBOX_WORKER.outbox.close()
+        await Bitrix.close()
+
+
+@functions_framework.http
+def deliver_leads(request: Request):
+    """HTTP Cloud Function, called by Cloud Scheduler, see scripts/deploy.sh."""
+    return asyncio.new_event_loop().run_until_complete(process_outbox())
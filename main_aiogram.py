@@ -2,20 +2,37 @@ from aiogram import Dispatcher, executor
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
 from logfmt_logger import getLogger
 
+from cost_my_chemo_bot import metrics
 from cost_my_chemo_bot.bots.telegram.bot import close_bot, init_bot, make_bot
 from cost_my_chemo_bot.bots.telegram.dispatcher import make_dispatcher
 from cost_my_chemo_bot.bots.telegram.storage import make_storage
-from cost_my_chemo_bot.config import SETTINGS, WEBHOOK_SETTINGS, BotMode
+from cost_my_chemo_bot.config import (
+    LOOP_MONITOR_SETTINGS,
+    METRICS_SETTINGS,
+    SETTINGS,
+    WEBHOOK_SETTINGS,
+    BotMode,
+)
+from cost_my_chemo_bot.loopmonitor import LOOP_MONITOR
 
 logger = getLogger(__name__)
 
 
 async def on_startup(dp: Dispatcher):
+    if LOOP_MONITOR_SETTINGS.LOOP_MONITOR:
+        LOOP_MONITOR.start()
     await init_bot(bot=dp.bot, dp=dp)
+    if METRICS_SETTINGS.METRICS_PORT is not None:
+        dp["metrics_runner"] = await metrics.start_metrics_server(
+            host=METRICS_SETTINGS.METRICS_HOST, port=METRICS_SETTINGS.METRICS_PORT
+        )
 
 
 async def on_shutdown(dp):
     await close_bot(bot=dp.bot, dp=dp)
+    if "metrics_runner" in dp:
+        await dp["metrics_runner"].cleanup()
+    await LOOP_MONITOR.stop()
 
 
 if __name__ == "__main__":
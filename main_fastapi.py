@@ -1,17 +1,32 @@
+import dataclasses
 import json
 import secrets
 
 import uvicorn
 from aiogram import Bot, Dispatcher, types
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBasicCredentials, APIKeyHeader
 from logfmt_logger import getLogger
+from pydantic import BaseModel
 
+from cost_my_chemo_bot import metrics, profiling
 from cost_my_chemo_bot.bots.telegram.bot import close_bot, init_bot, make_bot
-from cost_my_chemo_bot.bots.telegram.dispatcher import make_dispatcher
+from cost_my_chemo_bot.bots.telegram.broadcast import (
+    Broadcaster,
+    BroadcastNotFound,
+    make_broadcast_checkpoints,
+)
+from cost_my_chemo_bot.bots.telegram.dispatcher import feed_update, make_dispatcher
+from cost_my_chemo_bot.bots.telegram.pagination import COURSE_KEYBOARDS
+from cost_my_chemo_bot.bots.telegram.prefetch import PREFETCHER
 from cost_my_chemo_bot.bots.telegram.storage import make_storage
-from cost_my_chemo_bot.config import SETTINGS, WEBHOOK_SETTINGS
+from cost_my_chemo_bot.bots.telegram.throttling import THROTTLER
+from cost_my_chemo_bot.config import LOOP_MONITOR_SETTINGS, SETTINGS, WEBHOOK_SETTINGS
 from cost_my_chemo_bot.db import DB
+from cost_my_chemo_bot.loopmonitor import LOOP_MONITOR
+from cost_my_chemo_bot.outbox import LEAD_OUTBOX_WORKER
+from cost_my_chemo_bot.tracing import TRACER
 
 logger = getLogger(__name__)
 app = FastAPI()
@@ -23,6 +38,14 @@ storage = make_storage()
 dp = make_dispatcher(bot, storage=storage)
 Bot.set_current(dp.bot)
 Dispatcher.set_current(dp)
+broadcaster = Broadcaster(
+    bot=bot, storage=storage, checkpoints=make_broadcast_checkpoints()
+)
+
+
+class BroadcastRequest(BaseModel):
+    text: str
+    parse_mode: str | None = None
 
 
 async def check_creds(credentials: str = Depends(security)):
@@ -53,6 +76,8 @@ async def check_creds(credentials: str = Depends(security)):
 async def on_startup():
     bot = Bot.get_current()
     dp = Dispatcher.get_current()
+    if LOOP_MONITOR_SETTINGS.LOOP_MONITOR:
+        LOOP_MONITOR.start()
     await init_bot(bot, dp)
 
 
@@ -61,7 +86,7 @@ async def bot_webhook(update: dict):
     telegram_update = types.Update(**update)
     Dispatcher.set_current(dp)
     Bot.set_current(bot)
-    results = await dp.process_update(telegram_update)
+    results = await feed_update(dp, telegram_update)
     results = [json.loads(r.get_web_response().body) for r in results]
     logger.info(f"results={results}")
     if not results:
@@ -92,6 +117,94 @@ async def reload_db(credentials: HTTPBasicCredentials = Depends(check_creds)):
     return {"ok": True}
 
 
+@app.get("/leads/dead/")
+async def get_dead_leads(credentials: HTTPBasicCredentials = Depends(check_creds)):
+    return await LEAD_OUTBOX_WORKER.outbox.dead()
+
+
+@app.get("/stats/prefetch/")
+async def get_prefetch_stats(credentials: HTTPBasicCredentials = Depends(check_creds)):
+    return {
+        **dataclasses.asdict(PREFETCHER.stats),
+        "hit_rate": PREFETCHER.stats.hit_rate,
+        "course_keyboards": {
+            "hits": COURSE_KEYBOARDS.hits,
+            "misses": COURSE_KEYBOARDS.misses,
+        },
+    }
+
+
+@app.get("/stats/throttling/")
+async def get_throttling_stats(
+    credentials: HTTPBasicCredentials = Depends(check_creds),
+):
+    return {"passed": THROTTLER.passed, "throttled": THROTTLER.throttled}
+
+
+@app.get("/traces/slowest/")
+async def get_slowest_traces(
+    credentials: HTTPBasicCredentials = Depends(check_creds),
+):
+    return {
+        "started": TRACER.started,
+        "sampled": TRACER.sampled,
+        "traces": [trace.as_dict() for trace in TRACER.slowest()],
+    }
+
+
+@app.get("/profile/stacks/", response_class=PlainTextResponse)
+async def profile_stacks(
+    seconds: float = Query(10, gt=0, le=profiling.MAX_SECONDS),
+    interval: float = Query(0.005, ge=0.001, le=1),
+    mode: str = Query(profiling.CPU, regex=f"^({profiling.CPU}|{profiling.WALL})$"),
+    include_idle: bool = False,
+    credentials: HTTPBasicCredentials = Depends(check_creds),
+):
+    try:
+        stacks = await profiling.sample_stacks(
+            seconds, interval=interval, mode=mode, include_idle=include_idle
+        )
+    except profiling.ProfilerBusy:
+        raise HTTPException(status.HTTP_409_CONFLICT, "profiler is busy")
+    return profiling.format_collapsed(stacks)
+
+
+@app.get("/profile/calls/", response_class=PlainTextResponse)
+async def profile_calls(
+    seconds: float = Query(10, gt=0, le=profiling.MAX_SECONDS),
+    sort: str = Query("cumulative", regex=f"^({'|'.join(profiling.SORT_KEYS)})$"),
+    limit: int = 50,
+    credentials: HTTPBasicCredentials = Depends(check_creds),
+):
+    try:
+        return await profiling.profile_calls(seconds, sort=sort, limit=limit)
+    except profiling.ProfilerBusy:
+        raise HTTPException(status.HTTP_409_CONFLICT, "profiler is busy")
+
+
+@app.get("/profile/memory/", response_class=PlainTextResponse)
+async def profile_memory(
+    seconds: float = Query(30, gt=0, le=profiling.MAX_SECONDS),
+    limit: int = 200,
+    credentials: HTTPBasicCredentials = Depends(check_creds),
+):
+    try:
+        stacks = await profiling.memory_growth(seconds, limit=limit)
+    except profiling.ProfilerBusy:
+        raise HTTPException(status.HTTP_409_CONFLICT, "profiler is busy")
+    return profiling.format_collapsed(stacks)
+
+
+@app.get("/stats/loop/")
+async def get_loop_stats(credentials: HTTPBasicCredentials = Depends(check_creds)):
+    return LOOP_MONITOR.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/telegram/webhook/")
 async def get_telegram_webhook(
     credentials: HTTPBasicCredentials = Depends(check_creds),
@@ -108,11 +221,51 @@ async def set_telegram_webhook(
     return {"ok": result}
 
 
+@app.post("/broadcast/")
+async def start_broadcast(
+    request: BroadcastRequest,
+    credentials: HTTPBasicCredentials = Depends(check_creds),
+):
+    broadcast_id = broadcaster.start(text=request.text, parse_mode=request.parse_mode)
+    return {"ok": True, "broadcast_id": broadcast_id}
+
+
+@app.get("/broadcast/{broadcast_id}/")
+async def get_broadcast(
+    broadcast_id: str, credentials: HTTPBasicCredentials = Depends(check_creds)
+):
+    try:
+        broadcast = await broadcaster.load(broadcast_id)
+    except BroadcastNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return {
+        **broadcast.dict(exclude={"page_done"}),
+        "running": broadcaster.is_running(broadcast_id),
+        "throughput": broadcast.throughput,
+    }
+
+
+@app.post("/broadcast/{broadcast_id}/resume/")
+async def resume_broadcast(
+    broadcast_id: str, credentials: HTTPBasicCredentials = Depends(check_creds)
+):
+    try:
+        await broadcaster.load(broadcast_id)
+    except BroadcastNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    broadcaster.resume(broadcast_id)
+    return {"ok": True, "broadcast_id": broadcast_id}
+
+
 @app.on_event("shutdown")
 async def on_shutdown():
     bot = Bot.get_current()
     dp = Dispatcher.get_current()
     await close_bot(bot=bot, dp=dp)
+    await broadcaster.checkpoints.close()
+    await LOOP_MONITOR.stop()
 
 
 if __name__ == "__main__":
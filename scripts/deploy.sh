@@ -13,3 +13,35 @@ gcloud functions deploy cost-my-chemo-bot \
     --min-instances=0 \
     --max-instances=10 \
     --memory=200Mi
+
+# Leads queued by the webhook are delivered to Bitrix by a second function,
+# called every minute. One instance, so a lead is never sent twice at once.
+gcloud functions deploy cost-my-chemo-bot-leads \
+    --project=cost-my-chemo-bot \
+    --gen2 \
+    --runtime=python310 \
+    --region=europe-west1 \
+    --source=. \
+    --entry-point=deliver_leads \
+    --trigger-http \
+    --no-allow-unauthenticated \
+    --env-vars-file=cloud_env.yaml \
+    --min-instances=0 \
+    --max-instances=1 \
+    --memory=200Mi
+
+SCHEDULER_ACCOUNT=${SCHEDULER_ACCOUNT:-"$(gcloud projects describe cost-my-chemo-bot --format="value(projectNumber)")-compute@developer.gserviceaccount.com"}
+gcloud functions add-invoker-policy-binding cost-my-chemo-bot-leads \
+    --project=cost-my-chemo-bot \
+    --region=europe-west1 \
+    --member="serviceAccount:${SCHEDULER_ACCOUNT}"
+LEADS_JOB=(
+    deliver-leads
+    --project=cost-my-chemo-bot
+    --location=europe-west1
+    --schedule="* * * * *"
+    --uri="$(gcloud functions describe cost-my-chemo-bot-leads --project cost-my-chemo-bot --region=europe-west1 --format="value(serviceConfig.uri)")"
+    --http-method=POST
+    --oidc-service-account-email="${SCHEDULER_ACCOUNT}"
+)
+gcloud scheduler jobs update http "${LEADS_JOB[@]}" || gcloud scheduler jobs create http "${LEADS_JOB[@]}"
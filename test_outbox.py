@@ -0,0 +1,57 @@
+import asyncio
+import pathlib
+import tempfile
+import time
+
+import httpx
+
+# Sets fake credentials before settings are read.
+import benchmarks  # noqa: F401
+from cost_my_chemo_bot.bitrix import Bitrix
+from cost_my_chemo_bot.outbox import FileLeadOutbox, LeadOutboxWorker
+
+MAX_ATTEMPTS = 3
+
+
+def unreachable(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError("connection refused", request=request)
+
+
+async def deliver_to_unreachable_bitrix(directory: pathlib.Path) -> None:
+    bitrix = Bitrix()
+    bitrix.client = httpx.AsyncClient(
+        base_url="http://bitrix", transport=httpx.MockTransport(unreachable)
+    )
+    outbox = FileLeadOutbox(directory)
+    worker = LeadOutboxWorker(
+        outbox=outbox, bitrix=bitrix, max_attempts=MAX_ATTEMPTS, backoff_base=5
+    )
+    lead = await worker.enqueue({"TITLE": "lead"})
+
+    backoff = 0.0
+    for attempt in range(1, MAX_ATTEMPTS):
+        started = time.time()
+        assert await worker.flush() == 0
+        [lead] = await outbox.pending()
+        assert lead.attempts == attempt
+        assert "ConnectError" in lead.last_error
+        assert lead.next_attempt_at - started > backoff
+        backoff = lead.next_attempt_at - started
+
+        # Not due until the backoff is over.
+        assert await outbox.due(limit=1) == []
+        lead.next_attempt_at = 0
+        await outbox.put(lead)
+
+    assert await worker.flush() == 0
+    assert await outbox.pending() == []
+    [dead] = await outbox.dead()
+    assert dead.id == lead.id
+    assert dead.attempts == MAX_ATTEMPTS
+    assert (worker.retried, worker.buried) == (MAX_ATTEMPTS - 1, 1)
+    await bitrix.client.aclose()
+
+
+def test_unreachable_bitrix_is_retried_then_buried():
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(deliver_to_unreachable_bitrix(pathlib.Path(directory)))
@@ -0,0 +1,113 @@
+import asyncio
+import gzip
+import pathlib
+import random
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.webhook import SendMessage
+
+from benchmarks.funnel import (
+    callback_update,
+    funnel_steps,
+    load_catalog,
+    message_update,
+)
+from benchmarks.standins import (
+    BitrixStandIn,
+    OneCStandIn,
+    StandInBot,
+    install_http_standins,
+    make_catalog,
+)
+from cost_my_chemo_bot.bots.telegram.dispatcher import feed_update, make_dispatcher
+from cost_my_chemo_bot.bots.telegram.handlers import init_handlers
+from cost_my_chemo_bot.bots.telegram.recorder import RecordingMiddleware, UpdateRecorder
+from cost_my_chemo_bot.db import DB
+
+USER_ID = 424242
+CONTACTS = {
+    "first_name": "Зинаида",
+    "last_name": "Прокофьева",
+    "email": "zinaida.prokofieva@example.org",
+    "phone_number": "+7 912 345 67 89",
+}
+# Contacts as the bot may render them back.
+LEAKS = [*CONTACTS.values(), "9123456789", "912 345"]
+
+
+def edited_message_update(user_id: int, text: str) -> types.Update:
+    return types.Update(
+        update_id=int(time.time() * 1000),
+        edited_message={
+            "message_id": 1,
+            "date": int(time.time()),
+            "edit_date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "text": text,
+        },
+    )
+
+
+def reply_text(results: list) -> str | None:
+    # Handlers answer with webhook responses or with sent messages.
+    for result in results:
+        if isinstance(result, (SendMessage, types.Message)):
+            return result.text
+    return None
+
+
+async def record_funnel(directory: pathlib.Path) -> list[str]:
+    install_http_standins(OneCStandIn(make_catalog(courses=50)), BitrixStandIn())
+    bot = StandInBot()
+    dp = make_dispatcher(bot, storage=MemoryStorage())
+    recorder = UpdateRecorder(directory=directory)
+    dp.middleware.setup(RecordingMiddleware(recorder))
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await load_catalog()
+    init_handlers(dp)
+
+    bot_texts = []
+    last_text = "..."
+    steps = funnel_steps(USER_ID, random.Random(0), DB().courses)
+    for step, make_update in steps:
+        if step in CONTACTS:
+            update = message_update(USER_ID, CONTACTS[step])
+        else:
+            update = make_update()
+        if update.callback_query is not None:
+            # The message the button was under, as Telegram sends it.
+            data = update.to_python()
+            data["callback_query"]["message"]["text"] = last_text
+            update = types.Update(**data)
+        last_text = reply_text(await feed_update(dp, update)) or last_text
+        bot_texts.append(last_text)
+
+        if step == "email":
+            # Edited in a contact state and after the funnel.
+            await feed_update(dp, edited_message_update(USER_ID, CONTACTS["email"]))
+    await feed_update(dp, edited_message_update(USER_ID, CONTACTS["phone_number"]))
+
+    recorder.close()
+    await dp.storage.close()
+    return bot_texts
+
+
+def test_recording_has_no_contacts():
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        bot_texts = asyncio.run(record_funnel(directory))
+        recorded = "".join(
+            gzip.open(path, "rt", encoding="utf-8").read()
+            for path in sorted(directory.glob("*.jsonl.gz"))
+        )
+
+    # Otherwise there's nothing to leak.
+    assert any(CONTACTS["email"] in text for text in bot_texts)
+    assert recorded.count("\n") == 16
+    for value in LEAKS:
+        assert value not in recorded, value